@@ -1,21 +1,56 @@
-import random
+import argparse
+import os
+import sys
 import time
 import tkinter as tk
 import ttkbootstrap as tb
-import fluidsynth
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fluid_driver import DriverConfig, start_synth as start_fluidsynth
+from synth_worker import SynthProcess, default_device
+from seeding import make_rng
+
 
 # ===============================
 # 🎸 FluidSynth初期化
 # ===============================
-sf = fluidsynth.Synth()
-sf.start(driver="dsound")
+class InProcessSynth:
+    """
+    GUI と同じプロセスで FluidSynth のドライバを動かす。
+    ドライバ・バッファなどは DriverConfig（--driver alsa --period-size 128 など）で選ぶ。
+    """
+
+    def __init__(self, config):
+        # アコースティックギター（MIDI楽器番号25）
+        self.sf, self.driver = start_fluidsynth(config, program=25)
+        print("FluidSynth:", config.describe(self.driver))
+
+    def note_on(self, note, vel=100, channel=0, scheduled=None):
+        self.sf.noteon(channel, note, vel)
 
-# ▼ ここを自分の SoundFont ファイルのパスに変更してください！
-soundfont_path = "C:/Users/kxiyt/Documents/GitHub/gitar_ai/GuitarA.sf2"
-sf.load_soundfont(soundfont_path)
+    def note_off(self, note, vel=0, channel=0, scheduled=None):
+        self.sf.noteoff(channel, note)
 
-# アコースティックギター（MIDI楽器番号25）
-sf.program_select(0, 0, 0, 25)
+    def close(self):
+        self.sf.delete()
+
+
+def start_synth(config, in_process=False):
+    """
+    合成は別プロセスで行い、GUI が固まっても音が途切れないようにする（synth_worker.py）。
+    出力に使う sounddevice がないか in_process なら、同じプロセスで FluidSynth のドライバから鳴らす。
+    別プロセスのときは --period-size をブロック長に、period-size * periods を sounddevice の
+    出力バッファに、--polyphony と gain を合成エンジンに渡す。--driver / --device は
+    FluidSynth のドライバの設定なので --in-process のときだけ効く。
+    """
+    if not in_process and default_device() != "null":
+        if config.driver != "auto" or config.device:
+            print("warning: --driver/--device only apply with --in-process; "
+                  "the synth worker plays through sounddevice's default output")
+        return SynthProcess(config.soundfont, sample_rate=config.sample_rate, block_size=config.period_size,
+                            program=25, polyphony=config.polyphony, gain=config.gain,
+                            output_latency=config.latency())
+    return InProcessSynth(config)
 
 # ===============================
 # 🎶 コード定義（ピッチ: MIDIノート番号）
@@ -39,48 +74,65 @@ def play_chord(chord_name, duration=1.0):
 
     notes = CHORDS[chord_name]
     for n in notes:
-        sf.noteon(0, n, 100)
+        synth.note_on(n, 100)
     time.sleep(duration)
     for n in notes:
-        sf.noteoff(0, n)
+        synth.note_off(n)
 
 # ===============================
 # 🎼 コード進行を自動生成
 # ===============================
-def generate_progression():
-    """4つのコードからなる進行を生成"""
-    chord_list = random.sample(list(CHORDS.keys()), 4)
-    progression_label.config(text=" - ".join(chord_list))
+def generate_progression(seed=None):
+    """4つのコードからなる進行を生成（seed を指定すると同じ進行を再現）"""
+    rng, seed = make_rng(seed)
+    chord_list = rng.sample(list(CHORDS.keys()), 4)
+    progression_label.config(text=" - ".join(chord_list) + f"\n(seed {seed})")
 
     # 順に鳴らす
     root.update()
     for c in chord_list:
         play_chord(c, duration=1.2)
 
-# ===============================
-# 🎨 GUI（tkinter + ttkbootstrap）
-# ===============================
-root = tb.Window(themename="minty")
-root.title("🎸 Guitar Progression Generator")
-root.geometry("500x300")
-
-title_label = tb.Label(root, text="🎶 Guitar Chord Progression Generator 🎶", font=("Segoe UI", 16, "bold"))
-title_label.pack(pady=20)
-
-progression_label = tb.Label(root, text="Press the button to generate chords", font=("Segoe UI", 14))
-progression_label.pack(pady=20)
-
-generate_button = tb.Button(
-    root,
-    text="🎸 Generate Progression 🎸",
-    bootstyle="info-outline",
-    width=25,
-    command=generate_progression,
-    padding=(12, 12)
-)
-generate_button.pack(pady=20)
-
-root.mainloop()
-
-# 終了時にサウンドエンジンを停止
-sf.delete()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Guitar Progression Generator")
+    DriverConfig.add_arguments(parser)
+    parser.add_argument("--in-process", action="store_true",
+                        help="run FluidSynth with its own audio driver in this process")
+    args = parser.parse_args()
+
+    # 合成プロセスは spawn で起動するので、GUI はここでだけ作る
+    # SoundFont の既定は同じフォルダの GuitarA.sf2（GUITAR_SOUNDFONT / --soundfont で変更）
+    try:
+        config = DriverConfig.from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    synth = start_synth(config, args.in_process)
+
+    # ===============================
+    # 🎨 GUI（tkinter + ttkbootstrap）
+    # ===============================
+    root = tb.Window(themename="minty")
+    root.title("🎸 Guitar Progression Generator")
+    root.geometry("500x300")
+
+    title_label = tb.Label(root, text="🎶 Guitar Chord Progression Generator 🎶", font=("Segoe UI", 16, "bold"))
+    title_label.pack(pady=20)
+
+    progression_label = tb.Label(root, text="Press the button to generate chords", font=("Segoe UI", 14))
+    progression_label.pack(pady=20)
+
+    generate_button = tb.Button(
+        root,
+        text="🎸 Generate Progression 🎸",
+        bootstyle="info-outline",
+        width=25,
+        command=generate_progression,
+        padding=(12, 12)
+    )
+    generate_button.pack(pady=20)
+
+    try:
+        root.mainloop()
+    finally:
+        # 終了時にサウンドエンジンを停止
+        synth.close()
@@ -0,0 +1,195 @@
+# analysis.py
+# コード名の進行 -> 調とローマ数字（chord_to_midi_notes の逆方向）。
+# 大量の進行をまとめて NumPy で処理する:
+#   1. 各進行をコードIDの出現数 (N, コード数) にする（コードIDの表からピッチクラスのヒストグラムになる）
+#   2. DIATONIC_MAJOR の全キーのプロファイル (12, K) と1回の行列積でスコアを出す
+#   3. 各コードの度数を (K, コード数) の表から引き、ROMAN_TO_INDEX と同じ表記で返す
+import sys
+import time
+
+import numpy as np
+
+from compact import CHORD_NAMES, chord_id
+from midi_import import DEGREE_ROMANS
+
+# 音階外の音（どのダイアトニックコードにも含まれない音）への減点
+OUT_OF_KEY_WEIGHT = -2.0
+# 主音（そのキーの I のルート）をルートに持つコード・最初のコードが主音、への加点
+TONIC_WEIGHT = 1.0
+FIRST_CHORD_WEIGHT = 0.6
+# F# と Gb のような異名同音のキーを、コード名の綴りで決めるための小さな加点
+SPELLING_WEIGHT = 0.01
+
+
+class KeyAnalyzer:
+    """
+    diatonic: DIATONIC_MAJOR と同じ形 {key: [7つのコード名]}
+    voicing:  chord_to_midi_notes（コード名 -> MIDIノート）
+    """
+
+    def __init__(self, diatonic, voicing):
+        self.keys = list(diatonic)
+        self.diatonic = {k: list(v) for k, v in diatonic.items()}
+        self.voicing = voicing
+        self.tonic_pc = np.array([voicing(chords[0])[0] % 12 for chords in diatonic.values()])
+        # キーのプロファイル: そのキーのダイアトニックコードに含まれる回数（音階外は減点）。
+        # 音階は7つのコードのルートから取る（chord_to_midi_notes は dim を短3和音で返すため、
+        # 構成音から取ると vii° の5度が音階外の音になってしまう）
+        profile = np.zeros((12, len(self.keys)), dtype=np.float32)
+        for k, chords in enumerate(diatonic.values()):
+            scale = {voicing(c)[0] % 12 for c in chords}
+            for c in chords:
+                for n in set(x % 12 for x in voicing(c)) & scale:
+                    profile[n, k] += 1.0
+            for n in set(range(12)) - scale:
+                profile[n, k] = OUT_OF_KEY_WEIGHT
+        self.profile = profile
+        self._size = 0
+        self._refresh_tables()
+
+    def _refresh_tables(self):
+        """コードIDごとの表（ピッチクラス、ルート、綴り、度数）を作り直す。"""
+        for chords in self.diatonic.values():
+            for c in chords:
+                chord_id(c)
+        n = len(CHORD_NAMES)
+        K = len(self.keys)
+        pcs = np.zeros((n, 12), dtype=np.float32)
+        roots = np.zeros(n, dtype=np.int64)
+        member = np.zeros((n, K), dtype=np.float32)
+        degree = np.full((K, n), -1, dtype=np.int8)
+        for cid, name in enumerate(CHORD_NAMES):
+            notes = self.voicing(name)
+            for x in set(x % 12 for x in notes):
+                pcs[cid, x] = 1.0
+            roots[cid] = notes[0] % 12 if notes else 0
+        seventh = np.array([name.endswith('7') for name in CHORD_NAMES], dtype=bool)
+        for k, chords in enumerate(self.diatonic.values()):
+            index = {c: d for d, c in enumerate(chords)}
+            for cid, name in enumerate(CHORD_NAMES):
+                # roman_to_chord と同じく、'7' 付きは元のコードの度数として扱う（V7 など）
+                d = index.get(name, index.get(name[:-1]) if seventh[cid] else None)
+                if d is not None:
+                    member[cid, k] = 1.0
+                    degree[k, cid] = d
+        self.chord_pcs = pcs
+        self.chord_roots = roots
+        self.member = member
+        self.degree = degree
+        self.seventh = seventh
+        self._size = n
+
+    def _ensure_tables(self):
+        if self._size != len(CHORD_NAMES):
+            self._refresh_tables()
+
+    # ---------- エンコード ----------
+    @staticmethod
+    def encode(progressions):
+        """
+        コード名リストの並び -> (ids, offsets)。ProgressionStore ならその配列をそのまま使う。
+        """
+        if hasattr(progressions, "chords") and hasattr(progressions, "offsets"):
+            return (np.frombuffer(progressions.chords, dtype=np.uint16).astype(np.int64),
+                    np.frombuffer(progressions.offsets, dtype=np.uint32).astype(np.int64))
+        ids = []
+        offsets = [0]
+        for prog in progressions:
+            ids.extend(chord_id(c) for c in prog)
+            offsets.append(len(ids))
+        return np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+    # ---------- 解析 ----------
+    def detect_keys(self, ids, offsets, chunk=65536):
+        """
+        各進行の最適なキーの番号（self.keys の添字）を返す。空の進行は -1。
+        ピッチクラスのヒストグラム H = counts @ chord_pcs に対して H @ profile を計算するが、
+        結合則で counts @ (chord_pcs @ profile) とまとめ、チャンクごとに1回の行列積で済ませる。
+        """
+        self._ensure_tables()
+        n = len(offsets) - 1
+        result = np.full(n, -1, dtype=np.int64)
+        C = self._size
+        is_tonic = self.chord_roots[:, None] == self.tonic_pc[None, :]
+        weights = (self.chord_pcs @ self.profile
+                   + TONIC_WEIGHT * is_tonic
+                   + SPELLING_WEIGHT * self.member).astype(np.float32)      # (C, K)
+        for r0 in range(0, n, chunk):
+            r1 = min(n, r0 + chunk)
+            a, b = offsets[r0], offsets[r1]
+            lengths = np.diff(offsets[r0:r1 + 1])
+            rows = np.repeat(np.arange(r1 - r0), lengths)
+            counts = np.bincount(rows * C + ids[a:b], minlength=(r1 - r0) * C)
+            scores = counts.reshape(r1 - r0, C).astype(np.float32) @ weights   # (rows, K)
+            nonempty = lengths > 0
+            first = ids[np.minimum(offsets[r0:r1], len(ids) - 1)] if len(ids) else np.zeros(r1 - r0, dtype=np.int64)
+            scores += FIRST_CHORD_WEIGHT * is_tonic[first]
+            best = scores.argmax(axis=1)
+            result[r0:r1] = np.where(nonempty, best, -1)
+        return result
+
+    def degrees(self, ids, offsets, key_idx):
+        """
+        各コードの度数（0..6、ダイアトニックでなければ -1）をフラットな配列で返す。
+        """
+        self._ensure_tables()
+        rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        k = key_idx[rows]
+        out = np.full(ids.shape, -1, dtype=np.int8)
+        ok = k >= 0
+        out[ok] = self.degree[k[ok], ids[ok]]
+        return out
+
+    def analyze(self, progressions):
+        """
+        まとめて解析し、[(key, [roman, ...]), ...] を返す。
+        ダイアトニックでないコードは None。
+        """
+        ids, offsets = self.encode(progressions)
+        key_idx = self.detect_keys(ids, offsets)
+        deg = self.degrees(ids, offsets, key_idx)
+        sev = self.seventh[ids]
+        out = []
+        for i in range(len(offsets) - 1):
+            a, b = offsets[i], offsets[i + 1]
+            key = self.keys[key_idx[i]] if key_idx[i] >= 0 else None
+            out.append((key, [(DEGREE_ROMANS[d] + ('7' if s7 else '')) if d >= 0 else None
+                              for d, s7 in zip(deg[a:b], sev[a:b])]))
+        return out
+
+
+def benchmark(n=1_000_000, bars=8):
+    """n 件の進行のキー推定と度数付けのスループット。"""
+    from theory import DIATONIC_MAJOR, COMMON_PATTERNS, roman_to_chord, chord_to_midi_notes
+
+    analyzer = KeyAnalyzer(DIATONIC_MAJOR, chord_to_midi_notes)
+    # 既知のキーで作った進行を並べ、正解率も見る
+    templates = []
+    for k_idx, key in enumerate(DIATONIC_MAJOR):
+        for patterns in COMMON_PATTERNS.values():
+            for p in patterns:
+                prog = [roman_to_chord(p[i % len(p)], key) for i in range(bars)]
+                templates.append((k_idx, [chord_id(c) for c in prog]))
+    rng = np.random.default_rng(0)
+    pick = rng.integers(0, len(templates), n)
+    table = np.array([t[1] for t in templates], dtype=np.int64)
+    truth = np.array([t[0] for t in templates], dtype=np.int64)[pick]
+    ids = table[pick].ravel()
+    offsets = np.arange(n + 1, dtype=np.int64) * bars
+    analyzer._ensure_tables()
+
+    t0 = time.perf_counter()
+    key_idx = analyzer.detect_keys(ids, offsets)
+    t1 = time.perf_counter()
+    analyzer.degrees(ids, offsets, key_idx)
+    t2 = time.perf_counter()
+    # 異名同音（F# / Gb）は同じ音なので一致扱い
+    same = analyzer.tonic_pc[key_idx] == analyzer.tonic_pc[truth]
+    print(f"progressions: {n:,} x {bars} bars")
+    print(f"key detection: {t1 - t0:.2f}s ({n / (t1 - t0):,.0f}/s)")
+    print(f"degrees      : {t2 - t1:.2f}s ({n / (t2 - t1):,.0f}/s)")
+    print(f"tonic agrees with generating key: {same.mean():.1%}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
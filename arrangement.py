@@ -0,0 +1,233 @@
+# arrangement.py
+# 進行を複数レーン（コード・ストローク・ベース・ドラム）のイベント列にコンパイルする。
+# 各レーンは時刻順のイベントリストを返し、heapq.merge で1本のストリームにまとめる。
+# イベント: (beat, kind, channel, note, velocity)
+#   beat は進行先頭からの拍数。kind は NOTE_OFF=0 / NOTE_ON=1 なので、
+#   同時刻では note_off が先に並ぶ（同じ音の鳴らし直しが正しく効く）。
+import heapq
+
+NOTE_OFF = 0
+NOTE_ON = 1
+
+# General MIDI のチャンネル10（0始まりで9）はドラム
+DRUM_CHANNEL = 9
+
+# GM ドラムのノート番号
+KICK = 36
+SNARE = 38
+CLOSED_HAT = 42
+
+
+# ---------- レーン ----------
+class BlockLane:
+    """
+    コードの全音を同時に鳴らし、次のコードまで伸ばす（従来の Block）。
+    legato=True なら前のコードとの差分だけを送る: 共通音（C→Am の C と E など）は
+    鳴らし直さずに伸ばし、消える音だけ note_off、新しい音だけ note_on する。
+    """
+
+    def __init__(self, channel=0, velocity=100, legato=False):
+        self.channel = channel
+        self.velocity = velocity
+        self.legato = legato
+
+    def events(self, progression, beats_per_chord, voicing):
+        if self.legato:
+            return self._legato_events(progression, beats_per_chord, voicing)
+        out = []
+        for i, chord in enumerate(progression):
+            start = i * beats_per_chord
+            notes = voicing(chord)
+            for n in notes:
+                out.append((start, NOTE_ON, self.channel, n, self.velocity))
+            for n in notes:
+                out.append((start + beats_per_chord, NOTE_OFF, self.channel, n, 0))
+        out.sort()
+        return out
+
+    def _legato_events(self, progression, beats_per_chord, voicing):
+        out = []
+        held = set()
+        for i, chord in enumerate(progression):
+            start = i * beats_per_chord
+            notes = set(voicing(chord))
+            for n in sorted(held - notes):
+                out.append((start, NOTE_OFF, self.channel, n, 0))
+            for n in sorted(notes - held):
+                out.append((start, NOTE_ON, self.channel, n, self.velocity))
+            held = notes
+        end = len(progression) * beats_per_chord
+        for n in sorted(held):
+            out.append((end, NOTE_OFF, self.channel, n, 0))
+        out.sort()
+        return out
+
+
+class ArpLane:
+    """コードの構成音を1音ずつ均等に並べる（従来の Arp）。gate は音価に対する発音長の割合。"""
+
+    def __init__(self, channel=0, velocity=100, gate=0.9):
+        self.channel = channel
+        self.velocity = velocity
+        self.gate = gate
+
+    def events(self, progression, beats_per_chord, voicing):
+        out = []
+        for i, chord in enumerate(progression):
+            start = i * beats_per_chord
+            notes = voicing(chord)
+            if not notes:
+                continue
+            step = beats_per_chord / len(notes)
+            for j, n in enumerate(notes):
+                t = start + j * step
+                out.append((t, NOTE_ON, self.channel, n, self.velocity))
+                out.append((t + step * self.gate, NOTE_OFF, self.channel, n, 0))
+        out.sort()
+        return out
+
+
+class StrumLane:
+    """
+    ストロークのリズムパターン。pattern は8分音符単位の文字列で、
+    'D' = ダウン（低音弦→高音弦）、'U' = アップ（高音弦→低音弦）、'-' = 休み。
+    string_offset は弦ごとのずれ（拍）。
+    """
+
+    def __init__(self, pattern="D-DU-UDU", channel=0, velocity=96, string_offset=0.02, octave_offset=-12):
+        self.pattern = pattern
+        self.channel = channel
+        self.velocity = velocity
+        self.string_offset = string_offset
+        self.octave_offset = octave_offset
+
+    def events(self, progression, beats_per_chord, voicing):
+        out = []
+        slot = 0.5  # 8分音符
+        steps = int(beats_per_chord / slot)
+        for i, chord in enumerate(progression):
+            start = i * beats_per_chord
+            notes = [n + self.octave_offset for n in voicing(chord)]
+            hits = [k for k in range(steps) if self.pattern[k % len(self.pattern)] in "DU"]
+            for h_idx, k in enumerate(hits):
+                t = start + k * slot
+                # 次のストロークまで（なければコードの終わりまで）伸ばす
+                end = start + hits[h_idx + 1] * slot if h_idx + 1 < len(hits) else start + beats_per_chord
+                up = self.pattern[k % len(self.pattern)] == "U"
+                order = list(reversed(notes)) if up else notes
+                vel = self.velocity - 12 if up else self.velocity
+                for s, n in enumerate(order):
+                    out.append((t + s * self.string_offset, NOTE_ON, self.channel, n, vel))
+                    out.append((end, NOTE_OFF, self.channel, n, 0))
+        out.sort()
+        return out
+
+
+class BassLane:
+    """各コードの1拍目にルート音（2オクターブ下）を鳴らす。"""
+
+    def __init__(self, channel=1, velocity=100, octave_offset=-24, length=0.95):
+        self.channel = channel
+        self.velocity = velocity
+        self.octave_offset = octave_offset
+        self.length = length
+
+    def events(self, progression, beats_per_chord, voicing):
+        out = []
+        for i, chord in enumerate(progression):
+            notes = voicing(chord)
+            if not notes:
+                continue
+            start = i * beats_per_chord
+            root = max(0, notes[0] + self.octave_offset)
+            out.append((start, NOTE_ON, self.channel, root, self.velocity))
+            out.append((start + beats_per_chord * self.length, NOTE_OFF, self.channel, root, 0))
+        out.sort()
+        return out
+
+
+class DrumLane:
+    """
+    GM ドラム。pattern は {ノート番号: 8分音符ごとのヒット文字列} で、
+    'X' = アクセント、'x' = 通常、'-' = 休み。
+    """
+
+    DEFAULT_PATTERN = {
+        KICK:       "x---x---",
+        SNARE:      "--x---x-",
+        CLOSED_HAT: "XxXxXxXx",
+    }
+
+    def __init__(self, pattern=None, channel=DRUM_CHANNEL, velocity=90, accent=20):
+        self.pattern = pattern or self.DEFAULT_PATTERN
+        self.channel = channel
+        self.velocity = velocity
+        self.accent = accent
+
+    def events(self, progression, beats_per_chord, voicing):
+        out = []
+        slot = 0.5
+        steps = int(beats_per_chord / slot)
+        total = len(progression) * steps
+        for k in range(total):
+            t = k * slot
+            for note, hits in self.pattern.items():
+                c = hits[k % len(hits)]
+                if c in "xX":
+                    vel = min(127, self.velocity + (self.accent if c == "X" else 0))
+                    out.append((t, NOTE_ON, self.channel, note, vel))
+                    out.append((t + slot * 0.5, NOTE_OFF, self.channel, note, 0))
+        out.sort()
+        return out
+
+
+# ---------- アレンジ定義 ----------
+# name -> (1コードあたりの拍数, レーンのリスト)
+ARRANGEMENTS = {
+    "Block": (2, [BlockLane()]),
+    "Legato": (2, [BlockLane(legato=True)]),
+    "Arp": (4, [ArpLane()]),
+    "Band": (4, [StrumLane(), BassLane(), DrumLane()]),
+}
+
+
+def compile_progression(progression, lanes, beats_per_chord, voicing):
+    """
+    全レーンのイベントを heapq.merge で時刻順の1本のストリームにする（遅延評価のイテレータ）。
+    レーンがいくつあってもスケジューラは1つで済む。
+    """
+    return heapq.merge(*(lane.events(progression, beats_per_chord, voicing) for lane in lanes))
+
+
+def lane_channels(lanes):
+    """停止時の all-notes-off 用に、使っているチャンネルを返す。"""
+    return sorted({lane.channel for lane in lanes})
+
+
+# ---------- ベンチマーク ----------
+def benchmark():
+    """
+    COMMON_PATTERNS × DIATONIC_MAJOR の全進行について、
+    Block と Legato のイベント数（MIDIメッセージ数）を比べる。
+    """
+    from theory import COMMON_PATTERNS, DIATONIC_MAJOR, roman_to_chord, chord_to_midi_notes
+
+    totals = {"Block": 0, "Legato": 0}
+    count = 0
+    for key in DIATONIC_MAJOR:
+        for style, patterns in COMMON_PATTERNS.items():
+            for pattern in patterns:
+                prog = [roman_to_chord(r, key) for r in pattern]
+                count += 1
+                for name in totals:
+                    beats_per_chord, lanes = ARRANGEMENTS[name]
+                    totals[name] += sum(1 for _ in compile_progression(prog, lanes, beats_per_chord, chord_to_midi_notes))
+    saved = 1.0 - totals["Legato"] / totals["Block"]
+    print(f"progressions: {count}")
+    print(f"Block events : {totals['Block']}")
+    print(f"Legato events: {totals['Legato']}  ({saved:.1%} fewer)")
+    return totals
+
+
+if __name__ == "__main__":
+    benchmark()
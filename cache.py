@@ -0,0 +1,258 @@
+# cache.py
+# 生成結果・ボイシング・レンダリング結果のキャッシュ（LRU）。
+# データテーブル（DIATONIC_MAJOR, CHORD_SHAPES など）が変わったら全体を無効化する。
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def table_fingerprint(*tables):
+    """テーブルの内容から短いハッシュを作る。内容が変われば値も変わる。"""
+    h = hashlib.sha256()
+    for t in tables:
+        h.update(json.dumps(t, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class LRUCache:
+    """
+    件数上限（max_entries）とバイト上限（max_bytes, sizeof で各値のサイズを測る）を持つ LRU。
+    disk_dir を指定すると、メモリから追い出された値も pickle でディスクに残る（2段目）。
+    ディスクは max_disk_bytes を超えたら、最後に使った時刻（mtime）が古いファイルから消す。
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None, disk_dir=None, max_disk_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda v: 0)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, _, size in self._disk_files())
+            self._prune_disk()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, name + ".pkl")
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                os.utime(path)      # 使った時刻を残す（_prune_disk は古いものから消す）
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            else:
+                with self.lock:
+                    self.disk_hits += 1
+                self._put_memory(key, value)
+                return value
+        with self.lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._put_memory(key, value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = os.path.getsize(tmp)
+                try:
+                    size -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(tmp, path)
+            except OSError as e:
+                print("cache disk write error:", e)
+                return
+            with self.lock:
+                self.disk_bytes += size
+            self._prune_disk()
+
+    def _disk_files(self):
+        """ディスク2段目の [(mtime, path, size), ...]。"""
+        out = []
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            return out
+        for name in names:
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, path, st.st_size))
+        return out
+
+    def _prune_disk(self):
+        """
+        max_disk_bytes を超えていたら mtime の古い順に消し、上限の 9 割まで減らす
+        （超えるたびにディレクトリを見直さないよう、少し余裕を作る）。
+        """
+        if self.max_disk_bytes is None or self.disk_bytes <= self.max_disk_bytes:
+            return
+        with self.disk_lock:
+            files = sorted(self._disk_files())
+            total = sum(size for _, _, size in files)
+            target = self.max_disk_bytes * 0.9
+            removed = 0
+            for _, path, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            with self.lock:
+                self.disk_bytes = total
+                self.disk_evictions += removed
+
+    def _put_memory(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.data:
+                self.nbytes -= self.sizeof(self.data.pop(key))
+            self.data[key] = value
+            self.nbytes += size
+            while self.data and (
+                (self.max_entries is not None and len(self.data) > self.max_entries)
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+            ):
+                _, old = self.data.popitem(last=False)
+                self.nbytes -= self.sizeof(old)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        sentinel = _MISSING
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.data),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_bytes": self.disk_bytes,
+            "disk_evictions": self.disk_evictions,
+        }
+
+
+_MISSING = object()
+_FINGERPRINT_RE = re.compile(r"[0-9a-f]{16}")
+
+
+class ResultCache:
+    """
+    アプリ用の階層キャッシュ。
+    - progressions: (key, style, bars, seed) -> コード名のタプル
+    - voicings:     chord -> (MIDIノート, シェイプ)
+    - texts:        (key, style, bars, seed) -> on_generate の表示テキスト
+    - renders:      任意のキー -> bytes（音声やMIDIのblob。synth.SampleBank の PCM など）。
+                    バイト数で上限、disk_dir があればディスク2段目（disk_dir/<fingerprint>/、
+                    max_disk_bytes まで）
+    tables_fn() が返すテーブルの fingerprint が変わったら全部捨てる（ディスクの古い fingerprint の
+    ディレクトリも消す。renders は使う側が参照を持たず、毎回 results.renders を引くこと）。
+    """
+
+    def __init__(self, tables_fn, disk_dir=None, max_render_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=512 * 1024 * 1024):
+        self.tables_fn = tables_fn
+        self.disk_dir = disk_dir
+        self.max_render_bytes = max_render_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.fingerprint = table_fingerprint(*tables_fn())
+        self._build()
+
+    def _build(self):
+        self.progressions = LRUCache(max_entries=4096)
+        self.voicings = LRUCache(max_entries=1024)
+        self.texts = LRUCache(max_entries=1024)
+        self.renders = self._make_renders()
+
+    def use_disk(self, disk_dir):
+        """renders のディスク2段目を disk_dir に置く（アプリの起動時に呼ぶ。メモリの中身は捨てる）。"""
+        self.disk_dir = disk_dir
+        self.renders = self._make_renders()
+
+    def _make_renders(self):
+        if not self.disk_dir:
+            return LRUCache(max_bytes=self.max_render_bytes, sizeof=len)
+        # 前のテーブルのレンダリングはもう引かれないので消す（table_fingerprint の形の名前だけ）
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if name != self.fingerprint and _FINGERPRINT_RE.fullmatch(name):
+                shutil.rmtree(os.path.join(self.disk_dir, name), ignore_errors=True)
+        return LRUCache(max_bytes=self.max_render_bytes, sizeof=len,
+                        disk_dir=os.path.join(self.disk_dir, self.fingerprint), max_disk_bytes=self.max_disk_bytes)
+
+    def validate(self):
+        """テーブルが変わっていれば無効化する。無効化したら True。"""
+        fp = table_fingerprint(*self.tables_fn())
+        if fp != self.fingerprint:
+            self.fingerprint = fp
+            self._build()
+            return True
+        return False
+
+    def invalidate(self):
+        self.fingerprint = table_fingerprint(*self.tables_fn())
+        self._build()
+
+    def stats(self):
+        return {
+            "progressions": self.progressions.stats(),
+            "voicings": self.voicings.stats(),
+            "texts": self.texts.stats(),
+            "renders": self.renders.stats(),
+        }
@@ -0,0 +1,294 @@
+# calibration.py
+# 出力デバイスごとの遅れ（送ってから音が出るまで）を測り、プロファイル（JSON）に保存する。
+# MidiManager.latencies に入れると、スケジューラは一番遅いデバイスの分だけ早めに送り、
+# 各デバイスの書き込みスレッドは「遅れの差」だけ待ってから送る。どの出力も同じ瞬間に鳴る。
+#
+# 測り方:
+#   - ループバック: 出力をケーブル/仮想ポートで入力へ戻し、note_on が戻ってくるまでの時間
+#   - FluidSynth: レンダリングしたサンプルの立ち上がり位置 + オーディオドライバのバッファ分
+#
+# python calibration.py --loopback OUT IN   実デバイスのループバックを測って保存
+# python calibration.py --fluidsynth [SF2] [OUT]
+#                                           FluidSynth（GuitarSound.py と同じ設定）を測り、MIDI 出力 OUT
+#                                           （番号か名前。省略時は名前に FLUID / Synth input を含む出力）の名前で保存
+# python calibration.py                     仮想デバイスで補正の前後を比べる
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+PROFILE_VERSION = 1
+# main_3.py が起動時に読むプロファイル
+LATENCY_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "latency_profile.json")
+
+
+class LatencyProfile:
+    """
+    デバイス名 -> 測定結果 の辞書を JSON で保存する。
+    デバイスIDは接続順で変わるので、名前で引く。
+    load は手で書き換えたり途中で切れたりしたファイルも読めるよう、latency が 0 以上の数でない
+    エントリを飛ばす（飛ばした名前は invalid に残る）。ファイル全体が壊れていれば ValueError。
+    """
+
+    def __init__(self, devices=None):
+        self.devices = dict(devices or {})
+        self.invalid = []
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: not a latency profile")
+        if data.get("version") != PROFILE_VERSION:
+            return cls()
+        devices = data.get("devices", {})
+        if not isinstance(devices, dict):
+            raise ValueError(f"{path}: 'devices' must be an object")
+        profile = cls()
+        for name, entry in devices.items():
+            latency = entry.get("latency") if isinstance(entry, dict) else None
+            if (isinstance(latency, (int, float)) and not isinstance(latency, bool)
+                    and math.isfinite(latency) and latency >= 0):
+                profile.devices[name] = entry
+            else:
+                profile.invalid.append(name)
+        return profile
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": PROFILE_VERSION, "devices": self.devices}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def set(self, name, latency, method, spread=0.0, samples=1):
+        self.devices[name] = {
+            "latency": latency,
+            "spread": spread,
+            "method": method,
+            "samples": samples,
+            "measured": time.time(),
+        }
+
+    def get(self, name, default=0.0):
+        entry = self.devices.get(name)
+        return entry["latency"] if entry else default
+
+    def latencies(self):
+        """MidiManager.latencies に入れる形 {名前: 秒}。"""
+        return {name: entry["latency"] for name, entry in self.devices.items()}
+
+
+# ---------- ループバック ----------
+def measure_loopback(backend, output_id, input_id, pings=16, note=60, channel=15,
+                     interval=0.05, timeout=1.0):
+    """
+    出力から note_on を送り、入力に戻ってくるまでの時間を pings 回測る。
+    (中央値, ばらつき(最大-最小), 成功回数) を秒で返す。1回も戻らなければ (None, None, 0)。
+    backend: pygame.midi か virtual_midi.VirtualMidi
+    """
+    out = backend.Output(output_id)
+    inp = backend.Input(input_id)
+    timed = hasattr(inp, "read_timed")
+    results = []
+    try:
+        # 前に溜まっていた分を捨てる
+        while inp.poll():
+            inp.read(64)
+        for _ in range(pings):
+            sent = time.perf_counter()
+            out.note_on(note, 1, channel)
+            arrived = None
+            while arrived is None and time.perf_counter() - sent < timeout:
+                if inp.poll():
+                    now = time.perf_counter()
+                    if timed:
+                        for t, status, d1, d2 in inp.read_timed(64):
+                            if status & 0xF0 == 0x90 and d1 == note and arrived is None:
+                                arrived = t
+                    else:
+                        for (status, d1, d2, _), _ts in inp.read(64):
+                            if status & 0xF0 == 0x90 and d1 == note and arrived is None:
+                                arrived = now
+            out.note_off(note, 0, channel)
+            if arrived is not None:
+                results.append(arrived - sent)
+            time.sleep(interval)
+    finally:
+        out.close()
+        inp.close()
+    if not results:
+        return None, None, 0
+    return statistics.median(results), max(results) - min(results), len(results)
+
+
+# ---------- FluidSynth ----------
+def onset_delay(samples, sample_rate, threshold=0.05):
+    """
+    レンダリングしたPCM（int16、ステレオなら交互）で、最大振幅の threshold 倍を
+    初めて超える位置までの秒数。
+    """
+    x = np.abs(np.asarray(samples, dtype=np.float32))
+    if x.size == 0 or not x.max():
+        return 0.0
+    first = int(np.argmax(x >= x.max() * threshold))
+    channels = 2 if x.size % 2 == 0 else 1
+    return (first // channels) / sample_rate
+
+
+def measure_fluidsynth(soundfont, sample_rate=44100, period_size=64, periods=16,
+                       program=25, note=60, trials=5):
+    """
+    FluidSynth の遅れ = ドライバのバッファ（period_size * periods サンプル）+ 音の立ち上がり。
+    オーディオドライバは起動せず、get_samples でレンダリングしたサンプルから測る。
+    (遅れ, ばらつき, 回数) を秒で返す。
+    """
+    import fluidsynth
+
+    synth = fluidsynth.Synth(samplerate=float(sample_rate))
+    try:
+        sfid = synth.sfload(soundfont)
+        if sfid < 0:
+            raise RuntimeError(f"cannot load soundfont: {soundfont}")
+        synth.program_select(0, sfid, 0, program)
+        buffering = period_size * periods / sample_rate
+        onsets = []
+        for _ in range(trials):
+            synth.noteon(0, note, 100)
+            onsets.append(onset_delay(synth.get_samples(int(sample_rate * 0.2)), sample_rate))
+            synth.noteoff(0, note)
+            synth.get_samples(int(sample_rate * 0.5))
+    finally:
+        synth.delete()
+    return buffering + statistics.median(onsets), max(onsets) - min(onsets), len(onsets)
+
+
+def output_name(backend, device_id):
+    name = backend.get_device_info(device_id)[1]
+    return name.decode("utf-8") if isinstance(name, bytes) else str(name)
+
+
+def fluidsynth_outputs(backend, wanted=None):
+    """
+    FluidSynth の MIDI 入力ポートに当たる出力の名前（MidiManager.latencies のキーになる）。
+    wanted は出力の番号か名前。省略時は FluidSynth らしい名前の出力を全部返す。
+    """
+    names = []
+    for i in range(backend.get_count()):
+        if not backend.get_device_info(i)[3]:
+            continue
+        name = output_name(backend, i)
+        if wanted is None:
+            if "fluid" in name.lower() or name.startswith("Synth input port"):
+                names.append(name)
+        elif wanted == str(i) or wanted == name:
+            names.append(name)
+    return names
+
+
+def calibrate_loopbacks(backend, pairs, profile, pings=16):
+    """
+    pairs: [(出力ID, 入力ID), ...]。測った出力の名前で profile に保存し、結果を返す。
+    """
+    results = {}
+    for out_id, in_id in pairs:
+        name = output_name(backend, out_id)
+        latency, spread, n = measure_loopback(backend, out_id, in_id, pings=pings)
+        if latency is None:
+            print(f"{name}: no loopback response")
+            continue
+        profile.set(name, latency, "loopback", spread, n)
+        results[name] = latency
+    return results
+
+
+# ---------- ベンチマーク ----------
+def benchmark():
+    """
+    遅れの違う仮想デバイス3台をループバックで測り、Band を補正なし/ありで流して、
+    同じイベントが各デバイスで鳴る時刻のずれ（最大 - 最小）を比べる。
+    """
+    import random
+    import threading
+    from playback import MidiManager, play_progression
+    from theory import generate_progression
+    from virtual_midi import VirtualMidi
+
+    ports = {"USB": {"latency": 0.004}, "SoftSynth": {"latency": 0.035}, "FluidSynth": {"latency": 0.023}}
+    prog = generate_progression('C', 'Pop', 4, rng=random.Random(1))
+
+    backend = VirtualMidi(ports)
+    profile = LatencyProfile()
+    measured = calibrate_loopbacks(backend, [(0, 1), (2, 3), (4, 5)], profile)
+    for name, latency in measured.items():
+        print(f"{name:10s} measured {latency * 1000:6.2f} ms (true {ports[name]['latency'] * 1000:.2f} ms)")
+
+    for label, latencies in (("uncompensated", {}), ("compensated", profile.latencies())):
+        backend = VirtualMidi(ports)
+        mm = MidiManager(backend=backend)
+        mm.latencies = latencies
+        mm.open_outputs([0, 2, 4])
+        flag = threading.Event()
+        flag.set()
+        play_progression(prog, 120, "Band", False, mm, flag)
+        mm.close()
+        # 各ポートの note_on の到着時刻を順に並べ、同じ順番同士でずれを取る
+        arrivals = [[t for (t, status, d1, d2) in backend.port(i).inbox if status & 0xF0 == 0x90]
+                    for i in (0, 2, 4)]
+        n = min(len(a) for a in arrivals)
+        spread = [max(a[k] for a in arrivals) - min(a[k] for a in arrivals) for k in range(n)]
+        print(f"{label:14s} events={n:4d} spread mean={statistics.fmean(spread) * 1000:6.2f} ms "
+              f"max={max(spread) * 1000:6.2f} ms")
+
+
+def main(argv):
+    if not argv:
+        benchmark()
+        return
+    profile = LatencyProfile.load(LATENCY_PROFILE_PATH)
+    if argv[0] == "--loopback" and len(argv) >= 3:
+        import pygame.midi
+        pygame.midi.init()
+        try:
+            for name, latency in calibrate_loopbacks(pygame.midi, [(int(argv[1]), int(argv[2]))], profile).items():
+                print(f"{name}: {latency * 1000:.2f} ms")
+        finally:
+            pygame.midi.quit()
+    elif argv[0] == "--fluidsynth":
+        # GUITAR_PERIOD_SIZE などの環境変数で GuitarSound.py と同じバッファ設定にする
+        from fluid_driver import DriverConfig
+        try:
+            config = DriverConfig.from_env()
+        except ValueError as e:
+            print("error:", e)
+            return
+        soundfont = argv[1] if len(argv) > 1 else config.soundfont
+        # MidiManager.latencies は MIDI 出力の名前で引くので、FluidSynth のポート名で保存する
+        import pygame.midi
+        pygame.midi.init()
+        try:
+            names = fluidsynth_outputs(pygame.midi, argv[2] if len(argv) > 2 else None)
+        finally:
+            pygame.midi.quit()
+        if not names:
+            print("no FluidSynth MIDI output found; start FluidSynth or pass the output: --fluidsynth SF2 OUT")
+            return
+        latency, spread, n = measure_fluidsynth(soundfont, config.sample_rate, config.period_size, config.periods)
+        for name in names:
+            profile.set(name, latency, "fluidsynth", spread, n)
+            print(f"{name}: {latency * 1000:.2f} ms")
+    else:
+        print("usage: calibration.py [--loopback OUT IN | --fluidsynth [SF2] [OUT]]")
+        return
+    profile.save(LATENCY_PROFILE_PATH)
+    print("saved", LATENCY_PROFILE_PATH)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,240 @@
+# capo.py
+# カポとチューニングの提案。
+# Eb / Ab / F# などのキーでは CHORD_SHAPES にないコードばかりになるので、
+# カポ 0〜11 と別チューニングのすべての組み合わせで「押さえる形」に移調し、難しさの合計が
+# 一番小さいものを選ぶ。
+#
+# コードは (ルートのピッチクラス, 種類) に分解し、形の難しさを (チューニング, ピッチクラス, 種類) の
+# 表に入れておく。カポ c・チューニングのずれ t で鳴らすとき、押さえる形のルートは (root - c - t) % 12
+# なので、全カポ x 全チューニング x 全コードの難しさは表を1回引くだけで出る（NumPy）。
+# 進行ごとの合計は np.add.reduceat でまとめる。
+import sys
+import time
+
+import numpy as np
+
+PC_OF = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+SHARP_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# 押さえる形が見つからないコード1つあたりの難しさ
+MISSING = 20.0
+# カポ1フレットごと・チューニングを変えることへの減点（同点ならカポなし・標準を選ぶ）。
+# HIGH_CAPO より上はフレットが狭くて弾きにくいので大きく減点する
+CAPO_WEIGHT = 0.15
+HIGH_CAPO = 7
+HIGH_CAPO_WEIGHT = 2.0
+RETUNE_WEIGHT = 2.0
+
+# ドロップD（DADGBE）で弾きやすい形。ほかのコードは6弦を使わない標準の形がそのまま使える
+DROP_D_SHAPES = {
+    'D': '000232',
+    'Dm': '000231',
+    'D7': '000212',
+    'G': 'x20003',
+    'Em': '222000',
+    'E': '222100',
+}
+
+
+def split_chord(name):
+    """'F#m7' -> (6, 'm7')。ルートの綴り（F# / Gb / E#）によらずピッチクラスにする。"""
+    pc = PC_OF[name[0]]
+    i = 1
+    while i < len(name) and name[i] in '#b':
+        pc += 1 if name[i] == '#' else -1
+        i += 1
+    return pc % 12, name[i:]
+
+
+def shape_difficulty(shape):
+    """
+    'x32010' のような形の難しさ。押さえる指の数・フレットの幅・ハイポジション、
+    それにセーハ（同じフレットを人差し指で複数弦まとめて押さえる）に大きく減点する。
+    (難しさ, セーハかどうか) を返す。
+    """
+    frets = [int(c) for c in shape if c != 'x']
+    fretted = [f for f in frets if f > 0]
+    if not fretted:
+        return 0.5, False
+    lo = min(fretted)
+    # 開放弦があれば人差し指で寝かせる必要はない（A の x02220 は3本の指で押さえる）
+    barre = fretted.count(lo) >= 2 and 0 not in frets
+    fingers = len(fretted) - (fretted.count(lo) - 1 if barre else 0)
+    score = 0.5 * fingers + 0.5 * (max(fretted) - lo) + 0.2 * max(0, lo - 1)
+    if barre:
+        score += 3.0
+    return score, barre
+
+
+class CapoEngine:
+    """
+    tunings: {名前: (ずれ(半音), {コード名: 形})}
+      例: {"Standard": (0, CHORD_SHAPES), "Half-step down": (-1, CHORD_SHAPES)}
+    """
+
+    def __init__(self, tunings, capos=range(12)):
+        self.tuning_names = list(tunings)
+        self.capos = np.asarray(list(capos), dtype=np.int64)
+        self.qualities = []
+        self._quality_ids = {}
+        shapes = []
+        for name, (offset, table) in tunings.items():
+            for chord, shape in table.items():
+                pc, q = split_chord(chord)
+                shapes.append((name, offset, pc, self._quality(q), chord, shape))
+        T, Q = len(self.tuning_names), len(self.qualities) + 1    # 最後の種類は「形がない」
+        self.cost = np.full((T, 12, Q), MISSING, dtype=np.float32)
+        self.barre = np.zeros((T, 12, Q), dtype=np.int8)
+        self.missing = np.ones((T, 12, Q), dtype=np.int8)
+        self.played = {}
+        self.offsets = np.zeros(T, dtype=np.int64)
+        for name, offset, pc, q, chord, shape in shapes:
+            t = self.tuning_names.index(name)
+            self.offsets[t] = offset
+            score, barre = shape_difficulty(shape)
+            if score < self.cost[t, pc, q] or self.missing[t, pc, q]:
+                self.cost[t, pc, q] = score
+                self.barre[t, pc, q] = barre
+                self.missing[t, pc, q] = 0
+                self.played[(t, pc, q)] = (chord, shape)
+        # 行 = (チューニング, カポ) の全組み合わせ
+        self.row_tuning = np.repeat(np.arange(T), len(self.capos))
+        self.row_capo = np.tile(self.capos, T)
+        self.row_shift = self.row_capo + self.offsets[self.row_tuning]
+        self.row_penalty = (CAPO_WEIGHT * self.row_capo
+                            + HIGH_CAPO_WEIGHT * np.maximum(0, self.row_capo - HIGH_CAPO)
+                            + RETUNE_WEIGHT * (self.row_tuning != 0)).astype(np.float32)
+        self._chord_cache = {}
+
+    def _quality(self, q):
+        if q not in self._quality_ids:
+            self._quality_ids[q] = len(self.qualities)
+            self.qualities.append(q)
+        return self._quality_ids[q]
+
+    # ---------- エンコード ----------
+    def encode(self, progressions):
+        """コード名リストの並び -> (roots, qualities, offsets)。知らない種類は「形がない」扱い。"""
+        unknown = len(self.qualities)
+        roots, quals, offsets = [], [], [0]
+        cache = self._chord_cache
+        for prog in progressions:
+            for c in prog:
+                rq = cache.get(c)
+                if rq is None:
+                    pc, q = split_chord(c)
+                    rq = cache[c] = (pc, self._quality_ids.get(q, unknown))
+                roots.append(rq[0])
+                quals.append(rq[1])
+            offsets.append(len(roots))
+        return (np.asarray(roots, dtype=np.int64), np.asarray(quals, dtype=np.int64),
+                np.asarray(offsets, dtype=np.int64))
+
+    # ---------- 評価 ----------
+    def score_batch(self, roots, quals, offsets, chunk=8192):
+        """
+        すべての (チューニング, カポ) の行について、各進行の難しさ・セーハ数・形がない数を返す。
+        形は (行数, 進行数)。
+        """
+        R = len(self.row_shift)
+        n = len(offsets) - 1
+        cost = np.zeros((R, n), dtype=np.float32)
+        barre = np.zeros((R, n), dtype=np.int32)
+        missing = np.zeros((R, n), dtype=np.int32)
+        t = self.row_tuning[:, None]
+        for p0 in range(0, n, chunk):
+            p1 = min(n, p0 + chunk)
+            a, b = offsets[p0], offsets[p1]
+            lengths = np.diff(offsets[p0:p1 + 1])
+            keep = lengths > 0
+            if a == b:
+                continue
+            starts = (offsets[p0:p1] - a)[keep]
+            played = (roots[None, a:b] - self.row_shift[:, None]) % 12    # (R, chords)
+            q = quals[None, a:b]
+            cost[:, p0:p1][:, keep] = np.add.reduceat(self.cost[t, played, q], starts, axis=1)
+            barre[:, p0:p1][:, keep] = np.add.reduceat(self.barre[t, played, q].astype(np.int32), starts, axis=1)
+            missing[:, p0:p1][:, keep] = np.add.reduceat(self.missing[t, played, q].astype(np.int32), starts, axis=1)
+        return cost, barre, missing
+
+    def best(self, roots, quals, offsets):
+        """
+        各進行の一番よい (チューニング番号, カポ, 難しさ, セーハ数, 形がない数)。配列で返す。
+        """
+        cost, barre, missing = self.score_batch(roots, quals, offsets)
+        total = cost + self.row_penalty[:, None]
+        row = total.argmin(axis=0)
+        cols = np.arange(total.shape[1])
+        return (self.row_tuning[row], self.row_capo[row], cost[row, cols],
+                barre[row, cols], missing[row, cols])
+
+    def suggest(self, progression, top=3):
+        """
+        1つの進行の候補を良い順に top 件。
+        [{"tuning", "capo", "difficulty", "barres", "missing", "shapes": [(押さえるコード, 形), ...]}, ...]
+        """
+        roots, quals, offsets = self.encode([progression])
+        cost, barre, missing = self.score_batch(roots, quals, offsets)
+        total = cost[:, 0] + self.row_penalty
+        out = []
+        for row in np.argsort(total, kind="stable")[:top]:
+            t = int(self.row_tuning[row])
+            shift = int(self.row_shift[row])
+            shapes = []
+            for r, q in zip(roots, quals):
+                pc = (int(r) - shift) % 12
+                shapes.append(self.played.get((t, pc, int(q)), (SHARP_NAMES[pc] + "?", "N/A")))
+            out.append({
+                "tuning": self.tuning_names[t],
+                "capo": int(self.row_capo[row]),
+                "difficulty": float(cost[row, 0]),
+                "barres": int(barre[row, 0]),
+                "missing": int(missing[row, 0]),
+                "shapes": shapes,
+            })
+        return out
+
+
+def default_tunings(chord_shapes):
+    """標準・半音下げ・全音下げ・ドロップD。"""
+    drop_d = {c: s for c, s in chord_shapes.items() if s[0] == 'x'}
+    drop_d.update(DROP_D_SHAPES)
+    return {
+        "Standard": (0, chord_shapes),
+        "Half-step down": (-1, chord_shapes),
+        "Whole-step down": (-2, chord_shapes),
+        "Drop D": (0, drop_d),
+    }
+
+
+def benchmark(n=100_000, bars=8):
+    """n 件の進行（全キー・全スタイル）の提案にかかる時間と、N/A の減り方。"""
+    import random
+    from theory import DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, generate_progression
+
+    engine = CapoEngine(default_tunings(CHORD_SHAPES))
+    rng = random.Random(0)
+    keys = list(DIATONIC_MAJOR)
+    styles = list(COMMON_PATTERNS)
+    catalog = [generate_progression(rng.choice(keys), rng.choice(styles), bars, rng=rng) for _ in range(n)]
+
+    t0 = time.perf_counter()
+    roots, quals, offsets = engine.encode(catalog)
+    t1 = time.perf_counter()
+    tuning, capo, cost, barre, missing = engine.best(roots, quals, offsets)
+    t2 = time.perf_counter()
+
+    # 比較: カポなし・標準チューニング
+    base_missing = np.add.reduceat(engine.missing[0, roots, quals].astype(np.int32), offsets[:-1])
+    base_barre = np.add.reduceat(engine.barre[0, roots, quals].astype(np.int32), offsets[:-1])
+    print(f"progressions: {n:,} x {bars} bars, rows (tuning x capo): {len(engine.row_shift)}")
+    print(f"encode: {t1 - t0:.2f}s, score all capos/tunings: {t2 - t1:.2f}s ({n / (t2 - t1):,.0f}/s)")
+    print(f"chords without a shape: capo 0 standard {base_missing.sum() / (n * bars):.1%} -> suggested {missing.sum() / (n * bars):.1%}")
+    print(f"barre chords          : capo 0 standard {base_barre.sum() / (n * bars):.1%} -> suggested {barre.sum() / (n * bars):.1%}")
+    for t, name in enumerate(engine.tuning_names):
+        print(f"  {name:16s} chosen for {np.mean(tuning == t):.1%}")
+    print("example:", catalog[0], "->", engine.suggest(catalog[0], top=1)[0])
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
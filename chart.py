@@ -0,0 +1,303 @@
+# chart.py
+# 練習帳用のコード譜（コード表のダイアグラム + リードシート）を SVG / PNG で大量に書き出す。
+#
+# - コードダイアグラムは形（'x32010' など）ごとに1回だけ <symbol> を作ってキャッシュし（GlyphCache）、
+#   ページでは <use href="#..."> で参照するだけ。同じ形を何度描いても SVG の文字列は作り直さない
+# - ページは進行 PER_PAGE 個ぶんを1枚にまとめ、ワーカープロセスでページ単位に並列に書き出す
+#   （imap_unordered で終わった順に流す。進捗と pages/s を表示）
+# - PNG は cairosvg があるときだけ（なければ SVG のみ）
+#
+# python chart.py [-n N] [--library] [-o DIR] [-j WORKERS] [--png]
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
+
+PAGE_W, PAGE_H = 794, 1123          # A4, 96dpi
+MARGIN = 40
+PER_PAGE = 6
+BOX_W, BOX_H = 70, 92               # 1つのダイアグラムの枠（名前を含む）
+BOXES_PER_LINE = 10
+STRINGS = 6
+FRETS = 5
+MISSING = "missing"
+# ページでコード譜に使える高さ（下はページ番号の分あける）。1件の高さは最低でもこれを PER_PAGE で割った分
+BODY_H = PAGE_H - 2 * MARGIN - 20
+
+
+def glyph_id(shape):
+    return "s-" + shape
+
+
+class GlyphCache:
+    """
+    形 -> <symbol> の SVG 文字列。ワーカープロセスごとに1つ作り、同じ形は2回目から辞書を引くだけ。
+    """
+
+    def __init__(self):
+        self.symbols = {}
+        self.built = 0
+
+    def get(self, shape):
+        sym = self.symbols.get(shape)
+        if sym is None:
+            sym = self.symbols[shape] = chord_box_symbol(shape)
+            self.built += 1
+        return sym
+
+
+def chord_box_symbol(shape):
+    """
+    1つの押さえ方のダイアグラム（6弦・5フレット、×/○、押さえる位置、ハイポジションならフレット番号）。
+    shape は 6弦 -> 1弦 の順の文字列。MISSING なら「?」の枠。
+    """
+    x0, y0, sx, sy = 14, 18, 9, 12
+    w, h = sx * (STRINGS - 1), sy * FRETS
+    parts = [f'<symbol id="{glyph_id(shape)}" viewBox="0 0 {BOX_W} {BOX_H - 16}">']
+    if shape == MISSING or len(shape) != STRINGS:
+        parts.append(f'<rect x="{x0}" y="{y0}" width="{w}" height="{h}" fill="none" stroke="#999" stroke-dasharray="3,2"/>')
+        parts.append(f'<text x="{x0 + w / 2}" y="{y0 + h / 2 + 5}" font-size="16" text-anchor="middle" fill="#999">?</text>')
+        parts.append("</symbol>")
+        return "".join(parts)
+    frets = [None if c in "xX" else int(c) for c in shape]
+    fretted = [f for f in frets if f]
+    base = 1
+    if fretted and max(fretted) > FRETS:
+        base = min(fretted)
+    # 弦とフレット
+    for s in range(STRINGS):
+        x = x0 + s * sx
+        parts.append(f'<line x1="{x}" y1="{y0}" x2="{x}" y2="{y0 + h}" stroke="#000" stroke-width="1"/>')
+    for f in range(FRETS + 1):
+        y = y0 + f * sy
+        width = 3 if f == 0 and base == 1 else 1
+        parts.append(f'<line x1="{x0}" y1="{y}" x2="{x0 + w}" y2="{y}" stroke="#000" stroke-width="{width}"/>')
+    if base > 1:
+        parts.append(f'<text x="{x0 + w + 4}" y="{y0 + sy - 2}" font-size="9">{base}fr</text>')
+    # セーハ: 開放弦がなく、一番低いフレットを複数弦で押さえるとき
+    if fretted and 0 not in frets and fretted.count(min(fretted)) >= 2:
+        low = min(fretted)
+        strings = [s for s, f in enumerate(frets) if f == low]
+        y = y0 + (low - base + 0.5) * sy
+        parts.append(f'<line x1="{x0 + strings[0] * sx}" y1="{y}" x2="{x0 + strings[-1] * sx}" y2="{y}" '
+                     f'stroke="#000" stroke-width="7" stroke-linecap="round"/>')
+    for s, f in enumerate(frets):
+        x = x0 + s * sx
+        if f is None:
+            parts.append(f'<text x="{x}" y="{y0 - 4}" font-size="9" text-anchor="middle">×</text>')
+        elif f == 0:
+            parts.append(f'<circle cx="{x}" cy="{y0 - 7}" r="3" fill="none" stroke="#000"/>')
+        else:
+            parts.append(f'<circle cx="{x}" cy="{y0 + (f - base + 0.5) * sy}" r="3.6" fill="#000"/>')
+    parts.append("</symbol>")
+    return "".join(parts)
+
+
+def row_height(chords):
+    """
+    1件（タイトル + リードシート + ダイアグラム）の高さ。ダイアグラムは BOXES_PER_LINE 個ごとに折り返すので、
+    コードの種類が多い進行は行が増えて高くなる。
+    """
+    lines = max(1, -(-len(set(chords)) // BOXES_PER_LINE))
+    return max(BODY_H / PER_PAGE, 40 + lines * BOX_H + 8)
+
+
+def render_page(entries, shapes, glyphs, page_no=None):
+    """
+    entries: [(タイトル, [コード名, ...]), ...]（iter_pages で区切った、BODY_H に収まる分）
+    shapes: {コード名: 形}（CHORD_SHAPES）
+    ページ1枚の SVG 文字列を返す。<defs> にはこのページで使う形だけを入れる。
+    """
+    used = {}
+    body = []
+    y = MARGIN
+    for title, chords in entries:
+        body.append(f'<text x="{MARGIN}" y="{y + 14}" font-size="13" font-weight="bold">{escape(title)}</text>')
+        # リードシート: 1小節1コード
+        lead = "| " + " | ".join(chords) + " |"
+        body.append(f'<text x="{MARGIN}" y="{y + 32}" font-size="12" font-family="monospace">{escape(lead)}</text>')
+        # ダイアグラムは進行に出てくる順に1回ずつ
+        seen = []
+        for c in chords:
+            if c not in seen:
+                seen.append(c)
+        for i, chord in enumerate(seen):
+            shape = shapes.get(chord) or MISSING
+            used[shape] = True
+            bx = MARGIN + (i % BOXES_PER_LINE) * BOX_W
+            by = y + 40 + (i // BOXES_PER_LINE) * BOX_H
+            body.append(f'<text x="{bx + BOX_W / 2 - 6}" y="{by + 10}" font-size="11" text-anchor="middle">{escape(chord)}</text>')
+            body.append(f'<use href="#{glyph_id(shape)}" x="{bx}" y="{by + 12}" width="{BOX_W}" height="{BOX_H - 16}"/>')
+        y += row_height(chords)
+    if page_no is not None:
+        body.append(f'<text x="{PAGE_W / 2}" y="{PAGE_H - 16}" font-size="10" text-anchor="middle">{page_no}</text>')
+    defs = "".join(glyphs.get(shape) for shape in used)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+            f'width="{PAGE_W}" height="{PAGE_H}" viewBox="0 0 {PAGE_W} {PAGE_H}" font-family="sans-serif">'
+            f'<rect width="100%" height="100%" fill="#fff"/><defs>{defs}</defs>{"".join(body)}</svg>')
+
+
+def entry_title(key, style, seed=None, prog_id=None):
+    title = f"Key {key} / {style}"
+    if seed is not None:
+        title += f" / seed {seed}"
+    if prog_id is not None:
+        title = f"#{prog_id}  " + title
+    return title
+
+
+# ---------- 並列書き出し ----------
+_worker = {}
+
+
+def _init_worker(shapes, out_dir, fmt):
+    _worker["shapes"] = shapes
+    _worker["glyphs"] = GlyphCache()
+    _worker["out_dir"] = out_dir
+    _worker["fmt"] = fmt
+
+
+def _write_page(job):
+    page_no, entries = job
+    svg = render_page(entries, _worker["shapes"], _worker["glyphs"], page_no)
+    base = os.path.join(_worker["out_dir"], f"page-{page_no:06d}")
+    if _worker["fmt"] == "png":
+        import cairosvg
+        cairosvg.svg2png(bytestring=svg.encode("utf-8"), write_to=base + ".png")
+        path = base + ".png"
+    else:
+        path = base + ".svg"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(svg)
+    return page_no, os.path.getsize(path)
+
+
+def iter_pages(entries, per_page=PER_PAGE):
+    """
+    (タイトル, コード列) の並びを (ページ番号, ページの中身) に区切る（ストリーミング）。
+    1ページは最大 per_page 件で、ダイアグラムが折り返す進行があれば高さ（row_height の合計）で先に改ページする。
+    """
+    page, used, page_no = [], 0.0, 1
+    for e in entries:
+        h = row_height(e[1])
+        if page and (len(page) == per_page or used + h > BODY_H + 1e-6):
+            yield page_no, page
+            page, used, page_no = [], 0.0, page_no + 1
+        page.append(e)
+        used += h
+    if page:
+        yield page_no, page
+
+
+def render_book(entries, shapes, out_dir, fmt="svg", workers=None, per_page=PER_PAGE, chunksize=16,
+                progress=None):
+    """
+    entries を per_page 件ずつのページにして out_dir に書き出す。ページはワーカーで並列に作る。
+    progress(pages, elapsed) を渡せば途中経過を知らせる。(ページ数, バイト数, 秒) を返す。
+    """
+    if fmt == "png":
+        import cairosvg  # noqa: F401  （ない環境では最初に ImportError にする）
+    os.makedirs(out_dir, exist_ok=True)
+    pages = written = 0
+    t0 = time.perf_counter()
+    with Pool(workers, initializer=_init_worker, initargs=(dict(shapes), out_dir, fmt)) as pool:
+        for page_no, size in pool.imap_unordered(_write_page, iter_pages(entries, per_page), chunksize):
+            pages += 1
+            written += size
+            if progress and pages % 500 == 0:
+                progress(pages, time.perf_counter() - t0)
+    return pages, written, time.perf_counter() - t0
+
+
+# ---------- ベンチマーク ----------
+def _inline_page(entries, shapes, page_no=None):
+    """比較用: グリフをキャッシュせず、ダイアグラムを毎回その場で作ってページに埋め込む。"""
+    class NoCache:
+        def get(self, shape):
+            return chord_box_symbol(shape)
+    return render_page(entries, shapes, NoCache(), page_no)
+
+
+def _generate_entries(n, seed=0):
+    import random
+    from theory import DIATONIC_MAJOR, COMMON_PATTERNS, generate_progression
+
+    rng = random.Random(seed)
+    keys = list(DIATONIC_MAJOR)
+    styles = list(COMMON_PATTERNS)
+    for i in range(n):
+        key, style = rng.choice(keys), rng.choice(styles)
+        yield entry_title(key, style, i), generate_progression(key, style, rng.choice((4, 8)), rng=rng)
+
+
+def benchmark(n=20_000, workers=None, out_dir=None):
+    """
+    n 件の進行（全キー・全スタイル）をページにする速さを、グリフキャッシュあり/なし（1プロセス）と
+    ワーカープロセスでの書き出しで比べる。
+    """
+    import tempfile
+    from theory import CHORD_SHAPES
+
+    entries = list(_generate_entries(n))
+    pages = list(iter_pages(entries))
+    sample = pages[:500]
+
+    t0 = time.perf_counter()
+    for no, page in sample:
+        _inline_page(page, CHORD_SHAPES, no)
+    inline = time.perf_counter() - t0
+    glyphs = GlyphCache()
+    t0 = time.perf_counter()
+    for no, page in sample:
+        render_page(page, CHORD_SHAPES, glyphs, no)
+    cached = time.perf_counter() - t0
+    print(f"compose {len(sample)} pages in-process: inline glyphs {len(sample) / inline:,.0f} pages/s, "
+          f"cached glyphs {len(sample) / cached:,.0f} pages/s ({glyphs.built} glyphs built)")
+
+    out_dir = out_dir or tempfile.mkdtemp(prefix="charts-")
+    done, size, elapsed = render_book(entries, CHORD_SHAPES, out_dir, workers=workers,
+                                      progress=lambda p, t: print(f"  {p:,} pages, {p / t:,.0f} pages/s"))
+    print(f"wrote {done:,} SVG pages ({n:,} progressions, {size / done / 1024:.1f} KiB/page) to {out_dir} "
+          f"in {elapsed:.2f}s = {done / elapsed:,.0f} pages/s with {workers or os.cpu_count()} workers")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render chord-box diagrams and lead sheets to SVG/PNG pages")
+    parser.add_argument("-n", type=int, default=20_000, help="number of generated progressions (without --library)")
+    parser.add_argument("--library", action="store_true", help="render the saved progressions in progressions.db")
+    parser.add_argument("-o", "--output", default=None)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--png", action="store_true", help="write PNG instead of SVG (needs cairosvg)")
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args(argv)
+    if args.bench:
+        benchmark(args.n, args.workers, args.output)
+        return
+    from library import LIBRARY_PATH
+    from theory import CHORD_SHAPES, DIATONIC_MAJOR
+
+    if args.library:
+        from library import ProgressionLibrary
+        lib = ProgressionLibrary(LIBRARY_PATH, DIATONIC_MAJOR)
+        rows = lib.find(limit=-1)    # -1 = 上限なし（SQLite）
+        lib.close()
+        entries = [(entry_title(key, style, seed, prog_id), chords)
+                   for prog_id, key, style, bars, seed, chords in rows]
+    else:
+        entries = _generate_entries(args.n)
+    out_dir = args.output or "charts"
+    fmt = "png" if args.png else "svg"
+    try:
+        pages, size, elapsed = render_book(entries, CHORD_SHAPES, out_dir, fmt, args.workers,
+                                           progress=lambda p, t: print(f"{p:,} pages, {p / t:,.0f} pages/s"))
+    except ImportError:
+        print("PNG output needs cairosvg (pip install cairosvg); use SVG instead", file=sys.stderr)
+        sys.exit(1)
+    if pages:
+        print(f"{pages:,} pages ({size / 1e6:.1f} MB) in {elapsed:.2f}s = {pages / elapsed:,.0f} pages/s -> {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# compact.py
+# 進行とイベントのコンパクトな表現。
+# - コード名は整数IDにインターン（CHORD_NAMES / chord_id）
+# - Progression: array('H') のコードID列 + 小さなヘッダ（key, style, bars, seed）
+# - ProgressionStore: 大量の進行を連続した配列に詰めたカタログ
+# - NoteEvent / EventBuffer: __slots__ のイベントと、配列で持つイベント列
+# どれも「コード名のシーケンス」「(beat, kind, channel, note, velocity) のイテラブル」
+# として振る舞うので、generate_progression / play_progression_loop / エクスポートにそのまま渡せる。
+import json
+import struct
+import sys
+import threading
+from array import array
+
+# ---------- コード名のインターン ----------
+CHORD_NAMES = []
+_CHORD_IDS = {}
+_intern_lock = threading.Lock()
+
+
+def chord_id(name):
+    """コード名 -> uint16 ID（初出なら登録）。"""
+    cid = _CHORD_IDS.get(name)
+    if cid is None:
+        with _intern_lock:
+            cid = _CHORD_IDS.get(name)
+            if cid is None:
+                cid = len(CHORD_NAMES)
+                if cid > 0xFFFF:
+                    raise OverflowError("too many distinct chord names")
+                CHORD_NAMES.append(name)
+                _CHORD_IDS[name] = cid
+    return cid
+
+
+def chord_name(cid):
+    return CHORD_NAMES[cid]
+
+
+# key / style も同じ仕組みで小さな整数にする
+class _Interner:
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.ids[name] = i
+        return i
+
+
+KEYS = _Interner()
+STYLES = _Interner()
+
+
+class NoteEvent:
+    """
+    イベント1つ。arrangement のタプルと同じ順序で比較・展開できる。
+    (beat, kind, channel, note, velocity)
+    """
+    __slots__ = ("beat", "kind", "channel", "note", "velocity")
+
+    def __init__(self, beat, kind, channel, note, velocity):
+        self.beat = beat
+        self.kind = kind
+        self.channel = channel
+        self.note = note
+        self.velocity = velocity
+
+    def astuple(self):
+        return (self.beat, self.kind, self.channel, self.note, self.velocity)
+
+    def __iter__(self):
+        return iter(self.astuple())
+
+    def __lt__(self, other):
+        return self.astuple() < tuple(other)
+
+    def __eq__(self, other):
+        try:
+            return self.astuple() == tuple(other)
+        except TypeError:
+            return NotImplemented
+
+    def __hash__(self):
+        # 同じ値のタプルと等しいので、ハッシュもタプルに合わせる
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return "NoteEvent(%r, %r, %r, %r, %r)" % self.astuple()
+
+
+# ---------- 進行 ----------
+class Progression:
+    """
+    コードID列（array('H')）とヘッダ。コード名のシーケンスとして振る舞う。
+    """
+    __slots__ = ("ids", "key", "style", "seed")
+
+    def __init__(self, ids, key=None, style=None, seed=None):
+        self.ids = ids if isinstance(ids, array) else array("H", ids)
+        self.key = key
+        self.style = style
+        self.seed = seed
+
+    @classmethod
+    def from_names(cls, names, key=None, style=None, seed=None):
+        return cls(array("H", [chord_id(n) for n in names]), key, style, seed)
+
+    @property
+    def bars(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [CHORD_NAMES[c] for c in self.ids[i]]
+        return CHORD_NAMES[self.ids[i]]
+
+    def __iter__(self):
+        names = CHORD_NAMES
+        for c in self.ids:
+            yield names[c]
+
+    def __eq__(self, other):
+        if isinstance(other, Progression):
+            return self.ids == other.ids
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __hash__(self):
+        # 同じコード列なら key / style / seed が違っても等しく、コード名のタプルとも等しいので、
+        # そのタプルと同じハッシュにする（{('C', 'G'): v}.get(p) も当たる）
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"Progression({list(self)!r}, key={self.key!r}, style={self.style!r}, seed={self.seed!r})"
+
+    def to_dict(self):
+        return {"key": self.key, "style": self.style, "bars": self.bars, "seed": self.seed, "chords": list(self)}
+
+
+class ProgressionStore:
+    """
+    大量の進行を保持するカタログ。進行ごとのヘッダは列ごとの配列、
+    コードIDはすべて1本の array('H') に連結し、offsets で区切る。
+    1進行あたり Python オブジェクトを作らないので、100万件でも数十MBに収まる。
+    """
+
+    # ファイルヘッダ: magic, version, 件数, コードID総数
+    # 版 1 は keys / styles が uint8（256 種類まで）だった。読めるが、書くのは版 2（uint16）
+    _HEADER = struct.Struct("<4sHQQ")
+    _MAGIC = b"GPRG"
+    _VERSION = 2
+
+    def __init__(self):
+        self.keys = array("H")
+        self.styles = array("H")
+        self.seeds = array("Q")
+        self.offsets = array("I", [0])
+        self.chords = array("H")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def append(self, names, key, style, seed=0):
+        self.keys.append(KEYS.id(key))
+        self.styles.append(STYLES.id(style))
+        self.seeds.append(seed or 0)
+        self.chords.extend(chord_id(n) for n in names)
+        self.offsets.append(len(self.chords))
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return Progression(self.chords[a:b], KEYS.names[self.keys[i]], STYLES.names[self.styles[i]], self.seeds[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.keys, self.styles, self.seeds, self.offsets, self.chords))
+
+    def to_numpy(self):
+        """ヘッダを NumPy の構造化配列で返す（分析用）。"""
+        import numpy as np
+        n = len(self)
+        out = np.zeros(n, dtype=[("key", "u2"), ("style", "u2"), ("bars", "u2"), ("seed", "u8"), ("offset", "u4")])
+        out["key"] = np.frombuffer(self.keys, dtype="u2")
+        out["style"] = np.frombuffer(self.styles, dtype="u2")
+        off = np.frombuffer(self.offsets, dtype="u4")
+        out["offset"] = off[:-1]
+        out["bars"] = np.diff(off)
+        out["seed"] = np.frombuffer(self.seeds, dtype="u8")
+        return out
+
+    def save(self, path):
+        """
+        バイナリで保存。コード名・キー名・スタイル名の表は JSON で同梱する。
+        """
+        names = json.dumps({"chords": CHORD_NAMES, "keys": KEYS.names, "styles": STYLES.names}).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(self._HEADER.pack(self._MAGIC, self._VERSION, len(self), len(self.chords)))
+            f.write(struct.pack("<I", len(names)))
+            f.write(names)
+            for a in (self.keys, self.styles, self.seeds, self.offsets, self.chords):
+                a.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with open(path, "rb") as f:
+            magic, version, n, nchords = cls._HEADER.unpack(f.read(cls._HEADER.size))
+            if magic != cls._MAGIC:
+                raise ValueError(f"not a progression store: {path}")
+            if version not in (1, cls._VERSION):
+                raise ValueError(f"unsupported progression store version {version}: {path}")
+            (nlen,) = struct.unpack("<I", f.read(4))
+            tables = json.loads(f.read(nlen).decode("utf-8"))
+            # 読み込んだ名前を今のプロセスのIDに付け替える
+            chord_map = [chord_id(c) for c in tables["chords"]]
+            key_map = [KEYS.id(k) for k in tables["keys"]]
+            style_map = [STYLES.id(s) for s in tables["styles"]]
+            code = "B" if version == 1 else "H"
+            keys, styles = array(code), array(code)
+            keys.fromfile(f, n)
+            styles.fromfile(f, n)
+            store.seeds.fromfile(f, n)
+            store.offsets = array("I")
+            store.offsets.fromfile(f, n + 1)
+            store.chords.fromfile(f, nchords)
+        store.keys = array("H", (key_map[k] for k in keys))
+        store.styles = array("H", (style_map[s] for s in styles))
+        store.chords = array("H", (chord_map[c] for c in store.chords))
+        return store
+
+
+# ---------- イベント列 ----------
+class EventBuffer:
+    """
+    (beat, kind, channel, note, velocity) を列ごとの配列で保持する。
+    長いループ（1万小節など）をコンパイルしても1イベントあたり 12 バイト程度。
+    """
+    __slots__ = ("beats", "kinds", "channels", "notes", "velocities")
+
+    def __init__(self, events=()):
+        self.beats = array("d")
+        self.kinds = array("B")
+        self.channels = array("B")
+        self.notes = array("B")
+        self.velocities = array("B")
+        self.extend(events)
+
+    def append(self, beat, kind, channel, note, velocity):
+        self.beats.append(beat)
+        self.kinds.append(kind)
+        self.channels.append(channel)
+        self.notes.append(note)
+        self.velocities.append(velocity)
+
+    def extend(self, events):
+        for ev in events:
+            self.append(*ev)
+
+    def __len__(self):
+        return len(self.beats)
+
+    def __getitem__(self, i):
+        return NoteEvent(self.beats[i], self.kinds[i], self.channels[i], self.notes[i], self.velocities[i])
+
+    def __iter__(self):
+        return zip(self.beats, self.kinds, self.channels, self.notes, self.velocities)
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.beats, self.kinds, self.channels, self.notes, self.velocities))
+
+
+# ---------- メモリ計測 ----------
+def benchmark(n=1_000_000, bars=8):
+    """
+    n 件の進行を「コード名リストのリスト」と ProgressionStore で持ったときの
+    メモリ使用量を tracemalloc で比べる。
+    """
+    import random
+    import tracemalloc
+
+    chords = ["C", "Dm", "Em", "F", "G", "Am", "Bdim", "F#m", "C#m", "Bb"]
+    keys = ["C", "G", "D", "A", "E", "F"]
+    styles = ["Pop", "Rock", "Ballad", "Blues"]
+    rng = random.Random(0)
+    rows = [(rng.choices(chords, k=bars), rng.choice(keys), rng.choice(styles), i) for i in range(n)]
+
+    tracemalloc.start()
+    base = tracemalloc.take_snapshot()
+    as_lists = [(list(names), key, style, seed) for names, key, style, seed in rows]
+    lists_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(base, "filename"))
+    del as_lists
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    base = tracemalloc.take_snapshot()
+    store = ProgressionStore()
+    for names, key, style, seed in rows:
+        store.append(names, key, style, seed)
+    store_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(base, "filename"))
+    tracemalloc.stop()
+
+    print(f"progressions: {n:,} x {bars} bars")
+    print(f"list of lists : {lists_bytes / 1e6:8.1f} MB")
+    print(f"ProgressionStore: {store_bytes / 1e6:8.1f} MB (arrays {store.nbytes() / 1e6:.1f} MB)")
+    return lists_bytes, store_bytes
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
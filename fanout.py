@@ -0,0 +1,285 @@
+# fanout.py
+# 同じイベントを複数のMIDI出力へ同時に送る（ハードシンセ + DAW + 照明コントローラなど）。
+# デバイスごとに上限付きキューと書き込みスレッドを持つので、1台が遅い/固まっても
+# 他のデバイスやスケジューラは止まらない。スケジューラ側は submit() でキューに積むだけ。
+#
+# 追いつけなくなったときの方針（policy）:
+#   "drop_oldest": キューが一杯なら一番古い note_on を（その note_off ごと）捨てて新しいイベントを入れる
+#   "drop_newest": キューが一杯なら新しい note_on を捨てる
+#   "coalesce":    キューが一杯のとき、来た note_off の note_on がまだキューにあれば、
+#                  その組を打ち消す（送る前に終わっている音）。ほかは drop_oldest と同じ
+# キューの上限は note_on / note_off の両方に掛かる。
+# note_on を捨てたら、その note_off も送らない（キューにあれば取り除き、まだなら来たときに捨てる）。
+# 鳴らしていない音の note_off（停止時の all-notes-off の大部分）はキューに積まない。
+# キューが鳴っている音の note_off だけで一杯のときは、新しい note_on を捨てる。
+# 新しい note_off はそれでも積む（鳴りっぱなしを防ぐため）。このとき超える分は、鳴っている音の数までに限られる。
+# max_lag を指定すると、送信1回にかかる時間から「max_lag 秒で送り切れる数」を見積もり、
+# キューの上限をそこまで下げる。予定時刻から max_lag 秒以上遅れた note_on は送らずに捨てる。
+#
+# latency（calibration.py で測ったこのデバイスの遅れ）を指定すると、scheduled を「鳴るべき時刻」と
+# みなして scheduled - latency まで待ってから送る。スケジューラは一番遅いデバイスの分だけ早く積む。
+import threading
+import time
+from collections import deque
+
+from arrangement import NOTE_ON, NOTE_OFF
+from scheduler import wait_until
+
+POLICIES = ("drop_oldest", "drop_newest", "coalesce")
+
+
+class DeviceWriter:
+    """
+    1台の出力デバイス専用の書き込みスレッド。
+    output: note_on/note_off(note, vel, channel) を持つ出力（pygame.midi.Output など）
+    metrics: PlaybackMetrics（None なら計測なし）。送信ごとにキューの深さと遅れを記録する
+    """
+
+    def __init__(self, device_id, output, name="", max_queue=256, policy="coalesce",
+                 max_lag=None, metrics=None, latency=0.0):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy: {policy!r} (choose from {', '.join(POLICIES)})")
+        self.device_id = device_id
+        self.output = output
+        self.name = name or str(device_id)
+        self.max_queue = max_queue
+        self.policy = policy
+        self.max_lag = max_lag
+        self.metrics = metrics
+        self.latency = latency
+        self.queue = deque()        # (kind, channel, note, vel, scheduled)
+        self.cond = threading.Condition()
+        self.running = True
+        # 統計（書き込みはこのスレッドか cond の中だけ）
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.redundant = 0          # 鳴っていない音の note_off（送らなかった）
+        self.stale = 0
+        self.max_depth = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.send_time = 0.0        # 送信1回にかかる時間（指数移動平均）
+        self._live = {}             # (channel, note) -> 受け付けた note_on の数 - 受け付けた note_off の数
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name=f"midi-writer-{self.name}", daemon=True)
+        self.thread.start()
+
+    # ---------- スケジューラ側 ----------
+    def submit(self, kind, channel, note, vel, scheduled=None):
+        """キューに積んで即座に戻る。捨てた場合は False。"""
+        if scheduled is None:
+            scheduled = time.perf_counter()
+        key = (channel, note)
+        with self.cond:
+            self.submitted += 1
+            full = len(self.queue) >= self.limit()
+            if kind == NOTE_OFF:
+                if not self._live.get(key):
+                    # 鳴らしていない（note_on を捨てた・送っていない）音なので要らない
+                    self.redundant += 1
+                    return False
+                if full and self.policy == "coalesce" and self._coalesce(channel, note):
+                    return False
+                if full:
+                    self._make_room()
+                self._unlive(key)
+            elif full and not self._make_room():
+                self.dropped += 1
+                return False
+            else:
+                self._live[key] = self._live.get(key, 0) + 1
+            self.queue.append((kind, channel, note, vel, scheduled))
+            depth = len(self.queue)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            self.cond.notify()
+        return True
+
+    def limit(self):
+        """今のキューの上限。max_lag があれば、max_lag 秒で送り切れる数まで下げる。"""
+        if self.max_lag is None or not self.send_time:
+            return self.max_queue
+        return max(4, min(self.max_queue, int(self.max_lag / self.send_time)))
+
+    def _make_room(self):
+        """
+        policy に従ってキューに1つ空きを作る。作れなければ False。
+        キューに note_on がなければ（鳴っている音の note_off だけなら）作れない。
+        """
+        if self.policy == "drop_newest":
+            return False
+        for i, (kind, channel, note, vel, scheduled) in enumerate(self.queue):
+            if kind == NOTE_ON:
+                del self.queue[i]
+                self._discard_on(channel, note, i)
+                self.dropped += 1
+                return True
+        return False
+
+    def _coalesce(self, channel, note):
+        """来た note_off の note_on がまだキューにあれば、両方とも送らない。打ち消せたら True。"""
+        for i in range(len(self.queue) - 1, -1, -1):
+            kind, ch, n = self.queue[i][:3]
+            if ch == channel and n == note:
+                if kind != NOTE_ON:
+                    return False
+                del self.queue[i]
+                self._unlive((channel, note))
+                self.coalesced += 2
+                return True
+        return False
+
+    def _discard_on(self, channel, note, start=0):
+        """
+        送らなかった note_on の後始末。対応する note_off が既にキューにあればそれも取り除き、
+        まだ来ていなければ、来たときに捨てられるよう鳴っている数から引く。
+        """
+        for i in range(start, len(self.queue)):
+            kind, ch, n = self.queue[i][:3]
+            if kind == NOTE_OFF and ch == channel and n == note:
+                del self.queue[i]
+                return
+        self._unlive((channel, note))
+
+    def _unlive(self, key):
+        n = self._live.get(key, 0) - 1
+        if n > 0:
+            self._live[key] = n
+        else:
+            self._live.pop(key, None)
+
+    # ---------- 書き込みスレッド ----------
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.queue:
+                    break
+                kind, channel, note, vel, scheduled = self.queue.popleft()
+                depth = len(self.queue)
+            # 遅れの補正: このデバイスで scheduled に鳴るよう、送る時刻は scheduled - latency
+            target = scheduled - self.latency
+            if self.latency:
+                wait_until(target)
+            lag = time.perf_counter() - target
+            if kind == NOTE_ON and self.max_lag is not None and lag > self.max_lag:
+                with self.cond:
+                    self._discard_on(channel, note)
+                    self.stale += 1
+                continue
+            t0 = time.perf_counter()
+            try:
+                if kind == NOTE_ON:
+                    self.output.note_on(int(note), int(vel), int(channel))
+                else:
+                    self.output.note_off(int(note), int(vel), int(channel))
+            except Exception as e:
+                if self.metrics:
+                    self.metrics.error(f'writer[{self.name}]', e)
+                continue
+            took = time.perf_counter() - t0
+            self.send_time = took if not self.send_time else self.send_time * 0.9 + took * 0.1
+            # 遅れはキューで待った時間（送り始めた時刻 - 送るべき時刻）
+            self.sent += 1
+            self.lag_total += lag
+            if lag > self.lag_max:
+                self.lag_max = lag
+            m = self.metrics
+            if m:
+                m.queue(self.device_id, depth, lag)
+        # close() が待ちきれずに戻っていても、出力はこのスレッドが送り終えてから閉じる
+        if self.closing:
+            try:
+                self.output.close()
+            except Exception as e:
+                if self.metrics:
+                    self.metrics.error(f'writer[{self.name}].close', e)
+
+    def depth(self):
+        return len(self.queue)
+
+    def stats(self):
+        return {
+            "device_id": self.device_id,
+            "name": self.name,
+            "policy": self.policy,
+            "latency_ms": self.latency * 1000.0,
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "redundant": self.redundant,
+            "stale": self.stale,
+            "lag_mean_ms": self.lag_total / self.sent * 1000.0 if self.sent else 0.0,
+            "lag_max_ms": self.lag_max * 1000.0,
+        }
+
+    def flush(self, timeout=1.0):
+        """キューが空になるまで待つ。空になれば True。"""
+        end = time.perf_counter() + timeout
+        while self.queue and time.perf_counter() < end:
+            time.sleep(0.001)
+        return not self.queue
+
+    def close(self, timeout=1.0):
+        """
+        残りを送り切ってから（最大 timeout 秒）スレッドを止める。出力はスレッドが抜けるときに閉じる
+        （送信中に固まっていても、送り終えるまでは閉じない）。閉じ終えていれば True。
+        """
+        self.flush(timeout)
+        with self.cond:
+            self.running = False
+            self.closing = True
+            self.queue.clear()
+            self.cond.notify_all()
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+
+def benchmark():
+    """
+    仮想デバイス3台（うち1台は1回の送信に40msかかり、追いつけない）へ Band を200 BPMで流し、
+    遅いデバイスが他の2台とスケジューラを遅らせないことを確かめる。
+    """
+    import random
+    from playback import MidiManager, play_progression
+    from theory import generate_progression
+    from instrumentation import PlaybackMetrics
+    from virtual_midi import VirtualMidi
+
+    backend = VirtualMidi({"Synth": {}, "DAW": {}, "Lights": {"block": 0.04}})
+    mm = MidiManager(backend=backend)
+    mm.metrics = PlaybackMetrics(capacity=1 << 16)
+    max_queue, max_lag = 64, 0.25
+    mm.open_outputs([0, 2, 4], max_queue=max_queue, policy="coalesce", max_lag=max_lag)
+    flag = threading.Event()
+    flag.set()
+    prog = generate_progression('C', 'Pop', 8, rng=random.Random(1))
+    t0 = time.perf_counter()
+    play_progression(prog, 200, "Band", False, mm, flag)
+    elapsed = time.perf_counter() - t0
+    for w in mm.writers.values():
+        w.flush(timeout=10.0)
+    stats = mm.output_stats()
+    mm.close()
+    s = mm.metrics.summary()
+    print(f"scheduler: {elapsed:.2f}s, late max {s['latency_max_ms']:.2f} ms")
+    ok = True
+    for st in stats:
+        print(f"{st['name']:7s} sent={st['sent']:5d} dropped={st['dropped']:4d} coalesced={st['coalesced']:4d} "
+              f"redundant={st['redundant']:4d} stale={st['stale']:4d} "
+              f"max_depth={st['max_depth']:3d} lag mean={st['lag_mean_ms']:7.2f} ms max={st['lag_max_ms']:7.2f} ms")
+        ok &= st["max_depth"] <= max_queue and st["lag_max_ms"] <= max_lag * 1000.0
+    lights = stats[-1]
+    ok &= lights["coalesced"] > 0
+    print(f"queue <= {max_queue}, lag <= {max_lag * 1000:.0f} ms, Lights coalesced > 0: {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,275 @@
+# fluid_driver.py
+# FluidSynth のオーディオドライバ設定。
+# GuitarSound.py は driver="dsound"（Windows 専用）と C:/Users/... の SoundFont を決め打ちしていたので、
+# Linux では起動しなかった。ドライバ・バッファ・サンプルレート・同時発音数を設定で選べるようにする。
+#
+# ドライバ: alsa / pulseaudio / jack（Linux）、dsound / wasapi（Windows）、coreaudio（macOS）、
+#           file（音声デバイスなしで音をファイルに書く。ヘッドレスの計測用）
+# ドライバのバッファによる遅れ ≒ audio.period-size * audio.periods / synth.sample-rate
+#
+# 環境変数（GuitarSound.py のコマンドライン引数でも上書きできる）:
+#   GUITAR_AUDIO_DRIVER, GUITAR_AUDIO_DEVICE, GUITAR_PERIOD_SIZE, GUITAR_PERIODS,
+#   GUITAR_SAMPLE_RATE, GUITAR_POLYPHONY, GUITAR_SOUNDFONT
+#
+# python fluid_driver.py [SF2]   file ドライバで period-size x periods を総当たりし、
+#                                実際の遅れ・CPU・取りこぼしを表にして、安定する一番小さい設定を出す
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from synth import DEFAULT_SOUNDFONT
+
+DRIVERS = ("alsa", "pulseaudio", "jack", "dsound", "wasapi", "coreaudio", "file")
+# プラットフォームごとの既定（先頭から試す）
+PLATFORM_DRIVERS = {
+    "linux": ("pulseaudio", "alsa", "jack"),
+    "win32": ("dsound", "wasapi"),
+    "darwin": ("coreaudio",),
+}
+
+
+def default_drivers(platform=sys.platform):
+    for prefix, drivers in PLATFORM_DRIVERS.items():
+        if platform.startswith(prefix):
+            return drivers
+    return ("file",)
+
+
+def _env_int(environ, name, default):
+    """整数の環境変数。読めない値は警告して既定値にする（起動時に ValueError で落とさない）。"""
+    value = environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"warning: ignoring {name}={value!r} (not an integer), using {default}")
+        return default
+
+
+class DriverConfig:
+    """
+    driver: DRIVERS のどれか、または "auto"（プラットフォームの既定を順に試す）
+    device: ドライバ固有のデバイス名（alsa なら "hw:0" など。None = 既定）
+    file_name: driver="file" のときの出力先（raw の s16 ステレオ）
+    """
+
+    def __init__(self, driver="auto", period_size=256, periods=2, sample_rate=44100, polyphony=64,
+                 device=None, soundfont=DEFAULT_SOUNDFONT, file_name=None, gain=0.2):
+        if driver != "auto" and driver not in DRIVERS:
+            raise ValueError(f"unknown audio driver: {driver!r} (choose from auto, {', '.join(DRIVERS)})")
+        if period_size < 64 or periods < 2:
+            raise ValueError("FluidSynth needs period-size >= 64 and periods >= 2")
+        self.driver = driver
+        self.period_size = int(period_size)
+        self.periods = int(periods)
+        self.sample_rate = int(sample_rate)
+        self.polyphony = int(polyphony)
+        self.device = device
+        self.soundfont = soundfont
+        self.file_name = file_name
+        self.gain = gain
+
+    @classmethod
+    def from_env(cls, environ=os.environ, **overrides):
+        """環境変数から作る。overrides に None 以外を渡した項目はそちらを優先する。"""
+        kw = {
+            "driver": environ.get("GUITAR_AUDIO_DRIVER", "auto"),
+            "device": environ.get("GUITAR_AUDIO_DEVICE") or None,
+            "period_size": _env_int(environ, "GUITAR_PERIOD_SIZE", 256),
+            "periods": _env_int(environ, "GUITAR_PERIODS", 2),
+            "sample_rate": _env_int(environ, "GUITAR_SAMPLE_RATE", 44100),
+            "polyphony": _env_int(environ, "GUITAR_POLYPHONY", 64),
+            "soundfont": environ.get("GUITAR_SOUNDFONT", DEFAULT_SOUNDFONT),
+        }
+        if kw["driver"] != "auto" and kw["driver"] not in DRIVERS:
+            print(f"warning: ignoring GUITAR_AUDIO_DRIVER={kw['driver']!r} (expected one of {', '.join(DRIVERS)})")
+            kw["driver"] = "auto"
+        kw.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**kw)
+
+    @staticmethod
+    def add_arguments(parser):
+        """argparse に --driver などを足す（既定値は None = 環境変数か DriverConfig の既定）。"""
+        parser.add_argument("--driver", choices=("auto",) + DRIVERS)
+        parser.add_argument("--device", help="driver-specific device name (e.g. hw:0 for alsa)")
+        parser.add_argument("--period-size", type=int, help="audio.period-size in frames")
+        parser.add_argument("--periods", type=int, help="audio.periods")
+        parser.add_argument("--sample-rate", type=int)
+        parser.add_argument("--polyphony", type=int)
+        parser.add_argument("--soundfont")
+        parser.add_argument("--file-name", help="output path for --driver file")
+
+    @classmethod
+    def from_args(cls, args):
+        return cls.from_env(driver=args.driver, device=args.device, period_size=args.period_size,
+                            periods=args.periods, sample_rate=args.sample_rate,
+                            polyphony=args.polyphony, soundfont=args.soundfont, file_name=args.file_name)
+
+    def latency(self):
+        """ドライバのバッファによる遅れ（秒）。"""
+        return self.period_size * self.periods / self.sample_rate
+
+    def candidates(self):
+        return default_drivers() if self.driver == "auto" else (self.driver,)
+
+    def settings(self, driver):
+        """Synth 作成前に設定する FluidSynth の設定。"""
+        s = {
+            "audio.driver": driver,
+            "audio.period-size": self.period_size,
+            "audio.periods": self.periods,
+            "synth.polyphony": self.polyphony,
+        }
+        if driver == "file":
+            s["audio.file.name"] = self.file_name or os.path.join(tempfile.gettempdir(), "guitar_fluidsynth.raw")
+            s["audio.file.type"] = "raw"
+            s["audio.file.format"] = "s16"
+        elif self.device:
+            s[f"audio.{driver}.device"] = self.device
+        return s
+
+    def describe(self, driver=None):
+        return (f"{driver or self.driver} period-size={self.period_size} periods={self.periods} "
+                f"rate={self.sample_rate} polyphony={self.polyphony} ({self.latency() * 1000:.1f} ms)")
+
+
+def start_synth(config, program=25):
+    """
+    config のドライバで FluidSynth を起動して (synth, 使ったドライバ) を返す。
+    driver="auto" なら起動できるまで順に試す。SoundFont が開けなければ RuntimeError。
+    """
+    import fluidsynth
+
+    errors = []
+    for driver in config.candidates():
+        synth = fluidsynth.Synth(gain=config.gain, samplerate=float(config.sample_rate), **config.settings(driver))
+        # SoundFont はドライバを動かす前に読む（読んでいる間に無音の period が流れないように）
+        sfid = synth.sfload(config.soundfont)
+        if sfid < 0:
+            synth.delete()
+            raise RuntimeError(f"cannot load soundfont: {config.soundfont}")
+        synth.program_select(0, sfid, 0, program)
+        try:
+            # ドライバ名・デバイスは settings() で設定済み。start() の driver 引数は
+            # pyfluidsynth の版によって file / wasapi を受け付けないので渡さない。
+            # 作れなかったときは例外にならず audio_driver が None のまま戻る
+            synth.start()
+            if getattr(synth, "audio_driver", True) is None:
+                raise RuntimeError("driver did not start")
+        except Exception as e:
+            errors.append(f"{driver}: {e}")
+            synth.delete()
+            continue
+        return synth, driver
+    raise RuntimeError("no FluidSynth audio driver could be started: " + "; ".join(errors))
+
+
+# ---------- 計測 ----------
+def measure(config, seconds=3.0, interval=0.25, note=60, threshold=0.05):
+    """
+    file ドライバで config のバッファ設定を鳴らし続け、
+    note_on を送った時刻と、ファイル上でその音が立ち上がる位置を比べて実際の遅れを測る。
+    返り値: 遅れ（中央値/最大）、CPU 使用率、書かれたフレーム数 / 経過時間から期待されるフレーム数
+    """
+    fd, path = tempfile.mkstemp(suffix=".raw")
+    os.close(fd)
+    cfg = DriverConfig(driver="file", period_size=config.period_size, periods=config.periods,
+                       sample_rate=config.sample_rate, polyphony=config.polyphony,
+                       soundfont=config.soundfont, file_name=path, gain=config.gain)
+    sr = cfg.sample_rate
+    try:
+        cpu0 = time.process_time()
+        synth, _ = start_synth(cfg)
+        t_start = time.perf_counter()     # ファイルの先頭 ≒ ドライバを起動した時刻
+        sent = []
+        try:
+            end = t_start + seconds
+            while time.perf_counter() < end:
+                sent.append(time.perf_counter() - t_start)
+                synth.noteon(0, note, 100)
+                time.sleep(interval / 2)
+                synth.noteoff(0, note)
+                time.sleep(interval / 2)
+            elapsed = time.perf_counter() - t_start
+        finally:
+            synth.delete()
+        cpu = time.process_time() - cpu0
+        pcm = np.fromfile(path, dtype=np.int16).reshape(-1, 2)
+    finally:
+        os.remove(path)
+    level = np.abs(pcm.astype(np.float32)).max(axis=1)
+    peak = float(level.max()) if level.size else 0.0
+    latencies = []
+    for t in sent:
+        start = int(t * sr)
+        window = level[start:start + int(interval * sr)]
+        if peak and window.size:
+            hits = np.flatnonzero(window >= peak * threshold)
+            if hits.size:
+                latencies.append((start + int(hits[0])) / sr - t)
+    return {
+        "config": cfg.describe("file"),
+        "period_size": cfg.period_size,
+        "periods": cfg.periods,
+        # 実デバイスではこれにドライバのバッファ分が足される
+        "render_ms": statistics.median(latencies) * 1000.0 if latencies else None,
+        "render_max_ms": max(latencies) * 1000.0 if latencies else None,
+        "expected_ms": cfg.latency() * 1000.0 + (statistics.median(latencies) * 1000.0 if latencies else 0.0),
+        "cpu_pct": cpu / elapsed * 100.0,
+        "frames_ratio": len(pcm) / (elapsed * sr),
+        "detected": len(latencies),
+        "notes": len(sent),
+    }
+
+
+def sweep(soundfont=DEFAULT_SOUNDFONT, period_sizes=(64, 128, 256, 512), periods=(2, 3, 4),
+          seconds=3.0, min_ratio=0.98):
+    """
+    period-size x periods を総当たりで measure() し、表を出す。
+    書かれたフレームが min_ratio 以上（取りこぼしなし）で全部の音が検出できた中で、
+    遅れが一番小さい設定を返す。
+    """
+    print(f"{'period':>6} {'periods':>7} {'buffer ms':>9} {'render ms':>9} {'max ms':>7} "
+          f"{'total ms':>8} {'cpu %':>6} {'frames':>7}")
+    best = None
+    for ps in period_sizes:
+        for n in periods:
+            cfg = DriverConfig(driver="file", period_size=ps, periods=n, soundfont=soundfont)
+            r = measure(cfg, seconds)
+            stable = r["frames_ratio"] >= min_ratio and r["detected"] == r["notes"]
+            render = r["render_ms"] if r["render_ms"] is not None else float("nan")
+            render_max = r["render_max_ms"] if r["render_max_ms"] is not None else float("nan")
+            print(f"{ps:>6} {n:>7} {cfg.latency() * 1000:>9.1f} {render:>9.1f} {render_max:>7.1f} "
+                  f"{r['expected_ms']:>8.1f} {r['cpu_pct']:>6.1f} {r['frames_ratio']:>7.3f}"
+                  f"{'' if stable else '  unstable'}")
+            if stable and (best is None or r["expected_ms"] < best["expected_ms"]):
+                best = r
+    if best:
+        print(f"lowest stable: --period-size {best['period_size']} --periods {best['periods']} "
+              f"(~{best['expected_ms']:.1f} ms)")
+    else:
+        print("no stable configuration found")
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure FluidSynth latency and CPU per buffer size (file driver)")
+    parser.add_argument("soundfont", nargs="?", default=os.environ.get("GUITAR_SOUNDFONT", DEFAULT_SOUNDFONT))
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--period-sizes", default="64,128,256,512")
+    parser.add_argument("--periods", default="2,3,4")
+    args = parser.parse_args(argv)
+    sweep(args.soundfont,
+          tuple(int(x) for x in args.period_sizes.split(",")),
+          tuple(int(x) for x in args.periods.split(",")),
+          args.seconds)
+
+
+if __name__ == "__main__":
+    main()
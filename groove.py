@@ -0,0 +1,300 @@
+# groove.py
+# グルーブ（スウィング・ストロークの弦ごとの遅れ・アクセント・人間らしいずれ）をイベント列に掛ける。
+# 全部をベロシティ 100 のまま格子どおりに鳴らすと機械的に聞こえるので、名前付きのテンプレートを選べるようにする。
+#
+# テンプレートは (テンポ, テンプレート, 1小節の拍数) ごとに、1小節を TICKS_PER_BEAT 刻みにした
+# 「時刻のずれ（拍）」「ベロシティの倍率」の配列と、弦ごとの遅れの表に前計算してキャッシュする。
+# 掛けるときは配列の引き算・表引き・乱数をイベント列全体にまとめて NumPy で行う（1イベントずつのループなし）。
+# 何千トラックでも apply_batch で1回にまとめられる。
+#
+# 乱数は seed から作るので、同じ seed・同じイベント列なら必ず同じ結果になる。
+# 同じチャンネル・同じ拍で鳴る音（コードの構成音やストローク）はひとかたまりとして同じだけずらし、
+# その拍で切れる note_off も同じだけずらす（鳴らし直しの前後関係が崩れない）。
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from arrangement import NOTE_ON, DRUM_CHANNEL
+from compact import EventBuffer
+
+TICKS_PER_BEAT = 24
+# 同じチャンネルでこれより近い note_on は1回のストローク（ひとかたまり）とみなす（拍）
+STRUM_GAP = 0.06
+# 弦ごとの遅れの表の長さ（7本目以降は最後の値）
+STRINGS = 8
+
+
+class GrooveTemplate:
+    """
+    swing: 8分音符の組の前半が占める割合（0.5 = イーブン、0.667 = 3連のシャッフル）
+    push_ms: 全体を後ろ（正）/前（負）にずらす
+    strum_ms: (ダウン, アップ) それぞれ、かたまりの何音目かごとの追加の遅れ（ms）
+    accents: 1小節を len(accents) 等分した位置ごとのベロシティの倍率
+    timing_ms: かたまりごとの時刻のずれ（標準偏差）
+    velocity_jitter: 音ごとのベロシティのずれ（標準偏差）
+    """
+
+    def __init__(self, name, swing=0.5, push_ms=0.0, strum_ms=((), ()), accents=(1.0,),
+                 timing_ms=0.0, velocity_jitter=0.0):
+        self.name = name
+        self.swing = swing
+        self.push_ms = push_ms
+        self.strum_ms = strum_ms
+        self.accents = tuple(accents)
+        self.timing_ms = timing_ms
+        self.velocity_jitter = velocity_jitter
+
+
+class GrooveTables:
+    """1つの (テンポ, テンプレート, 1小節の拍数) について前計算した表。"""
+
+    def __init__(self, template, tempo, beats_per_bar=4):
+        beat_sec = 60.0 / tempo
+        n = TICKS_PER_BEAT * beats_per_bar
+        pos = (np.arange(n) % TICKS_PER_BEAT) / TICKS_PER_BEAT     # 拍の中の位置 0..1
+        s = template.swing
+        mapped = np.where(pos < 0.5, pos * 2.0 * s, s + (pos - 0.5) * 2.0 * (1.0 - s))
+        self.offset = (mapped - pos) + template.push_ms / 1000.0 / beat_sec
+        slots = len(template.accents)
+        self.gain = np.asarray(template.accents, dtype=np.float64)[np.arange(n) * slots // n]
+        self.strum = np.zeros((2, STRINGS))
+        for d, delays in enumerate(template.strum_ms):
+            if len(delays):
+                row = np.asarray(delays[:STRINGS], dtype=np.float64) / 1000.0 / beat_sec
+                self.strum[d, :len(row)] = row
+                self.strum[d, len(row):] = row[-1]
+        self.timing_sd = template.timing_ms / 1000.0 / beat_sec
+        self.velocity_sd = template.velocity_jitter
+        self.length = n
+
+
+GROOVES = {
+    "Straight": GrooveTemplate("Straight"),
+    "Human": GrooveTemplate("Human", strum_ms=((0, 1, 2, 3, 4, 5), (0, 1, 2, 3, 4, 5)),
+                            accents=(1.1, 0.9, 1.0, 0.9, 1.05, 0.9, 1.0, 0.9), timing_ms=6.0, velocity_jitter=6.0),
+    "Swing": GrooveTemplate("Swing", swing=0.62, strum_ms=((0, 2, 4, 6, 8, 10), (0, 2, 4, 6, 8, 10)),
+                            accents=(1.0, 0.85, 1.15, 0.85, 1.0, 0.85, 1.15, 0.85), timing_ms=4.0, velocity_jitter=5.0),
+    "Shuffle": GrooveTemplate("Shuffle", swing=0.667, accents=(1.1, 0.8, 1.0, 0.8, 1.1, 0.8, 1.0, 0.8),
+                              timing_ms=3.0, velocity_jitter=4.0),
+    "Laid back": GrooveTemplate("Laid back", push_ms=12.0,
+                                strum_ms=((0, 4, 8, 12, 16, 20), (0, 3, 6, 9, 12, 15)),
+                                accents=(1.0, 0.85, 0.95, 0.85), timing_ms=5.0, velocity_jitter=5.0),
+    "Push": GrooveTemplate("Push", push_ms=-8.0, accents=(1.15, 0.9, 1.05, 0.9), timing_ms=3.0, velocity_jitter=4.0),
+}
+
+_tables = {}
+
+
+def tables(groove, tempo, beats_per_bar=4):
+    """(テンポ, テンプレート, 1小節の拍数) ごとの表。一度作ったものはキャッシュから返す。"""
+    template = GROOVES[groove] if isinstance(groove, str) else groove
+    key = (template.name, float(tempo), beats_per_bar)
+    t = _tables.get(key)
+    if t is None:
+        t = _tables[key] = GrooveTables(template, tempo, beats_per_bar)
+    return t
+
+
+def apply_arrays(beats, kinds, channels, notes, vels, tab, rng, tracks=None):
+    """
+    列ごとの配列（compact.EventBuffer と同じ並び）にグルーブを掛け、
+    (新しい拍, 新しいベロシティ, 並べ直しの順番) を返す。入力の配列は変更しない。
+    tracks: 何本ものトラックをまとめて渡すときのトラック番号（かたまりがトラックをまたがない）
+    """
+    beats = np.asarray(beats, dtype=np.float64)
+    kinds = np.asarray(kinds)
+    channels = np.asarray(channels, dtype=np.int64)
+    notes = np.asarray(notes, dtype=np.int64)
+    vels = np.asarray(vels, dtype=np.float64)
+    n = len(beats)
+    tracks = np.zeros(n, dtype=np.int64) if tracks is None else np.asarray(tracks, dtype=np.int64)
+    lane = tracks * 16 + channels
+    shift = np.zeros(n)
+    new_vels = vels.copy()
+
+    # ---- note_on をかたまりに分ける ----
+    on = np.flatnonzero(kinds == NOTE_ON)
+    order = on[np.lexsort((beats[on], lane[on]))]
+    m = len(order)
+    if m:
+        b = beats[order]
+        ln = lane[order]
+        first = np.ones(m, dtype=bool)
+        first[1:] = (ln[1:] != ln[:-1]) | (np.diff(b) > STRUM_GAP)
+        heads = np.flatnonzero(first)
+        gid = np.cumsum(first) - 1
+        rank = np.arange(m) - heads[gid]
+        anchor = b[heads]
+        # 2音目が1音目より低ければアップストローク
+        size = np.diff(np.append(heads, m))
+        up = np.zeros(len(heads), dtype=np.int64)
+        multi = size > 1
+        up[multi] = notes[order[heads[multi] + 1]] < notes[order[heads[multi]]]
+
+        tick = np.rint(anchor * TICKS_PER_BEAT).astype(np.int64) % tab.length
+        group_shift = tab.offset[tick]
+        if tab.timing_sd:
+            group_shift = group_shift + np.clip(rng.normal(0.0, tab.timing_sd, len(heads)),
+                                                -2 * tab.timing_sd, 2 * tab.timing_sd)
+        strum = tab.strum[up[gid], np.minimum(rank, STRINGS - 1)]
+        strum[(ln % 16) == DRUM_CHANNEL] = 0.0
+        shift[order] = group_shift[gid] + strum
+
+        own_tick = np.rint(b * TICKS_PER_BEAT).astype(np.int64) % tab.length
+        v = vels[order] * tab.gain[own_tick]
+        if tab.velocity_sd:
+            v = v + rng.normal(0.0, tab.velocity_sd, m)
+        new_vels[order] = np.clip(np.rint(v), 1, 127)
+
+        # ---- note_off: その拍にかたまりがあれば同じだけずらす ----
+        off = np.flatnonzero(kinds != NOTE_ON)
+        if len(off):
+            span = float(np.ceil(beats.max())) + 2.0
+            group_key = ln[heads] * span + anchor
+            off_key = lane[off] * span + beats[off]
+            pos = np.searchsorted(group_key, off_key - 1e-6)
+            pos_c = np.minimum(pos, len(heads) - 1)
+            hit = (pos < len(heads)) & (np.abs(group_key[pos_c] - off_key) < 1e-6)
+            off_tick = np.rint(beats[off] * TICKS_PER_BEAT).astype(np.int64) % tab.length
+            shift[off] = np.where(hit, group_shift[pos_c], tab.offset[off_tick])
+    else:
+        off_tick = np.rint(beats * TICKS_PER_BEAT).astype(np.int64) % tab.length
+        shift = tab.offset[off_tick]
+
+    # 0 で切らない: Push なら拍0の音も前にずれ、Laid back なら最後の note_off が周の長さを越える。
+    # ループの周をまたぐ分は呼び出し側（playback.play_progression）が次の周と混ぜて送る
+    new_beats = beats + shift
+    # arrangement と同じ並び（拍, note_off が先, チャンネル, ノート）
+    order = np.lexsort((notes, channels, kinds, new_beats, tracks))
+    return new_beats, new_vels, order
+
+
+def _columns(events, n=None):
+    """(beat, kind, channel, note, vel) のタプルの並び -> 列ごとの配列。"""
+    if n is None:
+        events = list(events)
+        n = len(events)
+    flat = np.fromiter(itertools.chain.from_iterable(events), dtype=np.float64, count=n * 5).reshape(n, 5)
+    return (flat[:, 0], flat[:, 1].astype(np.int64), flat[:, 2].astype(np.int64),
+            flat[:, 3].astype(np.int64), flat[:, 4])
+
+
+def _buffer_columns(buf):
+    """compact.EventBuffer -> 列ごとの配列（コピーなしのビュー）。"""
+    return (np.frombuffer(buf.beats, dtype=np.float64), np.frombuffer(buf.kinds, dtype=np.uint8),
+            np.frombuffer(buf.channels, dtype=np.uint8), np.frombuffer(buf.notes, dtype=np.uint8),
+            np.frombuffer(buf.velocities, dtype=np.uint8))
+
+
+def humanize(events, tempo, groove, seed=0, beats_per_bar=4):
+    """
+    (beat, kind, channel, note, vel) のイベント列にグルーブを掛けた新しいリストを返す。
+    groove が None / "Straight" ならそのまま。拍は負（拍0より前）になることがある。
+    """
+    events = list(events)
+    if not events or groove in (None, "Straight"):
+        return events
+    beats, kinds, channels, notes, vels = _columns(events, len(events))
+    new_beats, new_vels, order = apply_arrays(beats, kinds, channels, notes, vels,
+                                              tables(groove, tempo, beats_per_bar), np.random.default_rng(seed))
+    return list(zip(new_beats[order].tolist(), kinds[order].tolist(), channels[order].tolist(),
+                    notes[order].tolist(), new_vels[order].astype(np.int64).tolist()))
+
+
+def apply_batch(tracks, tempo, groove, seed=0, beats_per_bar=4):
+    """
+    何本ものトラックに1回の NumPy 処理でまとめてグルーブを掛ける。
+    tracks: イベント列（タプルのリスト）か compact.EventBuffer のリスト
+    トラックごとの (beats, kinds, channels, notes, vels) の配列のタプルのリストを返す。
+    """
+    counts = np.array([len(t) for t in tracks], dtype=np.int64)
+    total = int(counts.sum())
+    if not total:
+        return []
+    if all(isinstance(t, EventBuffer) for t in tracks):
+        cols = [np.concatenate(c) for c in zip(*(_buffer_columns(t) for t in tracks))]
+    else:
+        cols = _columns(itertools.chain.from_iterable(tracks), total)
+    beats, kinds, channels, notes, vels = cols
+    track_ids = np.repeat(np.arange(len(tracks)), counts)
+    new_beats, new_vels, order = apply_arrays(beats, kinds, channels, notes, vels,
+                                              tables(groove, tempo, beats_per_bar),
+                                              np.random.default_rng(seed), track_ids)
+    out = (new_beats[order], kinds[order], channels[order], notes[order], new_vels[order].astype(np.int64))
+    bounds = np.cumsum(counts)[:-1]
+    return list(zip(*(np.split(c, bounds) for c in out)))
+
+
+# ---------- ベンチマーク ----------
+def _naive_humanize(events, tempo, groove, rng):
+    """比較用: 1イベントずつ Python で同じことをする（かたまりの扱いは省略）。"""
+    t = GROOVES[groove]
+    beat_sec = 60.0 / tempo
+    out = []
+    for beat, kind, channel, note, vel in events:
+        pos = beat % 1.0
+        s = t.swing
+        mapped = pos * 2 * s if pos < 0.5 else s + (pos - 0.5) * 2 * (1 - s)
+        beat = beat + (mapped - pos) + t.push_ms / 1000.0 / beat_sec + rng.gauss(0.0, t.timing_ms / 1000.0 / beat_sec)
+        if kind == NOTE_ON:
+            slot = int((beat % 4) / 4 * len(t.accents)) % len(t.accents)
+            vel = max(1, min(127, round(vel * t.accents[slot] + rng.gauss(0.0, t.velocity_jitter))))
+        out.append((beat, kind, channel, note, vel))
+    out.sort()
+    return out
+
+
+def benchmark(n_tracks=2000, bars=8, groove="Swing", tempo=120):
+    """
+    n_tracks 本の Band トラックにグルーブを掛ける時間を、1イベントずつの Python 版・トラックごとの humanize・
+    apply_batch で比べる。同じ seed で2回掛けて結果が一致することも確かめる。
+    """
+    import random
+    from theory import generate_progression, cached_notes
+    from arrangement import ARRANGEMENTS, compile_progression
+
+    beats_per_chord, lanes = ARRANGEMENTS["Band"]
+    rng = random.Random(0)
+    keys = ["C", "G", "D", "A", "E", "F"]
+    tracks = [list(compile_progression(generate_progression(rng.choice(keys), "Pop", bars, rng=rng),
+                                       lanes, beats_per_chord, cached_notes)) for _ in range(n_tracks)]
+    events = sum(len(t) for t in tracks)
+
+    t0 = time.perf_counter()
+    r = random.Random(1)
+    for t in tracks:
+        _naive_humanize(t, tempo, groove, r)
+    naive = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for i, t in enumerate(tracks):
+        humanize(t, tempo, groove, seed=i)
+    per_track = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = apply_batch(tracks, tempo, groove, seed=1)
+    batched = time.perf_counter() - t0
+
+    buffers = [EventBuffer(t) for t in tracks]
+    t0 = time.perf_counter()
+    apply_batch(buffers, tempo, groove, seed=1)
+    batched_buffers = time.perf_counter() - t0
+
+    again = apply_batch(tracks, tempo, groove, seed=1)
+    same = all(np.array_equal(a, b) for ta, tb in zip(batch, again) for a, b in zip(ta, tb))
+    same = same and humanize(tracks[0], tempo, groove, seed=5) == humanize(tracks[0], tempo, groove, seed=5)
+
+    print(f"{n_tracks} Band tracks x {bars} bars = {events:,} events, groove {groove!r} @ {tempo} BPM")
+    print(f"python per event  : {naive:6.2f}s ({events / naive:>12,.0f} events/s)")
+    print(f"humanize per track: {per_track:6.2f}s ({events / per_track:>12,.0f} events/s)")
+    print(f"apply_batch       : {batched:6.2f}s ({events / batched:>12,.0f} events/s)")
+    print(f"  (EventBuffer)   : {batched_buffers:6.2f}s ({events / batched_buffers:>12,.0f} events/s)")
+    print(f"reproducible with the same seed: {same}")
+    print("example:", humanize(tracks[0], tempo, groove, seed=5)[:6])
+    return same
+
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000) else 1)
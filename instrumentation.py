@@ -0,0 +1,186 @@
+# instrumentation.py
+# 再生タイミングの計測（オプトイン）。
+# MidiManager.metrics に PlaybackMetrics を入れたときだけ記録する。None なら何もしない。
+import csv
+import itertools
+import json
+import statistics
+import time
+import tkinter as tk
+
+
+# ---------- リングバッファ ----------
+class RingBuffer:
+    """
+    固定長のリングバッファ。ロックは使わない。
+    書き込み位置は itertools.count() で払い出すので（CPythonでは next() がアトミック）、
+    複数スレッドから append しても位置が重ならない。古い要素は上書きされる。
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._counter = itertools.count()
+        self._written = 0
+
+    def append(self, item):
+        i = next(self._counter)
+        self._items[i % self.capacity] = item
+        if i >= self._written:
+            self._written = i + 1
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    def snapshot(self):
+        """古い順に並べたコピーを返す。"""
+        n = self._written
+        items = list(self._items)
+        if n <= self.capacity:
+            return [x for x in items[:n] if x is not None]
+        start = n % self.capacity
+        return [x for x in items[start:] + items[:start] if x is not None]
+
+    def clear(self):
+        self._items = [None] * self.capacity
+        self._counter = itertools.count()
+        self._written = 0
+
+
+# ---------- メトリクス ----------
+class PlaybackMetrics:
+    """
+    再生まわりの計測値を保持する。
+    - notes:   (kind, note, scheduled, actual)  予定時刻と実際の送信時刻（perf_counter秒）
+    - locks:   (op, wait)  MidiManager.lock の待ち時間
+    - devices: (op, device_id, duration)  デバイスの open/close にかかった時間
+    - errors:  (where, message, time)  握りつぶしていた例外
+    - queues:  (device_id, depth, lag)  複数出力（fanout.DeviceWriter）の送信時のキューの深さと遅れ
+    """
+
+    def __init__(self, capacity=4096):
+        self.notes = RingBuffer(capacity)
+        self.locks = RingBuffer(capacity)
+        self.devices = RingBuffer(256)
+        self.errors = RingBuffer(256)
+        self.queues = RingBuffer(capacity)
+
+    def note(self, kind, note, scheduled):
+        self.notes.append((kind, int(note), scheduled, time.perf_counter()))
+
+    def lock_wait(self, op, started):
+        self.locks.append((op, time.perf_counter() - started))
+
+    def device(self, op, device_id, started):
+        self.devices.append((op, device_id, time.perf_counter() - started))
+
+    def error(self, where, exc):
+        self.errors.append((where, repr(exc), time.perf_counter()))
+
+    def queue(self, device_id, depth, lag):
+        self.queues.append((device_id, depth, lag))
+
+    def clear(self):
+        for buf in (self.notes, self.locks, self.devices, self.errors, self.queues):
+            buf.clear()
+
+    def summary(self):
+        """オーバーレイやエクスポート用の集計（ミリ秒）。"""
+        latencies = [(actual - sched) * 1000.0 for (_, _, sched, actual) in self.notes.snapshot()]
+        waits = [w * 1000.0 for (_, w) in self.locks.snapshot()]
+        queues = self.queues.snapshot()
+        result = {
+            "events": len(latencies),
+            "latency_mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+            "latency_max_ms": max(latencies) if latencies else 0.0,
+            "jitter_ms": statistics.pstdev(latencies) if len(latencies) > 1 else 0.0,
+            "lock_wait_mean_ms": statistics.fmean(waits) if waits else 0.0,
+            "lock_wait_max_ms": max(waits) if waits else 0.0,
+            "device_ops": len(self.devices),
+            "errors": len(self.errors),
+            "queue_depth_max": max((d for (_, d, _) in queues), default=0),
+            "device_lag_max_ms": max((lag for (_, _, lag) in queues), default=0.0) * 1000.0,
+        }
+        return result
+
+    # ---------- エクスポート ----------
+    def to_json(self, path):
+        data = {
+            "summary": self.summary(),
+            "notes": [dict(zip(("kind", "note", "scheduled", "actual"), r)) for r in self.notes.snapshot()],
+            "locks": [dict(zip(("op", "wait"), r)) for r in self.locks.snapshot()],
+            "devices": [dict(zip(("op", "device_id", "duration"), r)) for r in self.devices.snapshot()],
+            "errors": [dict(zip(("where", "message", "time"), r)) for r in self.errors.snapshot()],
+            "queues": [dict(zip(("device_id", "depth", "lag"), r)) for r in self.queues.snapshot()],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def to_csv(self, path):
+        """全レコードを1つのCSVにまとめる（record列で種類を区別）。"""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["record", "name", "value1", "value2", "value3"])
+            for kind, note, sched, actual in self.notes.snapshot():
+                w.writerow(["note", kind, note, f"{sched:.6f}", f"{actual:.6f}"])
+            for op, wait in self.locks.snapshot():
+                w.writerow(["lock", op, f"{wait:.6f}", "", ""])
+            for op, dev, dur in self.devices.snapshot():
+                w.writerow(["device", op, dev, f"{dur:.6f}", ""])
+            for where, msg, t in self.errors.snapshot():
+                w.writerow(["error", where, msg, f"{t:.6f}", ""])
+            for dev, depth, lag in self.queues.snapshot():
+                w.writerow(["queue", dev, depth, f"{lag:.6f}", ""])
+
+
+# ---------- ライブ表示 ----------
+class MetricsOverlay:
+    """
+    メトリクスの簡易ウィンドウ。Tkスレッド上で after により定期更新する。
+    """
+
+    def __init__(self, root, metrics, interval_ms=500, on_export=None):
+        self.metrics = metrics
+        self.interval_ms = interval_ms
+        self.win = tk.Toplevel(root)
+        self.win.title("Playback Metrics")
+        self.win.attributes("-topmost", True)
+        self.label = tk.Label(self.win, justify="left", font=("Consolas", 10), anchor="w")
+        self.label.pack(padx=10, pady=8, fill="both")
+        if on_export is not None:
+            tk.Button(self.win, text="Export...", command=on_export).pack(pady=(0, 8))
+        self._job = None
+        self.win.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh()
+
+    def refresh(self):
+        s = self.metrics.summary()
+        lines = [
+            f"events        : {s['events']}",
+            f"latency mean  : {s['latency_mean_ms']:.2f} ms",
+            f"latency max   : {s['latency_max_ms']:.2f} ms",
+            f"jitter (sd)   : {s['jitter_ms']:.2f} ms",
+            f"lock wait mean: {s['lock_wait_mean_ms']:.3f} ms",
+            f"lock wait max : {s['lock_wait_max_ms']:.3f} ms",
+            f"device ops    : {s['device_ops']}",
+            f"errors        : {s['errors']}",
+            f"queue max     : {s['queue_depth_max']}",
+            f"device lag max: {s['device_lag_max_ms']:.2f} ms",
+        ]
+        self.label.configure(text="\n".join(lines))
+        self._job = self.win.after(self.interval_ms, self.refresh)
+
+    def close(self):
+        if self._job is not None:
+            try:
+                self.win.after_cancel(self._job)
+            except tk.TclError:
+                pass
+            self._job = None
+        self.win.destroy()
+
+    def is_open(self):
+        try:
+            return bool(self.win.winfo_exists())
+        except tk.TclError:
+            return False
@@ -0,0 +1,663 @@
+# jam.py
+# 先生の ChordApp の再生に合わせて、同じ LAN の生徒の端末（ブラウザ）に今のコードと拍を配る。
+# asyncio の WebSocket サーバを専用スレッドのイベントループで動かす。再生スレッドは
+# begin() で「拍0の時刻」と進行を渡すだけで、拍ごとの送信はサーバのループが行う。
+#
+# メッセージ（JSON テキスト。時刻はすべてサーバの時計 clock() の秒）:
+#   session: {"type": "session", "progression", "tempo", "beats_per_chord", "style", "playing"}
+#            接続直後と再生開始のたびに送る
+#   tick:    {"type": "tick", "beat", "chord_index", "chord", "tempo", "t", "sent"[, "notes"]}
+#            1拍に1通。t はその拍が鳴る時刻、sent は送った時刻。LOOKAHEAD 秒前に送るので、
+#            クライアントは t に合わせて表示・発音できる。コードが変わる拍だけ notes（MIDIノート番号）を付ける
+#   stop:    {"type": "stop"}
+#   pong:    {"type": "pong", "client_time", "server_time"}  クライアントの ping への返事。
+#            往復の真ん中を server_time とみなして時計のずれを推定する（NTP と同じ考え方）
+#
+# 1拍のメッセージは1回だけ JSON にしてフレームを組み、同じ bytes を全クライアントの transport に書く。
+# 遅いクライアント: 書き込みバッファが high_water を超えていたらその拍は送らない（捨てる）。
+# 追いついたら最新の session を送り直してから再開する。max_drops 拍続けて送れなければ切断する。
+# ほかのクライアントや再生は遅いクライアントを待たない。
+#
+# websockets パッケージには依存しない（RFC 6455 のうち、サーバに要るテキスト・ping・close だけを自前で扱う）。
+# "/" にはブラウザ用のクライアント（CLIENT_HTML）を返す。
+#
+# python jam.py [--port 8765]   デモの進行を流し続ける（ブラウザで http://<このPC>:8765/ を開く）
+# python jam.py --bench         ローカルの 500 クライアントで負荷試験
+import argparse
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import threading
+import time
+
+DEFAULT_PORT = 8765
+LOOKAHEAD = 0.15            # 拍の何秒前に tick を送るか（クライアント側の表示・発音の予約に使う）
+HIGH_WATER = 64 * 1024      # これ以上送れずに溜まっているクライアントには、その拍を送らない
+MAX_DROPS = 32              # 続けてこれだけ捨てたら切断する
+SNDBUF = 16 * 1024          # カーネルの送信バッファ。小さくして、止まった端末に古い拍を溜めこまない
+MAX_FRAME = 64 * 1024       # クライアントから受け取るフレームの上限
+HANDSHAKE_TIMEOUT = 5.0
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+_PERF0 = time.perf_counter()
+_WALL0 = time.time()
+
+
+def clock(perf=None):
+    """サーバの時計（perf_counter を起動時の time.time() に合わせたもの。途中で時刻合わせされても跳ばない）。"""
+    return _WALL0 + ((time.perf_counter() if perf is None else perf) - _PERF0)
+
+
+def lan_address():
+    """生徒の端末から届くこの PC のアドレス（わからなければ 127.0.0.1）。実際には何も送らない。"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("192.0.2.1", 9))
+        return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+
+# ---------- WebSocket（RFC 6455）----------
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + GUID).encode("ascii")).digest()).decode("ascii")
+
+
+def _xor(data, mask):
+    n = len(data)
+    if not n:
+        return b""
+    key = int.from_bytes((mask * (n // 4 + 1))[:n], "big")
+    return (int.from_bytes(data, "big") ^ key).to_bytes(n, "big")
+
+
+def encode_frame(payload, opcode=OP_TEXT, mask=None):
+    """1フレーム（FIN=1）。サーバからは mask なし、クライアントからは 4 バイトの mask 付きで送る。"""
+    n = len(payload)
+    mbit = 0x80 if mask else 0
+    head = bytearray((0x80 | opcode,))
+    if n < 126:
+        head.append(mbit | n)
+    elif n < 1 << 16:
+        head.append(mbit | 126)
+        head += n.to_bytes(2, "big")
+    else:
+        head.append(mbit | 127)
+        head += n.to_bytes(8, "big")
+    if mask:
+        head += mask
+        payload = _xor(payload, mask)
+    return bytes(head) + payload
+
+
+async def read_frame(reader, limit=MAX_FRAME):
+    """(opcode, payload)。分割されたフレーム（FIN=0）と limit を超えるフレームは ConnectionError。"""
+    b0, b1 = await reader.readexactly(2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = int.from_bytes(await reader.readexactly(2), "big")
+    elif n == 127:
+        n = int.from_bytes(await reader.readexactly(8), "big")
+    if n > limit:
+        raise ConnectionError(f"frame too large: {n} bytes")
+    mask = await reader.readexactly(4) if b1 & 0x80 else None
+    payload = await reader.readexactly(n)
+    if not b0 & 0x80:
+        raise ConnectionError("fragmented frames are not supported")
+    return b0 & 0x0F, _xor(payload, mask) if mask else payload
+
+
+def _parse_request(data):
+    lines = data.decode("latin-1").split("\r\n")
+    parts = lines[0].split()
+    path = parts[1] if len(parts) > 1 else "/"
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return path, headers
+
+
+def _http_response(status, body=b"", content_type="text/plain; charset=utf-8"):
+    return (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Cache-Control: no-store\r\nConnection: close\r\n\r\n").encode("ascii") + body
+
+
+# ---------- サーバ ----------
+class _Client:
+    __slots__ = ("writer", "transport", "drops")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.transport = writer.transport
+        self.drops = 0      # 続けて捨てた拍の数
+
+
+class JamServer:
+    """
+    begin / end / publish はどのスレッドから呼んでもよい（ループに call_soon_threadsafe で渡すだけ）。
+    それ以外の _ で始まるメソッドと broadcast はループのスレッドだけが呼ぶ。
+    """
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, high_water=HIGH_WATER, max_drops=MAX_DROPS,
+                 sndbuf=SNDBUF, lookahead=LOOKAHEAD):
+        self.host = host
+        self.port = port
+        self.high_water = high_water
+        self.max_drops = max_drops
+        self.sndbuf = sndbuf
+        self.lookahead = lookahead
+        self.clients = set()
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._handles = []
+        self._session = None
+        self._session_frame = self._frame({"type": "session", "progression": [], "tempo": None,
+                                           "beats_per_chord": None, "style": "", "playing": False})
+        # 統計
+        self.messages = 0
+        self.frames = 0
+        self.dropped = 0
+        self.kicked = 0
+        self.connected = 0
+        self.fanout_times = collections.deque(maxlen=4096)     # 直近の配信時間（p50 用）
+        self.fanout_max = 0.0                                   # 起動からの最大
+
+    # ---- 起動・停止 ----
+    def start(self):
+        """ループのスレッドを起こし、待ち受けを始めてから戻る（ポートが使えなければ OSError）。"""
+        ready = threading.Event()
+        error = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self.loop = loop
+            try:
+                self._server = loop.run_until_complete(
+                    asyncio.start_server(self._handle, self.host, self.port, backlog=1024))
+            except OSError as e:
+                error.append(e)
+                ready.set()
+                loop.close()
+                return
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            try:
+                loop.run_forever()
+            finally:
+                loop.run_until_complete(self._shutdown())
+                loop.close()
+
+        self._thread = threading.Thread(target=run, name="jam-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if error:
+            raise error[0]
+        return self
+
+    def close(self, timeout=2.0):
+        if self.loop is None or self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    async def _shutdown(self):
+        self._cancel()
+        self._server.close()
+        for c in list(self.clients):
+            c.transport.abort()
+        await self._server.wait_closed()
+
+    def url(self):
+        host = lan_address() if self.host in ("0.0.0.0", "") else self.host
+        return f"http://{host}:{self.port}/"
+
+    # ---- 再生スレッドから ----
+    def begin(self, progression, tempo, beats_per_chord, start, loop=True, voicing=None, style=""):
+        """
+        start: 拍0の perf_counter 時刻（play_progression の on_start から渡る）
+        voicing: コード名 -> MIDIノート番号の列（cached_notes など）。渡せば tick に notes を付ける
+        """
+        session = {
+            "progression": list(progression),
+            "tempo": tempo,
+            "beats_per_chord": beats_per_chord,
+            "style": style,
+            "notes": [list(voicing(ch)) for ch in progression] if voicing else None,
+        }
+        self._call(self._begin, session, start, loop)
+
+    def end(self):
+        self._call(self._end)
+
+    def publish(self, message):
+        """任意のメッセージを全員に送る（dict。JSON にできるもの）。"""
+        self._call(self.broadcast, message)
+
+    def _call(self, fn, *args):
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(fn, *args)
+            except RuntimeError:    # close() と行き違いでループが閉じた
+                pass
+
+    # ---- ループのスレッド ----
+    @staticmethod
+    def _frame(message):
+        return encode_frame(json.dumps(message, separators=(",", ":")).encode("utf-8"))
+
+    def broadcast(self, message):
+        """message を1回だけシリアライズして全クライアントに書く。"""
+        t0 = time.perf_counter()
+        frame = self._frame(message)
+        for c in list(self.clients):
+            self._send(c, frame)
+        self.messages += 1
+        dt = time.perf_counter() - t0
+        self.fanout_times.append(dt)
+        if dt > self.fanout_max:
+            self.fanout_max = dt
+
+    def _send(self, client, frame):
+        t = client.transport
+        if t.is_closing():
+            return
+        if t.get_write_buffer_size() > self.high_water:
+            client.drops += 1
+            self.dropped += 1
+            if client.drops >= self.max_drops:
+                self.kicked += 1
+                self.clients.discard(client)
+                t.abort()
+            return
+        if client.drops:
+            # 追いついた。捨てた間に進行が変わっているかもしれないので状態を送り直す
+            client.drops = 0
+            t.write(self._session_frame)
+            self.frames += 1
+        t.write(frame)
+        self.frames += 1
+
+    def _cancel(self):
+        for h in self._handles:
+            h.cancel()
+        self._handles.clear()
+
+    def _begin(self, session, start, loop):
+        self._cancel()
+        self._session = session
+        msg = {"type": "session", "playing": True}
+        msg.update((k, v) for k, v in session.items() if k != "notes")
+        self._session_frame = self._frame(msg)
+        for c in list(self.clients):
+            if not c.transport.is_closing():
+                c.transport.write(self._session_frame)
+                self.frames += 1
+        self._schedule_pass(start, 0, loop)
+
+    def _end(self):
+        self._cancel()
+        if self._session is None:
+            return
+        s = self._session
+        self._session = None
+        self._session_frame = self._frame({"type": "session", "progression": s["progression"], "tempo": s["tempo"],
+                                           "beats_per_chord": s["beats_per_chord"], "style": s["style"],
+                                           "playing": False})
+        self.broadcast({"type": "stop"})
+
+    def _schedule_pass(self, start, index, loop):
+        """1周分の拍を予約する。ループ再生なら、この周の頭で次の周を予約する（先の周まで溜めない）。"""
+        s = self._session
+        if s is None:
+            return
+        now = self.loop.time()
+        self._handles = [h for h in self._handles if h.when() > now and not h.cancelled()]
+        beat_length = 60.0 / s["tempo"]
+        pass_beats = s["beats_per_chord"] * len(s["progression"])
+        base = index * pass_beats
+        perf = time.perf_counter()
+        for b in range(pass_beats):
+            due = start + b * beat_length
+            self._handles.append(self.loop.call_later(max(0.0, due - self.lookahead - perf),
+                                                      self._tick, base + b, b, due))
+        if loop and pass_beats:
+            self._handles.append(self.loop.call_later(max(0.0, start - perf), self._schedule_pass,
+                                                      start + pass_beats * beat_length, index + 1, loop))
+
+    def _tick(self, beat, pass_beat, due):
+        s = self._session
+        if s is None:
+            return
+        i = pass_beat // s["beats_per_chord"]
+        msg = {"type": "tick", "beat": beat, "chord_index": i, "chord": s["progression"][i],
+               "tempo": s["tempo"], "t": clock(due), "sent": clock()}
+        if s["notes"] is not None and pass_beat % s["beats_per_chord"] == 0:
+            msg["notes"] = s["notes"][i]
+        self.broadcast(msg)
+
+    def _on_text(self, client, payload):
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return
+        if isinstance(msg, dict) and msg.get("type") == "ping":
+            # 受け取ってすぐ返す（この間の処理時間がずれの推定誤差になる）
+            client.transport.write(self._frame({"type": "pong", "client_time": msg.get("client_time"),
+                                                "server_time": clock()}))
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+            writer.close()
+            return
+        path, headers = _parse_request(request)
+        if headers.get("upgrade", "").lower() != "websocket":
+            if path.split("?")[0] in ("/", "/index.html"):
+                writer.write(_http_response("200 OK", CLIENT_HTML.encode("utf-8"), "text/html; charset=utf-8"))
+            else:
+                writer.write(_http_response("404 Not Found", b"not found\n"))
+            writer.close()
+            return
+        key = headers.get("sec-websocket-key")
+        if not key:
+            writer.write(_http_response("400 Bad Request", b"missing Sec-WebSocket-Key\n"))
+            writer.close()
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n").encode("ascii"))
+        sock = writer.get_extra_info("socket")
+        if self.sndbuf and sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        client = _Client(writer)
+        self.clients.add(client)
+        self.connected += 1
+        writer.write(self._session_frame)
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == OP_TEXT:
+                    self._on_text(client, payload)
+                elif opcode == OP_PING:
+                    writer.write(encode_frame(payload, OP_PONG))
+                elif opcode == OP_CLOSE:
+                    writer.write(encode_frame(payload[:2], OP_CLOSE))
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    def stats(self):
+        ft = sorted(self.fanout_times)
+        return {
+            "clients": len(self.clients),
+            "connected": self.connected,
+            "messages": self.messages,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "kicked": self.kicked,
+            "fanout_p50_ms": ft[len(ft) // 2] * 1000.0 if ft else None,
+            "fanout_max_ms": self.fanout_max * 1000.0 if ft else None,
+        }
+
+
+# ---------- ブラウザ用クライアント ----------
+CLIENT_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">
+<title>Jam</title>
+<style>
+body{font-family:sans-serif;margin:1em;background:#222;color:#eee}
+#chords span{display:inline-block;min-width:3em;padding:.6em;margin:.2em;border:1px solid #666;
+  border-radius:.3em;text-align:center;font-size:1.6em}
+#chords span.on{background:#e90;color:#000}
+#status{font-size:1.2em;margin:.6em 0}
+</style></head><body>
+<div id="chords"></div>
+<div id="status">connecting...</div>
+<label><input type="checkbox" id="play"> play locally</label>
+<script>
+const chords = document.getElementById("chords"), status = document.getElementById("status");
+let offset = 0, bestRtt = Infinity, beatsPerChord = 1, audio = null;  // offset = server clock - this clock (s)
+const now = () => Date.now() / 1000;
+document.getElementById("play").onchange = e => { if (e.target.checked && !audio) audio = new AudioContext(); };
+function strum(notes, at, dur) {
+  notes.forEach((n, k) => {
+    const o = audio.createOscillator(), g = audio.createGain(), t = at + k * 0.012;
+    o.type = "triangle";
+    o.frequency.value = 440 * Math.pow(2, (n - 69) / 12);
+    g.gain.setValueAtTime(0.2 / notes.length, t);
+    g.gain.exponentialRampToValueAtTime(0.001, t + dur);
+    o.connect(g).connect(audio.destination);
+    o.start(t);
+    o.stop(t + dur);
+  });
+}
+function connect() {
+  const ws = new WebSocket(`ws://${location.host}/ws`);
+  ws.onopen = () => {
+    for (let i = 0; i < 8; i++)
+      setTimeout(() => ws.readyState === 1 && ws.send(JSON.stringify({type: "ping", client_time: now()})), i * 250);
+  };
+  ws.onclose = () => { status.textContent = "reconnecting..."; setTimeout(connect, 1000); };
+  ws.onmessage = e => {
+    const m = JSON.parse(e.data), t = now();
+    if (m.type === "pong") {
+      const rtt = t - m.client_time;
+      if (rtt < bestRtt) { bestRtt = rtt; offset = m.server_time - (m.client_time + t) / 2; }
+    } else if (m.type === "session") {
+      chords.replaceChildren(...m.progression.map(c => {
+        const s = document.createElement("span"); s.textContent = c; return s;
+      }));
+      beatsPerChord = m.beats_per_chord || 1;
+      status.textContent = m.playing ? `${m.tempo} BPM` : "stopped";
+    } else if (m.type === "tick") {
+      const wait = Math.max(0, m.t - offset - now());
+      setTimeout(() => {
+        [...chords.children].forEach((s, i) => s.classList.toggle("on", i === m.chord_index));
+        status.textContent = `${m.tempo} BPM  ${m.chord}  ${m.beat % beatsPerChord + 1}/${beatsPerChord}`;
+      }, wait * 1000);
+      if (audio && m.notes) strum(m.notes, audio.currentTime + wait, 60 / m.tempo * beatsPerChord);
+    } else if (m.type === "stop") {
+      [...chords.children].forEach(s => s.classList.remove("on"));
+      status.textContent = "stopped";
+    }
+  };
+}
+connect();
+</script></body></html>
+"""
+
+
+# ---------- 負荷試験 ----------
+async def _sim_client(host, port, timeout, stall, ready):
+    """
+    ブラウザの代わりのクライアント。ping で時計のずれを測り、tick の届くまでの遅れと取りこぼしを数える。
+    stall: 接続してからこの秒数は一切読まない（固まったタブの代わり）。受信側のバッファも小さくしておく
+    """
+    slow = stall > 0
+    r = {"ticks": 0, "gaps": 0, "latencies": [], "margins": [], "sessions": 0, "closed": False, "slow": slow}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if slow:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.sock_connect(sock, (host, port))
+        # StreamReader は読まなくても limit の2倍までソケットから吸い上げるので、止まる側は小さくする
+        reader, writer = await asyncio.open_connection(sock=sock, limit=2048 if slow else 1 << 16)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        writer.write((f"GET /ws HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("ascii"))
+        head = await reader.readuntil(b"\r\n\r\n")
+        if b" 101 " not in head.split(b"\r\n", 1)[0] or accept_key(key).encode() not in head:
+            raise ConnectionError("handshake failed")
+    except (OSError, asyncio.IncompleteReadError):
+        ready()
+        r["closed"] = True
+        return r
+    offset, best = 0.0, float("inf")
+    for _ in range(3):
+        writer.write(encode_frame(json.dumps({"type": "ping", "client_time": time.time()}).encode(),
+                                  mask=os.urandom(4)))
+    ready()
+    deadline = loop.time() + timeout
+    last = None
+    try:
+        if slow:
+            await asyncio.sleep(stall)
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            _, payload = await asyncio.wait_for(read_frame(reader, 1 << 20), remaining)
+            t = time.time()
+            m = json.loads(payload)
+            kind = m["type"]
+            if kind == "pong":
+                rtt = t - m["client_time"]
+                if rtt < best:
+                    best, offset = rtt, m["server_time"] - (m["client_time"] + t) / 2
+            elif kind == "tick":
+                r["ticks"] += 1
+                if last is not None and m["beat"] != last + 1:
+                    r["gaps"] += 1
+                last = m["beat"]
+                r["latencies"].append(t + offset - m["sent"])
+                r["margins"].append(m["t"] - (t + offset))
+            elif kind == "session":
+                r["sessions"] += 1
+            elif kind == "stop":
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+        r["closed"] = True
+    writer.close()
+    return r
+
+
+def _client_worker(host, port, n, n_slow, stall, timeout, ready_q, result_q):
+    async def run():
+        tasks = [asyncio.create_task(_sim_client(host, port, timeout, stall if i < n_slow else 0.0,
+                                                 lambda: ready_q.put(1)))
+                 for i in range(n)]
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(run())
+    summary = []
+    for r in results:
+        lat = sorted(r["latencies"])
+        summary.append({
+            "slow": r["slow"], "ticks": r["ticks"], "gaps": r["gaps"], "closed": r["closed"],
+            "sessions": r["sessions"],
+            "lat_p50": lat[len(lat) // 2] if lat else None,
+            "lat_p99": lat[int(len(lat) * 0.99)] if lat else None,
+            "lat_max": lat[-1] if lat else None,
+            "late": sum(1 for m in r["margins"] if m < 0),
+        })
+    result_q.put(summary)
+
+
+def benchmark(clients=500, slow=10, seconds=10.0, tempo=1200, processes=None):
+    """
+    ローカルで clients 台のクライアントをつなぎ、tempo の拍を seconds 秒流す（既定は 20 tick/秒）。
+    slow 台は一切読まない固まったクライアントで、バックプレッシャで切断されるか、
+    ほかのクライアントの遅れに影響しないかを見る。クライアントは別プロセスで動かす。
+    """
+    progression = ["C", "G", "Am", "F"]
+    voicing = {"C": (48, 52, 55, 60, 64), "G": (43, 47, 50, 55, 59, 67),
+               "Am": (45, 52, 57, 60, 64), "F": (41, 48, 53, 57, 60, 65)}
+    # 負荷試験では送信バッファを小さくして、固まったクライアントが数秒で溢れるようにする
+    server = JamServer("127.0.0.1", 0, high_water=4096, max_drops=10, sndbuf=4096).start()
+    processes = processes or max(1, min(4, os.cpu_count() or 1))
+    ctx = multiprocessing.get_context("spawn")
+    ready_q, result_q = ctx.Queue(), ctx.Queue()
+    per = [clients // processes + (i < clients % processes) for i in range(processes)]
+    slow_per = [slow // processes + (i < slow % processes) for i in range(processes)]
+    procs = [ctx.Process(target=_client_worker,
+                         args=("127.0.0.1", server.port, per[i], slow_per[i], seconds + 1.0, seconds + 10.0,
+                               ready_q, result_q))
+             for i in range(processes)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    for _ in range(clients):
+        ready_q.get(timeout=60)
+    connect_s = time.perf_counter() - t0
+    cpu0 = time.process_time()
+    server.begin(progression, tempo, 4, time.perf_counter() + 0.5, loop=True, voicing=voicing.get, style="Pop")
+    time.sleep(seconds + 0.5)
+    server.end()
+    cpu = time.process_time() - cpu0
+    results = []
+    for _ in procs:
+        results.extend(result_q.get(timeout=60))
+    for p in procs:
+        p.join()
+    stats = server.stats()
+    server.close()
+
+    normal = [r for r in results if not r["slow"]]
+    stalled = [r for r in results if r["slow"]]
+    p50 = [r["lat_p50"] for r in normal if r["lat_p50"] is not None]
+    p99 = [r["lat_p99"] for r in normal if r["lat_p99"] is not None]
+    worst = max((r["lat_max"] for r in normal if r["lat_max"] is not None), default=float("nan"))
+    ticks = [r["ticks"] for r in normal]
+    print(f"{clients} clients ({slow} stalled) in {processes} process(es), connected in {connect_s:.2f} s")
+    print(f"server: {stats['messages']} messages, {stats['frames']} frames, "
+          f"fan-out p50 {stats['fanout_p50_ms']:.2f} ms / max {stats['fanout_max_ms']:.2f} ms per tick, "
+          f"cpu {cpu / seconds * 100:.0f}% of one core")
+    print(f"normal clients: ticks min/max {min(ticks)}/{max(ticks)}, "
+          f"gaps {sum(r['gaps'] for r in normal)}, late {sum(r['late'] for r in normal)}, "
+          f"disconnected {sum(r['closed'] for r in normal)}")
+    print(f"  delivery latency p50 {statistics.median(p50) * 1000:.2f} ms, "
+          f"p99 {statistics.median(p99) * 1000:.2f} ms, worst {worst * 1000:.2f} ms (lookahead {LOOKAHEAD * 1000:.0f} ms)")
+    print(f"stalled clients: dropped {stats['dropped']} ticks, kicked {stats['kicked']}/{slow}")
+    return stats, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Broadcast chord changes and beats to browsers on the LAN")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--tempo", type=int, default=100)
+    parser.add_argument("--bench", action="store_true", help="load test with local simulated clients")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args(argv)
+    if args.bench:
+        benchmark(clients=args.clients, seconds=args.seconds)
+        return
+    server = JamServer(args.host, args.port).start()
+    print(f"open {server.url()} on the student devices (Ctrl+C to stop)")
+    progression = ["C", "G", "Am", "F"]
+    server.begin(progression, args.tempo, 4, time.perf_counter() + 1.0, loop=True, style="Pop")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.end()
+        time.sleep(0.1)
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
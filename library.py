@@ -0,0 +1,236 @@
+# library.py
+# 進行を保存・検索するローカルの SQLite ライブラリ。
+# - WAL モード、まとめて1トランザクションで挿入（インポート向け）
+# - (key, コード列) の正規化ハッシュに UNIQUE 制約を付けて重複を防ぐ
+# - key / style / bars / 度数（ビットマスク）/ コード列・度数列の先頭一致で検索する
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+from midi_import import DEGREE_ROMANS
+from theory import roman_degree
+
+# main_3.py の Save Progression / Library ウィンドウが使うファイル
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "progressions.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS progressions (
+    id          INTEGER PRIMARY KEY,
+    hash        TEXT    NOT NULL UNIQUE,
+    key         TEXT    NOT NULL,
+    style       TEXT,
+    bars        INTEGER NOT NULL,
+    seed        INTEGER,
+    chords      TEXT    NOT NULL,
+    degrees     TEXT    NOT NULL,
+    degree_mask INTEGER NOT NULL,
+    created     REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_style_bars_key ON progressions(style, bars, key);
+CREATE INDEX IF NOT EXISTS idx_key_bars ON progressions(key, bars);
+-- (degree_mask & ?) = ? は B-tree では範囲にできないので、style + bars で絞った索引の中で
+-- 行を読まずに判定できるよう degree_mask を索引に含めておく
+CREATE INDEX IF NOT EXISTS idx_style_bars_mask ON progressions(style, bars, degree_mask);
+-- コード列・度数列の先頭一致（find(chords=..., degrees=...)）は範囲検索になる
+CREATE INDEX IF NOT EXISTS idx_chords ON progressions(chords);
+CREATE INDEX IF NOT EXISTS idx_degrees ON progressions(degrees);
+"""
+
+
+def canonical_hash(key, chords):
+    """キーとコード列だけから作るハッシュ（スタイルやシードが違っても同じ進行なら同じ値）。"""
+    text = key + "|" + " ".join(chords)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ProgressionLibrary:
+    """
+    path: SQLite ファイル
+    diatonic: DIATONIC_MAJOR（度数の計算に使う）
+    """
+
+    def __init__(self, path, diatonic):
+        self.path = path
+        self.diatonic = diatonic
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # ---------- 度数 ----------
+    def degrees_of(self, key, chords):
+        """コード列 -> ローマ数字の列（ダイアトニック外は '?'）。"""
+        scale = self.diatonic.get(key, [])
+        out = []
+        for c in chords:
+            if c in scale:
+                out.append(DEGREE_ROMANS[scale.index(c)])
+            elif c.endswith('7') and c[:-1] in scale:
+                out.append(DEGREE_ROMANS[scale.index(c[:-1])] + '7')
+            else:
+                out.append('?')
+        return out
+
+    @staticmethod
+    def normalize_romans(romans):
+        """
+        検索に渡されたローマ数字を degrees 列の表記（DEGREE_ROMANS、'7' は残す）にそろえる。
+        ROMAN_TO_INDEX の度数で引くので 'VI' も 'vi' も 'vi' になる。ローマ数字でなければ ValueError。
+        """
+        out = []
+        for r in romans:
+            d = roman_degree(r)
+            if d is None:
+                raise ValueError(f"unknown Roman numeral: {r!r}")
+            out.append(DEGREE_ROMANS[d] + ('7' if r.endswith('7') else ''))
+        return out
+
+    @staticmethod
+    def degree_mask(romans):
+        """degrees_of の結果 -> 含む度数のビットマスク（'?' は数えない）。"""
+        mask = 0
+        for r in romans:
+            r = r.replace('7', '')
+            if r in DEGREE_ROMANS:
+                mask |= 1 << DEGREE_ROMANS.index(r)
+        return mask
+
+    def _row(self, key, style, chords, seed=None):
+        chords = list(chords)
+        romans = self.degrees_of(key, chords)
+        return (canonical_hash(key, chords), key, style, len(chords), seed,
+                " ".join(chords), " ".join(romans), self.degree_mask(romans), time.time())
+
+    # ---------- 追加 ----------
+    def add(self, key, style, chords, seed=None):
+        """1件追加。新しく入ったら id、既にあれば None。"""
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO progressions "
+                "(hash, key, style, bars, seed, chords, degrees, degree_mask, created) VALUES (?,?,?,?,?,?,?,?,?)",
+                self._row(key, style, chords, seed))
+        return cur.lastrowid if cur.rowcount else None
+
+    def add_many(self, rows, batch=10000):
+        """
+        rows: (key, style, chords, seed) のイテラブル。batch 件ごとに1トランザクション。
+        新しく入った件数を返す。
+        """
+        inserted = 0
+        buf = []
+        sql = ("INSERT OR IGNORE INTO progressions "
+               "(hash, key, style, bars, seed, chords, degrees, degree_mask, created) VALUES (?,?,?,?,?,?,?,?,?)")
+        for key, style, chords, seed in rows:
+            buf.append(self._row(key, style, chords, seed))
+            if len(buf) >= batch:
+                inserted += self._flush(sql, buf)
+                buf = []
+        if buf:
+            inserted += self._flush(sql, buf)
+        return inserted
+
+    def _flush(self, sql, buf):
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(sql, buf)
+        return self.conn.total_changes - before
+
+    # ---------- 検索 ----------
+    def find(self, key=None, style=None, bars=None, contains=(), chords=None, degrees=None, limit=100):
+        """
+        例: find(style='Rock', bars=8, contains=['vi'])
+        contains のローマ数字をすべて含む進行を返す。[(id, key, style, bars, seed, chords[list]), ...]
+        chords / degrees: コード列・度数列がこれで始まる進行（例: degrees=['I', 'V', 'vi']）
+        contains / degrees のローマ数字は normalize_romans でそろえる（知らない表記は ValueError）。
+        """
+        where = []
+        args = []
+        for col, val in (("style", style), ("bars", bars), ("key", key)):
+            if val is not None:
+                where.append(f"{col} = ?")
+                args.append(val)
+        mask = self.degree_mask(self.normalize_romans(contains))
+        if degrees:
+            degrees = self.normalize_romans(degrees)
+        if mask:
+            where.append("(degree_mask & ?) = ?")
+            args += [mask, mask]
+        for col, seq in (("chords", chords), ("degrees", degrees)):
+            if seq:
+                # "I V" は "I V" と "I V ..." に当たり、"I V7" には当たらない（' ' の次に来る文字はない）
+                text = " ".join(seq)
+                where.append(f"{col} BETWEEN ? AND ?")
+                args += [text, text + " \U0010ffff"]
+        sql = "SELECT id, key, style, bars, seed, chords FROM progressions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " LIMIT ?"
+        args.append(limit)
+        return [(i, k, s, b, seed, chords.split(" ")) for i, k, s, b, seed, chords in self.conn.execute(sql, args)]
+
+    def get(self, prog_id):
+        row = self.conn.execute(
+            "SELECT id, key, style, bars, seed, chords FROM progressions WHERE id = ?", (prog_id,)).fetchone()
+        if row is None:
+            return None
+        i, k, s, b, seed, chords = row
+        return (i, k, s, b, seed, chords.split(" "))
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM progressions").fetchone()[0]
+
+
+def benchmark(n=1_000_000, queries=200):
+    """n 件の一括挿入と、style + bars + 度数 の検索のスループット。"""
+    import random
+    import tempfile
+    from theory import DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, generate_progression
+
+    path = os.path.join(tempfile.mkdtemp(prefix="lib_"), "bench.db")
+    lib = ProgressionLibrary(path, DIATONIC_MAJOR)
+    keys = list(DIATONIC_MAJOR)
+    styles = list(COMMON_PATTERNS)
+    rng = random.Random(0)
+    # パターンの組み合わせだけだと重複ばかりになるので、コードを一部ランダムに差し替える
+    pool = sorted({c for chords in DIATONIC_MAJOR.values() for c in chords} | set(CHORD_SHAPES))
+
+    def rows():
+        for i in range(n):
+            key = rng.choice(keys)
+            style = rng.choice(styles)
+            bars = rng.choice((4, 8, 16))
+            prog = generate_progression(key, style, bars, rng=rng)
+            prog[rng.randrange(bars)] = rng.choice(pool)
+            prog[rng.randrange(bars)] = rng.choice(pool)
+            yield key, style, prog, i
+
+    t0 = time.perf_counter()
+    inserted = lib.add_many(rows())
+    t1 = time.perf_counter()
+    print(f"insert: {n:,} rows ({inserted:,} unique) in {t1 - t0:.1f}s = {n / (t1 - t0):,.0f} rows/s")
+
+    t0 = time.perf_counter()
+    hits = 0
+    for i in range(queries):
+        hits += len(lib.find(style=styles[i % len(styles)], bars=8, contains=['vi'], limit=100))
+    t1 = time.perf_counter()
+    print(f"query (style, bars=8, contains vi, limit 100): {(t1 - t0) / queries * 1000:.2f} ms/query ({hits} rows)")
+
+    t0 = time.perf_counter()
+    hits = 0
+    for i in range(queries):
+        hits += len(lib.find(degrees=['I', 'V', 'vi'], limit=100))
+        hits += len(lib.find(chords=[keys[i % len(keys)]], limit=100))
+    t1 = time.perf_counter()
+    print(f"query (degrees / chords prefix, limit 100): {(t1 - t0) / (2 * queries) * 1000:.2f} ms/query ({hits} rows)")
+    lib.close()
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
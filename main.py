@@ -1,74 +1,33 @@
 import tkinter as tk
 from tkinter import ttk
-import random
 import pygame.midi
 import time
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
+from stylepacks import load_tables
+from seeding import make_rng
 
 # ---------- データ定義 ----------
 
-DIATONIC_MAJOR = {
-    'C': ['C','Dm','Em','F','G','Am','Bdim'],
-    'G': ['G','Am','Bm','C','D','Em','F#dim'],
-    'D': ['D','Em','F#m','G','A','Bm','C#dim'],
-    'A': ['A','Bm','C#m','D','E','F#m','G#dim'],
-    'E': ['E','F#m','G#m','A','B','C#m','D#dim'],
-    'F': ['F','Gm','Am','Bb','C','Dm','Edim']
-}
-
-COMMON_PATTERNS = {
-    'Pop': [
-        ['I','V','vi','IV'],
-        ['I','vi','IV','V'],
-        ['vi','IV','I','V']
-    ],
-    'Rock': [
-        ['I','IV','V','IV'],
-        ['I','V','I','V']
-    ],
-    'Ballad': [ 
-        ['I','vi','IV','V'],
-        ['I','V','vi','IV'] 
-    ], 
-}
-
-CHORD_SHAPES = {
-    'C': 'x32010',
-    'G': '320003',
-    'Am': 'x02210',
-    'F': '133211',
-    'Dm': 'xx0231',
-    'Em': '022000',
-    'D': 'xx0232',
-    'E': '022100',
-    'A': 'x02220',
-    'Bm': 'x24432',
-    'F#m': '244222' 
-}
+# styles/ のスタイルパックから読む（stylepacks.py。main_2.py / main_3.py と共通）
+DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI = load_tables()
 
 ROMAN_TO_INDEX = {'I':0,'ii':1,'II':1,'iii':2,'III':2,'IV':3,'V':4,'vi':5,'VI':5,'vii°':6,'VII':6}
 
-NOTE_TO_MIDI = {
-    'C': 60, 'C#': 61, 'Db': 61,
-    'D': 62, 'D#': 63, 'Eb': 63,
-    'E': 64, 'F': 65, 'F#': 66, 'Gb': 66,
-    'G': 67, 'G#': 68, 'Ab': 68,
-    'A': 69, 'A#': 70, 'Bb': 70,
-    'B': 71
-} 
-
 # ---------- コード関連 ----------
 
 def roman_to_chord(roman, key):
     roman = roman.replace("°", "")
     idx = ROMAN_TO_INDEX.get(roman, 0)
-    chords = DIATONIC_MAJOR.get(key, DIATONIC_MAJOR['C'])
+    chords = DIATONIC_MAJOR.get(key) or next(iter(DIATONIC_MAJOR.values()))
     return chords[idx]
 
-def generate_progression(key, style, bars=4):
-    patterns = COMMON_PATTERNS.get(style, COMMON_PATTERNS['Pop'])
-    pattern = random.choice(patterns)
+def generate_progression(key, style, bars=4, rng=None):
+    """rng: random.Random（省略時は新しいシードで作る）。シード付きで渡せば結果を再現できる。"""
+    if rng is None:
+        rng, _ = make_rng()
+    patterns = COMMON_PATTERNS.get(style) or next(iter(COMMON_PATTERNS.values()))
+    pattern = rng.choice(patterns)
     prog = []
     i = 0
     while len(prog) < bars:
@@ -95,11 +54,15 @@ def chord_to_midi_notes(chord_name):
     else:
         return [root_note, root_note+4, root_note+7]
 
-def play_chord(chord_name):
+# pygame.midi と同じ関数を持つもの。virtual_midi.VirtualMidi() に差し替えればデバイスなしで動く
+MIDI_BACKEND = pygame.midi
+
+def play_chord(chord_name, backend=None, device_id=0):
+    backend = backend or MIDI_BACKEND
     notes = chord_to_midi_notes(chord_name)
-    pygame.midi.init()
+    backend.init()
     try:
-        player = pygame.midi.Output(0)
+        player = backend.Output(device_id)
         volume = 100
         for note in notes:
             player.note_on(note, volume)
@@ -110,7 +73,7 @@ def play_chord(chord_name):
     except Exception as e:
         print("音を再生できません:", e)
     finally:
-        pygame.midi.quit()
+        backend.quit()
 
 # ---------- GUI ----------
 
@@ -159,8 +122,9 @@ def on_generate():
 
     key = key_var.get()
     style = style_var.get()
-    progression = generate_progression(key, style)
-    result = f"Key: {key}  Style: {style}\n\nProgression: | " + " | ".join(progression) + " |\n\n"
+    rng, seed = make_rng()
+    progression = generate_progression(key, style, rng=rng)
+    result = f"Key: {key}  Style: {style}  Seed: {seed}\n\nProgression: | " + " | ".join(progression) + " |\n\n"
     for chord in progression:
         result += f"{chord:4s} → {get_shape(chord)}\n"
 
@@ -1,78 +1,21 @@
 # improved_chord_generator.py
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import random
 import pygame.midi
 import time
 import threading
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
 from collections import OrderedDict
+from stylepacks import load_tables
+from seeding import make_rng
 
 # ---------- データ定義 ----------
-DIATONIC_MAJOR = {
-    'C': ['C','Dm','Em','F','G','Am','Bdim'],
-    'G': ['G','Am','Bm','C','D','Em','F#dim'],
-    'D': ['D','Em','F#m','G','A','Bm','C#dim'],
-    'A': ['A','Bm','C#m','D','E','F#m','G#dim'],
-    'E': ['E','F#m','G#m','A','B','C#m','D#dim'],
-    'B': ['B','C#m','D#m','E','F#','G#m','A#dim'],
-    'F#': ['F#','G#m','A#m','B','C#','D#m','E#dim'],
-    'Gb': ['Gb','Abm','Bbm','Cb','Db','Ebm','Fdim'],
-    'F': ['F','Gm','Am','Bb','C','Dm','Edim'],
-    'Bb': ['Bb','Cm','Dm','Eb','F','Gm','Adim'],
-    'Eb': ['Eb','Fm','Gm','Ab','Bb','Cm','Ddim'],
-    'Ab': ['Ab','Bbm','Cm','Db','Eb','Fm','Gdim']
-}
-
-COMMON_PATTERNS = {
-    'Pop': [
-        ['I','V','vi','IV'],
-        ['I','vi','IV','V'],
-        ['vi','IV','I','V']
-    ],
-    'Rock': [
-        ['I','IV','V','IV'],
-        ['I','V','I','V']
-    ],
-    'Ballad': [ 
-        ['I','vi','IV','V'],
-        ['I','V','vi','IV'] 
-    ],
-    'Blues': [
-        ['I','IV','I','V'],
-        ['I','I','IV','I','V','IV','I','V']
-    ]
-}
-
-CHORD_SHAPES = {
-    'C': 'x32010',
-    'G': '320003',
-    'Am': 'x02210',
-    'F': '133211',
-    'Dm': 'xx0231',
-    'Em': '022000',
-    'D': 'xx0232',
-    'E': '022100',
-    'A': 'x02220',
-    'Bm': 'x24432',
-    'F#m': '244222',
-    'B': 'x24442',
-    'Bb': 'x13331'
-}
+# styles/ のスタイルパックから読む（stylepacks.py。main.py / main_3.py と共通）
+DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI = load_tables()
 
 ROMAN_TO_INDEX = {'I':0,'ii':1,'II':1,'iii':2,'III':2,'IV':3,'V':4,'vi':5,'VI':5,'vii°':6,'VII':6}
 
-# midi note mapping for 4th octave
-NOTE_TO_MIDI = {
-    'C': 60, 'C#': 61, 'Db': 61,
-    'D': 62, 'D#': 63, 'Eb': 63,
-    'E': 64, 'F': 65, 'F#': 66, 'Gb': 66,
-    'G': 67, 'G#': 68, 'Ab': 68,
-    'A': 69, 'A#': 70, 'Bb': 70,
-    'B': 71
-}
-
 # ---------- ロジック ----------
 def roman_to_chord(roman, key):
     """
@@ -88,7 +31,7 @@ def roman_to_chord(roman, key):
         roman = roman[:-1]
 
     idx = ROMAN_TO_INDEX.get(roman, 0)
-    chords = DIATONIC_MAJOR.get(key, DIATONIC_MAJOR['C'])
+    chords = DIATONIC_MAJOR.get(key) or next(iter(DIATONIC_MAJOR.values()))
     base = chords[idx]
     if add7:
         # 簡易: メジャーなら7（maj7ではなくdom7表記は行わない）を付加、マイナーはm7
@@ -98,9 +41,12 @@ def roman_to_chord(roman, key):
             return base + '7'
     return base
 
-def generate_progression(key, style, bars=4):
-    patterns = COMMON_PATTERNS.get(style, COMMON_PATTERNS['Pop'])
-    pattern = random.choice(patterns)
+def generate_progression(key, style, bars=4, rng=None):
+    """rng: random.Random（省略時は新しいシードで作る）。シード付きで渡せば結果を再現できる。"""
+    if rng is None:
+        rng, _ = make_rng()
+    patterns = COMMON_PATTERNS.get(style) or next(iter(COMMON_PATTERNS.values()))
+    pattern = rng.choice(patterns)
     prog = []
     i = 0
     while len(prog) < bars:
@@ -333,8 +279,9 @@ class ChordApp:
         key = self.key_var.get()
         style = self.style_var.get()
         bars = self.bars_var.get()
-        progression = generate_progression(key, style, bars)
-        result = f"Key: {key}    Style: {style}    Bars: {bars}\n\nProgression: | " + " | ".join(progression) + " |\n\n"
+        rng, seed = make_rng()
+        progression = generate_progression(key, style, bars, rng=rng)
+        result = f"Key: {key}    Style: {style}    Bars: {bars}    Seed: {seed}\n\nProgression: | " + " | ".join(progression) + " |\n\n"
         for chord in progression:
             result += f"{chord:6s} → {get_shape(chord)}\n"
 
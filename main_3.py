@@ -1,237 +1,45 @@
 # improved_chord_generator.py
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import random
-import pygame.midi
 import time
 import threading
+import os
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
 from collections import OrderedDict 
+from instrumentation import PlaybackMetrics, MetricsOverlay
+from arrangement import ARRANGEMENTS, compile_progression
+from seeding import make_rng, derive_seed, GenerationLog
+from synth import SampleBank, make_renderer, BuiltinRenderer
+from mixer import render_events
+from library import ProgressionLibrary, LIBRARY_PATH
+from calibration import LatencyProfile, LATENCY_PROFILE_PATH
+from playhead import PlayheadFeed, PlayheadView
+from recorder import SessionRecorder
+from groove import GROOVES, humanize
+from chart import GlyphCache, render_page, entry_title
+from jam import JamServer
+from melody import MelodyLane
+import theory
+from theory import STYLE_STORE, apply_styles, cached_progression, resolve_voicing, cached_notes, suggest_capo, results
+from playback import MidiManager, play_progression
+
+# ---------- データ・ロジック ----------
+# コードの表・生成・ボイシングは theory.py、MIDI 出力と再生ループは playback.py（どちらも GUI なし）。
+# 表はスタイルパックの読み直しで付け替わるので theory.DIATONIC_MAJOR のように参照する
+midi = MidiManager()
 
-# ---------- データ定義 ----------
-DIATONIC_MAJOR = {
-    'C': ['C','Dm','Em','F','G','Am','Bdim'],
-    'G': ['G','Am','Bm','C','D','Em','F#dim'],
-    'D': ['D','Em','F#m','G','A','Bm','C#dim'],
-    'A': ['A','Bm','C#m','D','E','F#m','G#dim'],
-    'E': ['E','F#m','G#m','A','B','C#m','D#dim'],
-    'B': ['B','C#m','D#m','E','F#','G#m','A#dim'],
-    'F#': ['F#','G#m','A#m','B','C#','D#m','E#dim'],
-    'Gb': ['Gb','Abm','Bbm','Cb','Db','Ebm','Fdim'],
-    'F': ['F','Gm','Am','Bb','C','Dm','Edim'],
-    'Bb': ['Bb','Cm','Dm','Eb','F','Gm','Adim'],
-    'Eb': ['Eb','Fm','Gm','Ab','Bb','Cm','Ddim'],
-    'Ab': ['Ab','Bbm','Cm','Db','Eb','Fm','Gdim']
-}
-
-COMMON_PATTERNS = {
-    'Pop': [
-        ['I','V','vi','IV'],
-        ['I','vi','IV','V'],
-        ['vi','IV','I','V']
-    ],
-    'Rock': [
-        ['I','IV','V','IV'],
-        ['I','V','I','V']
-    ],
-    'Ballad': [ 
-        ['I','vi','IV','V'],
-        ['I','V','vi','IV'] 
-    ],
-    'Blues': [
-        ['I','IV','I','V'],
-        ['I','I','IV','I','V','IV','I','V']
-    ]
-}
-
-CHORD_SHAPES = {
-    'C': 'x32010',
-    'G': '320003',
-    'Am': 'x02210',
-    'F': '133211',
-    'Dm': 'xx0231',
-    'Em': '022000',
-    'D': 'xx0232',
-    'E': '022100',
-    'A': 'x02220',
-    'Bm': 'x24432',
-    'F#m': '244222',
-    'B': 'x24442',
-    'Bb': 'x13331'
-}
-
-ROMAN_TO_INDEX = {'I':0,'ii':1,'II':1,'iii':2,'III':2,'IV':3,'V':4,'vi':5,'VI':5,'vii°':6,'VII':6}
-
-# midi note mapping for 4th octave
-NOTE_TO_MIDI = {
-    'C': 60, 'C#': 61, 'Db': 61,
-    'D': 62, 'D#': 63, 'Eb': 63,
-    'E': 64, 'F': 65, 'F#': 66, 'Gb': 66,
-    'G': 67, 'G#': 68, 'Ab': 68,
-    'A': 69, 'A#': 70, 'Bb': 70,
-    'B': 71
-}
-
-# ---------- ロジック ----------
-def roman_to_chord(roman, key):
-    """
-    シンプルにローマ数字をDIATONIC_MAJORの対応するコードに変換する。
-    小文字はマイナーを表示(だしスケールの指定に従う）。
-    '7' サフィックスがあれば簡易的に7thを追加(テンションは考慮せず表記のみ）。
-    """
-    roman_in = roman
-    roman = roman.replace("°", "")
-    add7 = False
-    if roman.endswith('7'):
-        add7 = True
-        roman = roman[:-1]
-
-    idx = ROMAN_TO_INDEX.get(roman, 0)
-    chords = DIATONIC_MAJOR.get(key, DIATONIC_MAJOR['C'])
-    base = chords[idx]
-    if add7:
-        # 簡易: メジャーなら7（maj7ではなくdom7表記は行わない）を付加、マイナーはm7
-        if 'm' in base:
-            return base + '7'  # Em -> Em7
-        else:
-            return base + '7'
-    return base
-
-def generate_progression(key, style, bars=4):
-    patterns = COMMON_PATTERNS.get(style, COMMON_PATTERNS['Pop'])
-    pattern = random.choice(patterns)
-    prog = []
-    i = 0
-    while len(prog) < bars:
-        prog.append(roman_to_chord(pattern[i % len(pattern)], key))
-        i += 1
-    return prog
-
-def get_shape(chord):
-    return CHORD_SHAPES.get(chord, "N/A")
-
-def parse_chord_name(chord_name):
-    """
-    ルートとタイプを分離。例: 'F#m7' -> ('F#','m7')
-    """
-    if len(chord_name) >= 2 and chord_name[1] in ['#', 'b']:
-        root = chord_name[:2]
-        chord_type = chord_name[2:]
-    else:
-        root = chord_name[0]
-        chord_type = chord_name[1:]
-    return root, chord_type
-
-def chord_to_midi_notes(chord_name, octave_offset=0):
-    """
-    より柔軟な変換。
-    - メジャー: 0, +4, +7
-    - マイナー: 0, +3, +7
-    - 7th (dominant/maj/min を簡易): 0,+4,+7,+10 (4音で演奏)
-    octave_offset: ±12 per octave
-    """
-    root, ctype = parse_chord_name(chord_name)
-    root_note = NOTE_TO_MIDI.get(root, 60) + octave_offset
-    notes = []
-    if 'm' in ctype and 'maj' not in ctype and '7' not in ctype:
-        notes = [root_note, root_note+3, root_note+7]
-    elif '7' in ctype:
-        # simplistic: include 7th (dominant/minor/maj not fully distinguished)
-        if 'maj' in ctype or 'M' in ctype:
-            # maj7 -> 0,4,7,11
-            notes = [root_note, root_note+4, root_note+7, root_note+11]
-        elif 'm' in ctype:
-            # m7 -> 0,3,7,10
-            notes = [root_note, root_note+3, root_note+7, root_note+10]
-        else:
-            # dominant 7
-            notes = [root_note, root_note+4, root_note+7, root_note+10]
-    else:
-        notes = [root_note, root_note+4, root_note+7]
-    # ensure in reasonable midi range
-    notes = [max(0, min(127, n)) for n in notes]
-    return notes
-
-# ---------- MIDI ハンドリング（シングルトン風） ----------
-class MidiManager:
-    def __init__(self):
-        self.initialized = False
-        self.output = None
-        self.device_id = None
-        self.lock = threading.Lock()
-
-    def init(self):
-        if not self.initialized:
-            try:
-                pygame.midi.init()
-                self.initialized = True
-            except Exception as e:
-                print("MIDI init error:", e)
-                self.initialized = False
+# スタイルパックの変更を確認する間隔
+STYLE_POLL_MS = 1000
 
-    def list_devices(self):
-        self.init()
-        devs = []
-        try:
-            for i in range(pygame.midi.get_count()):
-                info = pygame.midi.get_device_info(i)
-                interf, name, is_input, is_output, opened = info
-                name = name.decode('utf-8') if isinstance(name, bytes) else str(name)
-                devs.append((i, name, bool(is_output)))
-        except Exception as e:
-            print("Device listing error:", e)
-        return devs
+# レンダリングしたコードの PCM のディスクキャッシュ（cache.ResultCache.renders の2段目）
+RENDER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_cache")
 
-    def open_output(self, device_id):
-        self.init()
-        with self.lock:
-            try:
-                if self.output:
-                    try:
-                        self.output.close()
-                    except:
-                        pass
-                self.output = pygame.midi.Output(device_id)
-                self.device_id = device_id
-                return True
-            except Exception as e:
-                print("open_output error:", e)
-                self.output = None
-                return False
-
-    def note_on(self, note, vel=100):
-        with self.lock:
-            if self.output:
-                try:
-                    self.output.note_on(int(note), int(vel))
-                except:
-                    pass
-
-    def note_off(self, note, vel=100):
-        with self.lock:
-            if self.output:
-                try:
-                    self.output.note_off(int(note), int(vel))
-                except:
-                    pass
-
-    def close(self):
-        with self.lock:
-            try:
-                if self.output:
-                    self.output.close()
-                    self.output = None
-            except:
-                pass
-            try:
-                if self.initialized:
-                    pygame.midi.quit()
-                    self.initialized = False
-            except:
-                pass
+# 生成ログ（seeding.replay で同じセッションを再現できる）
+GENERATION_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generation_log.jsonl")
 
-midi = MidiManager()
+# Jam（jam.py）の待ち受けポート
+JAM_PORT = 8765
 
 # ---------- GUI ----------
 class ChordApp:
@@ -239,8 +47,35 @@ class ChordApp:
         self.root = root
         self.play_thread = None
         self.play_flag = threading.Event()
+        self.metrics = PlaybackMetrics()
+        self.metrics_overlay = None
+        try:
+            self.generation_log = GenerationLog(GENERATION_LOG_PATH)
+        except (OSError, ValueError) as e:
+            print("generation log error:", e)
+            self.generation_log = None
+        self.samples = None
+        results.use_disk(RENDER_CACHE_DIR)
+        self.library = ProgressionLibrary(LIBRARY_PATH, theory.DIATONIC_MAJOR)
+        # 同時に鳴らす出力デバイス（Outputs... で選ぶ）。空なら MIDI Device の1台だけ
+        self.fanout_ids = []
+        self.jam = None     # Jam を入れている間の jam.JamServer
+        try:
+            profile = LatencyProfile.load(LATENCY_PROFILE_PATH)
+            for name in profile.invalid:
+                print("latency profile error: skipped invalid entry", repr(name))
+            midi.latencies = profile.latencies()
+        except (OSError, ValueError) as e:
+            print("latency profile error:", e)
+        # 送ったイベントはすべて sessions/ に記録する（python recorder.py replay/midi/wav で再現）。
+        # 起動ごとに1ファイルで、古いものは open_new が消す（新しい SESSIONS_KEEP 個だけ残る）
+        try:
+            midi.recorder = SessionRecorder.open_new()
+        except OSError as e:
+            print("session recorder error:", e)
         self.build_ui()
         self.populate_midi_devices()
+        self.root.after(STYLE_POLL_MS, self.poll_styles)
 
     def build_ui(self):
         # title
@@ -252,12 +87,12 @@ class ChordApp:
 
         tb.Label(control_frame, text="Key:", font=("Segoe UI", 11)).grid(row=0, column=0, sticky='w', padx=4)
         self.key_var = tk.StringVar(value="C")
-        self.key_menu = tb.Combobox(control_frame, textvariable=self.key_var, values=list(DIATONIC_MAJOR.keys()), width=6, state="readonly", bootstyle="info")
+        self.key_menu = tb.Combobox(control_frame, textvariable=self.key_var, values=list(theory.DIATONIC_MAJOR.keys()), width=6, state="readonly", bootstyle="info")
         self.key_menu.grid(row=0, column=1, padx=6)
 
         tb.Label(control_frame, text="Style:", font=("Segoe UI", 11)).grid(row=0, column=2, sticky='w', padx=4)
         self.style_var = tk.StringVar(value="Pop")
-        self.style_menu = tb.Combobox(control_frame, textvariable=self.style_var, values=list(COMMON_PATTERNS.keys()), width=10, state="readonly", bootstyle="info")
+        self.style_menu = tb.Combobox(control_frame, textvariable=self.style_var, values=list(theory.COMMON_PATTERNS.keys()), width=10, state="readonly", bootstyle="info")
         self.style_menu.grid(row=0, column=3, padx=6)
 
         tb.Label(control_frame, text="Bars:", font=("Segoe UI", 11)).grid(row=0, column=4, sticky='w', padx=4)
@@ -265,6 +100,12 @@ class ChordApp:
         self.bars_spin = tb.Spinbox(control_frame, from_=1, to=16, textvariable=self.bars_var, width=5)
         self.bars_spin.grid(row=0, column=5, padx=6)
 
+        tb.Label(control_frame, text="Seed:", font=("Segoe UI", 11)).grid(row=0, column=6, sticky='w', padx=4)
+        # 空欄なら毎回新しいシード。数値を入れるとその進行を再現する
+        self.seed_var = tk.StringVar(value="")
+        self.seed_entry = tb.Entry(control_frame, textvariable=self.seed_var, width=14)
+        self.seed_entry.grid(row=0, column=7, padx=6)
+
         tb.Label(control_frame, text="Tempo (BPM):", font=("Segoe UI", 11)).grid(row=1, column=0, sticky='w', padx=4, pady=6)
         self.tempo_var = tk.IntVar(value=90)
         self.tempo_slider = tb.Scale(control_frame, from_=40, to=200, orient='horizontal', bootstyle="info", variable=self.tempo_var, length=220)
@@ -275,6 +116,9 @@ class ChordApp:
         self.midi_menu = tb.Combobox(control_frame, textvariable=self.midi_var, values=[], width=24, state="readonly", bootstyle="info")
         self.midi_menu.grid(row=1, column=5, padx=6)
 
+        self.outputs_btn = tb.Button(control_frame, text="Outputs...", bootstyle="secondary-outline", command=self.on_outputs)
+        self.outputs_btn.grid(row=1, column=6, padx=6)
+
         # output frame
         output_frame = tb.Labelframe(self.root, text="Generated Progression", bootstyle="secondary")
         output_frame.pack(pady=8, fill="both", padx=12, expand=True)
@@ -292,30 +136,83 @@ class ChordApp:
         self.save_btn = tb.Button(bottom_frame, text="Save Progression", bootstyle="secondary-outline", command=self.on_save)
         self.save_btn.pack(side='left', padx=6)
 
+        self.library_btn = tb.Button(bottom_frame, text="Library", bootstyle="secondary-outline", command=self.on_library)
+        self.library_btn.pack(side='left', padx=6)
+
         self.play_btn = tb.Button(bottom_frame, text="Play Progression", bootstyle="info", command=self.on_play)
         self.play_btn.pack(side='left', padx=6)
 
         self.stop_btn = tb.Button(bottom_frame, text="Stop", bootstyle="danger", command=self.on_stop)
         self.stop_btn.pack(side='left', padx=6)
 
+        self.wav_btn = tb.Button(bottom_frame, text="Export WAV", bootstyle="secondary-outline", command=self.on_export_wav)
+        self.wav_btn.pack(side='left', padx=6)
+
+        self.chart_btn = tb.Button(bottom_frame, text="Export Chart", bootstyle="secondary-outline", command=self.on_export_chart)
+        self.chart_btn.pack(side='left', padx=6)
+
         # options
         options_frame = tb.Frame(self.root)
         options_frame.pack(pady=6, fill='x', padx=12)
         self.play_style_var = tk.StringVar(value="Block")
         tb.Radiobutton(options_frame, text="Block (ストローク)", variable=self.play_style_var, value="Block", bootstyle="info").pack(side='left', padx=6)
+        tb.Radiobutton(options_frame, text="Legato (共通音を保持)", variable=self.play_style_var, value="Legato", bootstyle="info").pack(side='left', padx=6)
         tb.Radiobutton(options_frame, text="Arpeggio (アルペジオ)", variable=self.play_style_var, value="Arp", bootstyle="info").pack(side='left', padx=6)
+        tb.Radiobutton(options_frame, text="Band (ストローク+ベース+ドラム)", variable=self.play_style_var, value="Band", bootstyle="info").pack(side='left', padx=6)
 
         self.loop_var = tk.BooleanVar(value=False)
         tb.Checkbutton(options_frame, text="Loop", variable=self.loop_var, bootstyle="success").pack(side='left', padx=8)
 
+        # グルーブ（groove.py）。進行のシードから乱数を作るので、同じ進行なら同じノリで鳴る
+        tb.Label(options_frame, text="Groove:", font=("Segoe UI", 11)).pack(side='left', padx=(8, 2))
+        self.groove_var = tk.StringVar(value="Straight")
+        tb.Combobox(options_frame, textvariable=self.groove_var, values=list(GROOVES), width=9,
+                    state="readonly", bootstyle="info").pack(side='left', padx=4)
+
+        # Sampler: コードボタンを事前レンダリングした音声で鳴らす（MIDIデバイス不要）
+        self.sampler_var = tk.BooleanVar(value=False)
+        tb.Checkbutton(options_frame, text="Sampler", variable=self.sampler_var, bootstyle="success").pack(side='left', padx=8)
+
+        self.metrics_var = tk.BooleanVar(value=False)
+        tb.Checkbutton(options_frame, text="Metrics", variable=self.metrics_var, bootstyle="secondary", command=self.on_toggle_metrics).pack(side='left', padx=8)
+
+        # Melody: 進行の上にリードを作って別チャンネルで鳴らす（melody.py）
+        self.melody_var = tk.BooleanVar(value=False)
+        tb.Checkbutton(options_frame, text="Melody", variable=self.melody_var, bootstyle="success").pack(side='left', padx=8)
+
+        # Jam: 再生中のコードと拍を LAN のブラウザに配る（jam.py）
+        self.jam_var = tk.BooleanVar(value=False)
+        tb.Checkbutton(options_frame, text="Jam", variable=self.jam_var, bootstyle="warning", command=self.on_toggle_jam).pack(side='left', padx=8)
+
         # chord buttons area
         self.chord_buttons_frame = tb.Frame(self.root)
         self.chord_buttons_frame.pack(pady=8, fill='x', padx=12)
 
+        # 再生位置（今のコードと指板上の音）。再生スレッドは feed に積むだけで、描画は Tk スレッド
+        self.playhead_feed = PlayheadFeed()
+        self.playhead = PlayheadView(self.root, self.playhead_feed)
+        self.playhead.pack(pady=4, padx=12)
+
         # footer
         footer = tb.Label(self.root, text="Created by KAZUMA KOHARA", font=("Segoe UI", 10), bootstyle="secondary")
         footer.pack(side="bottom", pady=6)
 
+    def poll_styles(self):
+        # スタイルパックが編集されていれば読み直す（stat だけなので毎秒でも軽い）
+        try:
+            if STYLE_STORE.changed():
+                if STYLE_STORE.reload_if_changed():
+                    apply_styles(STYLE_STORE.tables)
+                    self.library.diatonic = theory.DIATONIC_MAJOR
+                    results.validate()
+                    self.key_menu.configure(values=list(theory.DIATONIC_MAJOR.keys()))
+                    self.style_menu.configure(values=list(theory.COMMON_PATTERNS.keys()))
+                for e in STYLE_STORE.errors:
+                    print("style pack error:", e)
+        except OSError as e:
+            print("style reload error:", e)
+        self.root.after(STYLE_POLL_MS, self.poll_styles)
+
     def populate_midi_devices(self):
         devs = midi.list_devices()
         out_devs = [f"{i}: {name}" for (i, name, is_out) in devs if is_out]
@@ -327,28 +224,78 @@ class ChordApp:
             self.midi_menu.set("(Auto)")
 
     def on_generate(self):
-        for w in self.chord_buttons_frame.winfo_children():
-            w.destroy()
-
         key = self.key_var.get()
         style = self.style_var.get()
         bars = self.bars_var.get()
-        progression = generate_progression(key, style, bars)
-        result = f"Key: {key}    Style: {style}    Bars: {bars}\n\nProgression: | " + " | ".join(progression) + " |\n\n"
-        for chord in progression:
-            result += f"{chord:6s} → {get_shape(chord)}\n"
+        seed_text = self.seed_var.get().strip()
+        try:
+            seed = int(seed_text) if seed_text else None
+        except ValueError:
+            messagebox.showerror("Error", "Seed は整数で入力してください。")
+            return
+        _, seed = make_rng(seed)
+        results.validate()
+        progression = cached_progression(key, style, bars, seed)
+        if self.generation_log is not None:
+            try:
+                self.generation_log.append(seed, key, style, bars, progression)
+            except OSError as e:
+                print("generation log error:", e)
+        self.show_progression(key, style, bars, seed, progression)
+
+    def show_progression(self, key, style, bars, seed, progression):
+        """進行を表示し、コードボタンを作り直して現在の進行にする（生成・ライブラリ読み込み共通）。"""
+        for w in self.chord_buttons_frame.winfo_children():
+            w.destroy()
+
+        result = results.texts.get_or_compute((key, style, bars, seed, tuple(progression)), lambda: self.format_progression(key, style, bars, seed, progression))
 
         self.output_text.delete("1.0", tk.END)
         self.output_text.insert(tk.END, result)
 
+        # 進行のコードを裏でレンダリングしておく（クリック時はキャッシュから再生）
+        try:
+            self.get_samples().prerender(progression)
+        except Exception as e:
+            print("prerender error:", e)
+
         # create chord quick-play buttons
         for chord in progression:
             btn = tb.Button(self.chord_buttons_frame, text=chord, width=8, bootstyle="success-outline",
-                            command=lambda c=chord: threading.Thread(target=self.safe_play_chord, args=(c,)).start())
+                            command=lambda c=chord: self.on_chord_button(c))
             btn.pack(side="left", padx=6, pady=4)
 
         # store current progression
         self.current_progression = progression
+        self.current_meta = (key, style, bars, seed)
+
+    def format_progression(self, key, style, bars, seed, progression):
+        result = f"Key: {key}    Style: {style}    Bars: {bars}    Seed: {seed}\n\nProgression: | " + " | ".join(progression) + " |\n\n"
+        for chord in progression:
+            result += f"{chord:6s} → {resolve_voicing(chord)[1]}\n"
+        s = suggest_capo(progression)
+        if s["capo"] or s["tuning"] != "Standard":
+            result += f"\nEasier: {s['tuning']}, capo {s['capo']}\n"
+            for chord, (shape_chord, shape) in zip(progression, s["shapes"]):
+                result += f"{chord:6s} → {shape_chord} {shape}\n"
+        return result
+
+    def get_samples(self):
+        if self.samples is None:
+            self.samples = SampleBank(cached_notes, make_renderer(), store=results)
+        return self.samples
+
+    def on_chord_button(self, chord):
+        if self.sampler_var.get():
+            try:
+                # まだレンダリングできていなければ（裏で描かせて）今回は MIDI で鳴らす
+                if self.get_samples().play(chord) is not None:
+                    return
+            except Exception as e:
+                print("sampler error:", e)
+                if midi.metrics:
+                    midi.metrics.error('sampler', e)
+        threading.Thread(target=self.safe_play_chord, args=(chord,)).start()
 
     def safe_play_chord(self, chord):
         """
@@ -357,7 +304,7 @@ class ChordApp:
         try:
             # try auto open midi device if not opened
             self.ensure_midi_open()
-            notes = chord_to_midi_notes(chord)
+            notes = cached_notes(chord)
             for n in notes:
                 midi.note_on(n, 100)
             time.sleep(0.8)
@@ -365,8 +312,23 @@ class ChordApp:
                 midi.note_off(n, 100)
         except Exception as e:
             print("play error:", e)
+            if midi.metrics:
+                midi.metrics.error('safe_play_chord', e)
+
+    def on_outputs(self):
+        OutputsWindow(self.root, midi.list_devices(), self.fanout_ids, self.on_outputs_selected)
+
+    def on_outputs_selected(self, device_ids):
+        self.fanout_ids = list(device_ids)
+        # 次の再生で開き直す
+        midi.close_outputs()
 
     def ensure_midi_open(self):
+        # 複数出力が選ばれていれば、全デバイスへ書き込みスレッド経由で送る
+        if self.fanout_ids:
+            if sorted(midi.writers) != sorted(self.fanout_ids):
+                midi.open_outputs(self.fanout_ids)
+            return
         # open chosen device if selected
         self.midi_choice = self.midi_var.get()
         if self.midi_choice == "(Auto)":
@@ -381,6 +343,8 @@ class ChordApp:
                 midi.open_output(dev_id)
             except Exception as e:
                 print("cannot open selected device:", e)
+                if midi.metrics:
+                    midi.metrics.error('ensure_midi_open', e)
                 # fallback to auto
                 devs = midi.list_devices()
                 outputs = [i for (i, name, is_out) in devs if is_out]
@@ -396,6 +360,9 @@ class ChordApp:
             messagebox.showinfo("Info", "既に再生中です。")
             return
         self.play_flag.set()
+        beats_per_chord, _ = ARRANGEMENTS.get(self.play_style_var.get(), ARRANGEMENTS["Block"])
+        self.playhead.set_progression(self.current_progression, beats_per_chord)
+        self.playhead.start()
         self.play_thread = threading.Thread(target=self.play_progression_loop, daemon=True)
         self.play_thread.start()
 
@@ -408,81 +375,234 @@ class ChordApp:
         # open midi device
         try:
             self.ensure_midi_open()
-        except:
-            pass
-
-        tempo = self.tempo_var.get()
-        beat_length = 60.0 / tempo  # 1 beat (quarter note) in seconds
+        except Exception as e:
+            if midi.metrics:
+                midi.metrics.error('play_progression_loop.open', e)
 
         progression = self.current_progression[:]
-        play_style = self.play_style_var.get()
-        loop = self.loop_var.get()
+        tempo, style, loop = self.tempo_var.get(), self.play_style_var.get(), self.loop_var.get()
+        jam = self.jam
+
+        def on_start(start, beats_per_chord):
+            if jam:
+                jam.begin(progression, tempo, beats_per_chord, start, loop, voicing=cached_notes, style=style)
 
         try:
-            while self.play_flag.is_set():
-                for chord in progression:
-                    if not self.play_flag.is_set():
-                        break
-                    notes = chord_to_midi_notes(chord, octave_offset=0)
-                    if play_style == "Block":
-                        # play all notes together for a duration of 2 beats (adjustable)
-                        for n in notes:
-                            midi.note_on(n, 100)
-                        time.sleep(beat_length * 2)  # chord length = 2 beats
-                        for n in notes:
-                            midi.note_off(n, 100)
-                    else:
-                        # arpeggio: play notes sequentially across one bar (4 beats)
-                        arpeggio_total = beat_length * 4
-                        if notes:
-                            step = arpeggio_total / len(notes)
-                        else:
-                            step = beat_length
-                        for n in notes:
-                            if not self.play_flag.is_set():
-                                break
-                            midi.note_on(n, 100)
-                            time.sleep(step * 0.9)
-                            midi.note_off(n, 100)
-                        # short pause between chords
-                        time.sleep(0.05)
-                if not loop:
-                    break
+            play_progression(progression, tempo, style, loop, midi, self.play_flag, on_event=self.playhead_feed.post,
+                             groove=self.groove_var.get(), seed=self.current_meta[3] or 0, on_start=on_start,
+                             melody=self.melody_lane())
         finally:
-            # ensure all notes off
-            # attempt to turn off any lingering notes
-            for n in range(0, 128):
-                try:
-                    midi.note_off(n, 0)
-                except:
-                    pass
+            self.playhead_feed.finish()
+            if jam:
+                jam.end()
+
+    def melody_lane(self):
+        """Melody が入っていれば、今の進行のキーとシードで MelodyLane を作る（同じ進行なら同じリード）。"""
+        if not self.melody_var.get():
+            return None
+        key, _, _, seed = self.current_meta
+        return MelodyLane(theory.DIATONIC_MAJOR, key, derive_seed(seed or 0, "melody"))
+
+    def on_toggle_jam(self):
+        if self.jam_var.get():
+            try:
+                self.jam = JamServer(port=JAM_PORT).start()
+            except OSError as e:
+                self.jam_var.set(False)
+                messagebox.showerror("Jam", f"ポート {JAM_PORT} で待ち受けできません: {e}")
+                return
+            messagebox.showinfo("Jam", f"生徒の端末のブラウザで {self.jam.url()} を開いてください。\n"
+                                       "次の再生から配信します。")
+        elif self.jam:
+            self.jam.close()
+            self.jam = None
+
+    def on_export_wav(self):
+        # MIDIデバイスなしで、今の進行と奏法をミキサーで WAV に書き出す
+        if getattr(self, 'current_progression', None) is None:
+            messagebox.showinfo("Info", "まずGenerate Progressionで進行を生成してください。")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".wav", filetypes=[("WAV files","*.wav")])
+        if not file_path:
+            return
+        beats_per_chord, lanes = ARRANGEMENTS.get(self.play_style_var.get(), ARRANGEMENTS["Block"])
+        melody = self.melody_lane()
+        if melody is not None:
+            lanes = lanes + [melody]
+        events = compile_progression(self.current_progression, lanes, beats_per_chord, cached_notes)
+        events = humanize(events, self.tempo_var.get(), self.groove_var.get(), derive_seed(self.current_meta[3] or 0, 0))
+        if events and events[0][0] < 0:
+            # Push で拍0より前にずれた音があれば、その分だけ全体を後ろにずらして書き出す
+            head = events[0][0]
+            events = [(e[0] - head,) + tuple(e[1:]) for e in events]
+        renderer = BuiltinRenderer()
+        sources = {}
+
+        def note_source(note, vel):
+            if (note, vel) not in sources:
+                sources[(note, vel)] = renderer.render_mono([note], duration=2.0, velocity=vel)
+            return sources[(note, vel)]
 
-    def on_save(self):
+        try:
+            render_events(events, 60.0 / self.tempo_var.get(), note_source, file_path)
+            messagebox.showinfo("Saved", f"Saved to {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"保存に失敗しました: {e}")
+
+    def on_export_chart(self):
+        # 今の進行のコードダイアグラムとリードシートを SVG で保存（大量に作るときは python chart.py）
         if getattr(self, 'current_progression', None) is None:
-            messagebox.showinfo("Info", "保存する進行がありません。まず生成してください。")
+            messagebox.showinfo("Info", "まずGenerate Progressionで進行を生成してください。")
             return
-        file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files","*.txt")])
+        file_path = filedialog.asksaveasfilename(defaultextension=".svg", filetypes=[("SVG files","*.svg")])
         if not file_path:
             return
+        key, style, bars, seed = self.current_meta
+        svg = render_page([(entry_title(key, style, seed), list(self.current_progression))], theory.CHORD_SHAPES, GlyphCache())
         try:
             with open(file_path, "w", encoding="utf-8") as f:
-                f.write(self.output_text.get("1.0", tk.END))
+                f.write(svg)
             messagebox.showinfo("Saved", f"Saved to {file_path}")
+        except OSError as e:
+            messagebox.showerror("Error", f"保存に失敗しました: {e}")
+
+    def on_toggle_metrics(self):
+        # 計測のオン/オフ。オフのときは midi.metrics = None でホットパスの負荷をほぼゼロにする
+        if self.metrics_var.get():
+            self.metrics.clear()
+            midi.metrics = self.metrics
+            if self.metrics_overlay is None or not self.metrics_overlay.is_open():
+                self.metrics_overlay = MetricsOverlay(self.root, self.metrics, on_export=self.on_export_metrics)
+        else:
+            midi.metrics = None
+            if self.metrics_overlay is not None and self.metrics_overlay.is_open():
+                self.metrics_overlay.close()
+            self.metrics_overlay = None
+
+    def on_export_metrics(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON","*.json"), ("CSV","*.csv")])
+        if not file_path:
+            return
+        try:
+            if file_path.lower().endswith(".csv"):
+                self.metrics.to_csv(file_path)
+            else:
+                self.metrics.to_json(file_path)
+            messagebox.showinfo("Saved", f"Saved to {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"保存に失敗しました: {e}")
+
+    def on_save(self):
+        # ライブラリ（SQLite）に保存。同じキー・同じコード列は重複して入らない
+        if getattr(self, 'current_progression', None) is None:
+            messagebox.showinfo("Info", "保存する進行がありません。まず生成してください。")
+            return
+        key, style, bars, seed = self.current_meta
+        try:
+            prog_id = self.library.add(key, style, list(self.current_progression), seed)
         except Exception as e:
             messagebox.showerror("Error", f"保存に失敗しました: {e}")
+            return
+        if prog_id is None:
+            messagebox.showinfo("Saved", "この進行は既にライブラリにあります。")
+        else:
+            messagebox.showinfo("Saved", f"Saved to library (#{prog_id})")
+
+    def on_library(self):
+        LibraryWindow(self.root, self.library, self.on_load_from_library)
+
+    def on_load_from_library(self, row):
+        prog_id, key, style, bars, seed, chords = row
+        self.show_progression(key, style, bars, seed, chords)
 
     def on_close(self):
         # stop thread and close midi
         self.play_flag.clear()
         if self.play_thread and self.play_thread.is_alive():
             self.play_thread.join(timeout=1.0)
+        self.playhead.stop()
+        if self.jam:
+            self.jam.close()
         midi.close()
+        if midi.recorder:
+            midi.recorder.close()
+            midi.recorder = None
+        self.library.close()
         self.root.destroy()
 
+class OutputsWindow:
+    """同時に鳴らす出力デバイスを選ぶウィンドウ。"""
+
+    def __init__(self, root, devices, selected, on_ok):
+        self.on_ok = on_ok
+        self.win = tb.Toplevel(root)
+        self.win.title("Outputs")
+        tb.Label(self.win, text="同時に送る出力デバイス:").pack(anchor='w', padx=10, pady=(8, 4))
+        self.vars = []
+        for (i, name, is_out) in devices:
+            if not is_out:
+                continue
+            var = tk.BooleanVar(value=i in selected)
+            tb.Checkbutton(self.win, text=f"{i}: {name}", variable=var, bootstyle="info").pack(anchor='w', padx=14, pady=2)
+            self.vars.append((i, var))
+        if not self.vars:
+            tb.Label(self.win, text="(No MIDI output detected)").pack(anchor='w', padx=14)
+        tb.Button(self.win, text="OK", bootstyle="info", command=self.on_confirm).pack(pady=8)
+
+    def on_confirm(self):
+        self.on_ok([i for i, var in self.vars if var.get()])
+        self.win.destroy()
+
+class LibraryWindow:
+    """ライブラリの検索・読み込み用ウィンドウ。"""
+
+    def __init__(self, root, library, on_load):
+        self.library = library
+        self.on_load = on_load
+        self.rows = []
+        self.win = tb.Toplevel(root)
+        self.win.title("Progression Library")
+        self.win.geometry("640x420")
+
+        frame = tb.Frame(self.win)
+        frame.pack(fill='x', padx=10, pady=8)
+        tb.Label(frame, text="Style:").pack(side='left')
+        self.style_var = tk.StringVar(value="")
+        tb.Combobox(frame, textvariable=self.style_var, values=[""] + list(theory.COMMON_PATTERNS.keys()), width=8, state="readonly").pack(side='left', padx=4)
+        tb.Label(frame, text="Bars:").pack(side='left')
+        self.bars_var = tk.StringVar(value="")
+        tb.Entry(frame, textvariable=self.bars_var, width=4).pack(side='left', padx=4)
+        tb.Label(frame, text="Contains:").pack(side='left')
+        self.contains_var = tk.StringVar(value="")
+        tb.Entry(frame, textvariable=self.contains_var, width=12).pack(side='left', padx=4)
+        tb.Button(frame, text="Search", bootstyle="info-outline", command=self.search).pack(side='left', padx=6)
+
+        self.listbox = tk.Listbox(self.win, font=("Consolas", 10), bg="#111", fg="#E8E8E8")
+        self.listbox.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+        self.listbox.bind("<Double-Button-1>", self.load_selected)
+        self.search()
+
+    def search(self):
+        bars_text = self.bars_var.get().strip()
+        try:
+            bars = int(bars_text) if bars_text else None
+        except ValueError:
+            bars = None
+        contains = self.contains_var.get().replace(",", " ").split()
+        self.rows = self.library.find(style=self.style_var.get() or None, bars=bars, contains=contains, limit=500)
+        self.listbox.delete(0, tk.END)
+        for prog_id, key, style, b, seed, chords in self.rows:
+            self.listbox.insert(tk.END, f"#{prog_id:<6} {key:3s} {style or '':7s} {b:2d} bars  | " + " | ".join(chords) + " |")
+
+    def load_selected(self, event=None):
+        sel = self.listbox.curselection()
+        if sel:
+            self.on_load(self.rows[sel[0]])
+
 def main():
     root = tb.Window(themename="darkly")
     root.title("Guitar Chord Progression Generator (Improved)")
-    root.geometry("900x700")
+    root.geometry("900x880")
     app = ChordApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
@@ -0,0 +1,326 @@
+# melody.py
+# 進行の上に乗せるリード（メロディ・リフ）を作る。和音だけでは伴奏にしかならないので、
+# コードごとに候補フレーズをたくさん作り、NumPy でまとめて採点してビームサーチでつなぐ。
+#
+# 1コード（beats_per_chord 拍）を1フレーズとし、リズムは RHYTHMS の8分音符単位の文字列
+# （'x' = 発音、'-' = 伸ばす、'.' = 休み。StrumLane / DrumLane と同じ書き方）から選ぶ。
+# 2コードごとに同じリズムを繰り返しがちにして、リフらしいまとまりを出す。最後のコードは CADENCES から選ぶ。
+# 音程はキーの音階（DIATONIC_MAJOR のそのキーのコードのルート = 長音階）の上のランダムウォークで作り、
+# ときどき半音ずらす（ノンダイアトニックなコードの構成音にも届くように）。
+#
+# 採点（全コード x 全候補 x 全音を1つの配列で）:
+#   コードトーン: 強拍ほど重く、構成音なら加点・それ以外は減点
+#   音階: 音階にもコードにもない音は減点
+#   経過音: コードトーンでない音は前後が順次進行（2半音以内）でなければ減点
+#   なめらかさ: 順次進行に加点、4半音を超える跳躍は幅に比例して減点、同音の連続は少し減点、
+#               5半音以上の跳躍のあとは反対向きの順次進行で戻らなければ減点
+#   音域: CENTER から離れすぎたら減点
+#   終止: 最後の音が主音なら加点
+# フレーズのつなぎ目（前のフレーズの最後の音 -> 次の最初の音）はビームサーチの中で採点する。
+#
+# 乱数は seed から作るので、同じ進行・キー・seed なら同じメロディになる。
+# python melody.py   64小節のメロディの生成時間を測る
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from arrangement import NOTE_ON, NOTE_OFF
+
+# ベースが 1、ドラムが 9 なので、リードは 2
+MELODY_CHANNEL = 2
+
+LOW, HIGH = 60, 84          # C4..C6
+CENTER = 72
+CANDIDATES = 256            # 1コードあたりの候補フレーズ数
+BEAM = 16
+
+RHYTHMS = ("x-x-x-x-", "x-xxx-x-", "xxx-x-x-", "x--xx-x-", "x-x-xxxx", "x---x-x-",
+           "x-.xx-x-", "xx-x-xx-", "x--x--x-", "x-x-x---")
+CADENCES = ("x-x-x---", "x---x---", "x-------")
+REPEAT_RHYTHM = 0.75        # 2コード前と同じリズムを使う確率
+
+# 音階の上の歩幅（度数）と確率
+DEGREE_STEPS = np.array([-4, -3, -2, -1, 0, 1, 2, 3, 4])
+STEP_P = np.array([0.03, 0.06, 0.14, 0.22, 0.08, 0.22, 0.14, 0.08, 0.03])
+CHROMATIC_P = 0.06          # 半音ずらす確率
+
+# 採点の重み
+CHORD_TONE = 3.0
+OUT_OF_SCALE = 4.0
+APPROACH = 2.0
+STEP = 0.6
+REPEAT = 0.4
+LEAP = 0.5
+RECOVER = 1.5
+RANGE = 0.15
+CADENCE = 4.0
+
+_LETTERS = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+
+def root_pc(chord):
+    """コード名のルートのピッチクラス。'E#dim' -> 5、'Cb' -> 11（NOTE_TO_MIDI にない異名も扱う）。"""
+    pc = _LETTERS[chord[0]]
+    for c in chord[1:]:
+        if c == "#":
+            pc += 1
+        elif c == "b":
+            pc -= 1
+        else:
+            break
+    return pc % 12
+
+
+def scale_of(key, diatonic):
+    """DIATONIC_MAJOR[key] のコードのルートから、音階（12 個の bool）と主音のピッチクラスを返す。"""
+    chords = diatonic[key]
+    scale = np.zeros(12, dtype=bool)
+    for c in chords:
+        scale[root_pc(c)] = True
+    return scale, root_pc(chords[0])
+
+
+def guess_key(progression, diatonic):
+    """進行のコードを一番多く含むキー（同点なら DIATONIC_MAJOR の順で先のもの）。"""
+    chords = set(progression)
+    return max(diatonic, key=lambda k: len(chords.intersection(diatonic[k])))
+
+
+def _slot_strength(k):
+    """8分音符 k 番目の拍の強さ（1拍目 > 3拍目 > 表拍 > 裏拍）。"""
+    if k == 0:
+        return 1.0
+    if k % 2:
+        return 0.15
+    return 0.6 if k % 4 == 0 else 0.35
+
+
+@lru_cache(maxsize=None)
+def rhythm_table(slots):
+    """
+    RHYTHMS + CADENCES を slots 個の8分音符に切った表。
+    返り値: (onsets, lengths, strength, counts)。前の3つは (パターン数, 最大音数) で、音は前に詰める。
+    onsets / lengths は拍。counts はパターンごとの音数。
+    """
+    rows = []
+    for pattern in RHYTHMS + CADENCES:
+        chars = [pattern[k % len(pattern)] for k in range(slots)]
+        notes = []
+        for k, c in enumerate(chars):
+            if c != "x":
+                continue
+            end = k + 1
+            while end < slots and chars[end] == "-":
+                end += 1
+            notes.append((k * 0.5, (end - k) * 0.5, _slot_strength(k)))
+        rows.append(notes)
+    n = max(1, max(len(r) for r in rows))
+    onsets = np.zeros((len(rows), n))
+    lengths = np.zeros((len(rows), n))
+    strength = np.zeros((len(rows), n))
+    counts = np.zeros(len(rows), dtype=np.int64)
+    for i, r in enumerate(rows):
+        counts[i] = len(r)
+        for j, (o, l, s) in enumerate(r):
+            onsets[i, j], lengths[i, j], strength[i, j] = o, l, s
+    return onsets, lengths, strength, counts
+
+
+def choose_rhythms(n_chords, rng):
+    """コードごとのリズム（rhythm_table の行番号）。2コード前を REPEAT_RHYTHM の確率で繰り返す。"""
+    rhythm = rng.integers(0, len(RHYTHMS), n_chords)
+    keep = rng.random(n_chords) < REPEAT_RHYTHM
+    for m in range(2, n_chords):
+        if keep[m]:
+            rhythm[m] = rhythm[m - 2]
+    rhythm[-1] = len(RHYTHMS) + rng.integers(0, len(CADENCES))
+    return rhythm
+
+
+def candidate_pitches(scale, shape, rng):
+    """音階の上のランダムウォークで shape = (コード数, 候補数, 音数) の音高を作る。音域の端では折り返す。"""
+    ladder = np.array([p for p in range(LOW, HIGH + 1) if scale[p % 12]])
+    top = len(ladder) - 1
+    m, k, n = shape
+    steps = rng.choice(DEGREE_STEPS, size=(m, k, n), p=STEP_P / STEP_P.sum())
+    steps[:, :, 0] = rng.integers(0, top + 1, (m, k))
+    idx = np.cumsum(steps, axis=2) % (2 * top)
+    idx = np.where(idx > top, 2 * top - idx, idx)
+    pitches = ladder[idx]
+    shift = rng.random(shape) < CHROMATIC_P
+    pitches += shift * rng.choice(np.array([-1, 1]), size=shape)
+    return np.clip(pitches, LOW, HIGH)
+
+
+def score_phrases(pitches, valid, strength, chord_pcs, scale):
+    """
+    pitches: (M, K, N) の音高、valid / strength: (M, 1, N)（音は前に詰めてある）
+    chord_pcs: (M, 12) コードごとの構成音、scale: (12,)
+    返り値: (M, K) のフレーズごとの点数
+    """
+    m = pitches.shape[0]
+    pc = pitches % 12
+    ct = chord_pcs[np.arange(m)[:, None, None], pc]
+    score = CHORD_TONE * (strength * np.where(ct, 1.0, -1.0)).sum(axis=2)
+    score -= OUT_OF_SCALE * (valid & ~ct & ~scale[pc]).sum(axis=2)
+
+    iv = np.diff(pitches, axis=2)
+    pair = valid[..., 1:]
+    a = np.abs(iv)
+    score += STEP * ((a > 0) & (a <= 2) & pair).sum(axis=2)
+    score -= REPEAT * ((a == 0) & pair).sum(axis=2)
+    score -= LEAP * (np.maximum(a - 4, 0) * pair).sum(axis=2)
+    back = (iv[..., :-1] * iv[..., 1:] < 0) & (a[..., 1:] <= 2)
+    score -= RECOVER * ((a[..., :-1] >= 5) & pair[..., 1:] & ~back).sum(axis=2)
+
+    # 経過音・刺繍音: 前後とも順次進行（フレーズの最初と最後は片側だけ見る）
+    near = a <= 2
+    ones = np.ones(near.shape[:2] + (1,), dtype=bool)
+    prev_ok = np.concatenate([ones, near], axis=2)
+    next_ok = np.concatenate([near | ~pair, ones], axis=2)
+    score -= APPROACH * (valid & ~ct & ~(prev_ok & next_ok)).sum(axis=2)
+
+    score -= RANGE * (np.maximum(np.abs(pitches - CENTER) - 7, 0) * valid).sum(axis=2)
+    return score
+
+
+def _join(last, first):
+    """フレーズのつなぎ目の点数（score_phrases のなめらかさと同じ重み）。"""
+    a = np.abs(first - last)
+    return STEP * ((a > 0) & (a <= 2)) - REPEAT * (a == 0) - LEAP * np.maximum(a - 4, 0)
+
+
+def generate(progression, beats_per_chord, voicing, scale, tonic, seed=0, candidates=CANDIDATES, beam=BEAM):
+    """
+    progression の各コードに1フレーズずつ付けたメロディを返す。
+    voicing: コード名 -> MIDIノート番号の列（構成音の判定に使う。cached_notes など）
+    scale, tonic: scale_of() の返り値
+    返り値: (拍, 長さ（拍）, 音高, 拍の強さ) のリスト（時刻順）
+    """
+    n_chords = len(progression)
+    if not n_chords:
+        return []
+    rng = np.random.default_rng(seed)
+    onsets, lengths, strength, counts = rhythm_table(max(1, int(round(beats_per_chord * 2))))
+    n = onsets.shape[1]
+    rhythm = choose_rhythms(n_chords, rng)
+
+    pitches = candidate_pitches(scale, (n_chords, candidates, n), rng)
+    count = counts[rhythm]
+    valid = (np.arange(n) < count[:, None])[:, None, :]
+    weight = strength[rhythm][:, None, :]
+    chord_pcs = np.zeros((n_chords, 12), dtype=bool)
+    for m, chord in enumerate(progression):
+        chord_pcs[m, [p % 12 for p in voicing(chord)]] = True
+
+    scores = score_phrases(pitches, valid, weight, chord_pcs, scale)
+    first = pitches[:, :, 0]
+    last = pitches[np.arange(n_chords), :, count - 1]
+    scores[-1] += CADENCE * (last[-1] % 12 == tonic)
+
+    # ビームサーチ: 各コードで (ビーム x 候補) を全部足し、上位 beam 本だけ残す
+    beam = min(beam, candidates)
+    choice = np.zeros((n_chords, beam), dtype=np.int64)
+    back = np.zeros((n_chords, beam), dtype=np.int64)
+    choice[0] = np.argsort(-scores[0])[:beam]
+    total = scores[0, choice[0]]
+    for m in range(1, n_chords):
+        t = (total[:, None] + scores[m][None, :] + _join(last[m - 1, choice[m - 1]][:, None], first[m][None, :])).ravel()
+        top = np.argpartition(-t, beam - 1)[:beam]
+        back[m], choice[m] = np.divmod(top, candidates)
+        total = t[top]
+
+    j = int(np.argmax(total))
+    picks = [0] * n_chords
+    for m in range(n_chords - 1, -1, -1):
+        picks[m] = choice[m, j]
+        j = back[m, j]
+
+    notes = []
+    for m, k in enumerate(picks):
+        r = rhythm[m]
+        base = m * beats_per_chord
+        for i in range(counts[r]):
+            notes.append((base + float(onsets[r, i]), float(lengths[r, i]), int(pitches[m, k, i]),
+                          float(strength[r, i])))
+    return notes
+
+
+class MelodyLane:
+    """
+    arrangement のレーンとして使う（ARRANGEMENTS のレーンと並べて compile_progression に渡す）。
+    diatonic: DIATONIC_MAJOR。key: そのキー（None なら進行から推定する）
+    同じ進行ならループの周ごとに作り直さない（同じリフを繰り返す）。
+    """
+
+    def __init__(self, diatonic, key=None, seed=0, channel=MELODY_CHANNEL, velocity=96, gate=0.9,
+                 candidates=CANDIDATES, beam=BEAM):
+        self.diatonic = diatonic
+        self.key = key
+        self.seed = seed
+        self.channel = channel
+        self.velocity = velocity
+        self.gate = gate
+        self.candidates = candidates
+        self.beam = beam
+        self._cache = (None, None)
+
+    def notes(self, progression, beats_per_chord, voicing):
+        cache_key = (tuple(progression), beats_per_chord)
+        if self._cache[0] != cache_key:
+            key = self.key if self.key in self.diatonic else guess_key(progression, self.diatonic)
+            scale, tonic = scale_of(key, self.diatonic)
+            self._cache = (cache_key, generate(progression, beats_per_chord, voicing, scale, tonic,
+                                               self.seed, self.candidates, self.beam))
+        return self._cache[1]
+
+    def events(self, progression, beats_per_chord, voicing):
+        out = []
+        for beat, length, note, strength in self.notes(progression, beats_per_chord, voicing):
+            vel = max(1, min(127, int(self.velocity + 16 * (strength - 0.5))))
+            out.append((beat, NOTE_ON, self.channel, note, vel))
+            out.append((beat + length * self.gate, NOTE_OFF, self.channel, note, 0))
+        out.sort()
+        return out
+
+
+# ---------- ベンチマーク ----------
+def benchmark(bars=64, runs=20):
+    """
+    64小節（Arp / Band と同じ1コード4拍）のメロディを runs 回作って時間を測る。
+    コードトーンに乗った強拍の割合と、跳躍の大きさも出す。
+    """
+    import random
+    from theory import generate_progression, cached_notes, DIATONIC_MAJOR
+
+    rng = random.Random(0)
+    keys = list(DIATONIC_MAJOR)
+    times = []
+    on_chord = strong = leaps = intervals = 0
+    for i in range(runs):
+        key = rng.choice(keys)
+        progression = generate_progression(key, "Pop", bars, rng=rng)
+        scale, tonic = scale_of(key, DIATONIC_MAJOR)
+        t0 = time.perf_counter()
+        notes = generate(progression, 4, cached_notes, scale, tonic, seed=i)
+        times.append(time.perf_counter() - t0)
+        prev = None
+        for beat, _, note, s in notes:
+            if s >= 0.6:
+                strong += 1
+                chord = progression[int(beat // 4)]
+                on_chord += note % 12 in {p % 12 for p in cached_notes(chord)}
+            if prev is not None:
+                intervals += 1
+                leaps += abs(note - prev) > 4
+            prev = note
+    times.sort()
+    print(f"{bars} bars x {CANDIDATES} candidates/chord, beam {BEAM}: "
+          f"median {times[len(times) // 2] * 1000:.1f} ms, max {times[-1] * 1000:.1f} ms")
+    print(f"strong beats on chord tones {on_chord / strong:.0%}, leaps > 4 semitones {leaps / intervals:.0%}")
+    return times
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,342 @@
+# midi_import.py
+# Standard MIDI File（.mid）のフォルダからコード進行を抜き出す。
+# - ファイルは mmap で開き、トラックチャンクを順に読むだけ（メッセージオブジェクトは作らない）
+# - ノートを小節ごとのピッチクラス重みにまとめ、ピッチクラス集合の表引きでコードを決める
+# - ディレクトリ全体はプロセスプールで処理し、結果は1ファイルずつ JSON Lines で流す
+# - 調の推定とローマ数字（ROMAN_TO_INDEX と同じ表記）は親プロセスで analysis.KeyAnalyzer に
+#   まとめて任せる（ワーカーはコード名まで）
+#
+# 使い方: python midi_import.py <dir> [-o out.jsonl] [-j workers]
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+FLAT_NAMES = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+
+DRUM_CHANNEL = 9
+
+# コードの種類: (サフィックス, ルートからの音程)
+CHORD_QUALITIES = [
+    ('', (0, 4, 7)),
+    ('m', (0, 3, 7)),
+    ('dim', (0, 3, 6)),
+    ('7', (0, 4, 7, 10)),
+    ('m7', (0, 3, 7, 10)),
+    ('maj7', (0, 4, 7, 11)),
+]
+
+
+def _mask(pcs):
+    m = 0
+    for pc in pcs:
+        m |= 1 << (pc % 12)
+    return m
+
+
+# (ピッチクラス集合のビットマスク) -> (root, quality)
+CHORD_BY_MASK = {}
+CHORD_TEMPLATES = []
+for _q, (_suffix, _ivs) in enumerate(CHORD_QUALITIES):
+    for _root in range(12):
+        _m = _mask(_root + i for i in _ivs)
+        CHORD_BY_MASK.setdefault(_m, (_root, _q))
+        CHORD_TEMPLATES.append((_root, _q, _m))
+
+
+# ---------- SMF の読み込み ----------
+def _read_varlen(buf, pos):
+    value = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, pos
+
+
+def iter_track_chunks(buf):
+    """MTrk チャンクの (start, end) を順に返す。中身はまだ読まない。"""
+    pos = 14
+    size = len(buf)
+    while pos + 8 <= size:
+        ctype = buf[pos:pos + 4]
+        length = int.from_bytes(buf[pos + 4:pos + 8], "big")
+        start = pos + 8
+        end = min(start + length, size)
+        if ctype == b"MTrk":
+            yield start, end
+        pos = end
+
+
+def iter_notes(buf, start, end, time_sig=None):
+    """
+    1トラック分から (start_tick, end_tick, note) を返す（ドラムは除く）。
+    time_sig（リスト）を渡すと、最初に見つかった拍子 (分子, 分母) を入れる。
+    """
+    pos = start
+    tick = 0
+    status = 0
+    active = {}
+    while pos < end:
+        delta, pos = _read_varlen(buf, pos)
+        tick += delta
+        b = buf[pos]
+        if b & 0x80:
+            status = b
+            pos += 1
+        kind = status & 0xF0
+        if status == 0xFF:
+            mtype = buf[pos]
+            length, pos = _read_varlen(buf, pos + 1)
+            if mtype == 0x58 and time_sig is not None and not time_sig and length >= 2:
+                time_sig.append((buf[pos], 1 << buf[pos + 1]))
+            elif mtype == 0x2F:
+                break
+            pos += length
+            continue
+        if status in (0xF0, 0xF7):
+            length, pos = _read_varlen(buf, pos)
+            pos += length
+            continue
+        if kind in (0x80, 0x90):
+            ch = status & 0x0F
+            note = buf[pos]
+            vel = buf[pos + 1]
+            pos += 2
+            if ch == DRUM_CHANNEL:
+                continue
+            k = (ch, note)
+            if kind == 0x90 and vel > 0:
+                active.setdefault(k, tick)
+            elif k in active:
+                yield active.pop(k), tick, note
+        elif kind in (0xC0, 0xD0):
+            pos += 1
+        else:
+            pos += 2
+    for (ch, note), t in active.items():
+        yield t, tick, note
+
+
+# ---------- 解析 ----------
+def bar_histograms(path):
+    """
+    ファイルを小節ごとの12次元ピッチクラス重み（発音長のtick数）にする。
+    返り値: (histograms, ticks_per_bar)
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:4] != b"MThd":
+                raise ValueError("not a Standard MIDI File")
+            division = int.from_bytes(buf[12:14], "big")
+            if division & 0x8000:
+                raise ValueError("SMPTE time division is not supported")
+            time_sig = []
+            notes = []
+            for start, end in iter_track_chunks(buf):
+                notes.extend(iter_notes(buf, start, end, time_sig))
+    num, den = time_sig[0] if time_sig else (4, 4)
+    ticks_per_bar = max(1, division * 4 * num // den)
+    if not notes:
+        return [], ticks_per_bar
+    last = max(e for _, e, _ in notes)
+    hists = [[0] * 12 for _ in range((last - 1) // ticks_per_bar + 1)]
+    for s, e, note in notes:
+        pc = note % 12
+        bar = s // ticks_per_bar
+        while s < e:
+            bar_end = (bar + 1) * ticks_per_bar
+            seg = min(e, bar_end) - s
+            hists[bar][pc] += seg
+            s = bar_end
+            bar += 1
+    return hists, ticks_per_bar
+
+
+def identify_chord(hist, threshold=0.15):
+    """
+    1小節の重みからコードを決める。まず主要なピッチクラスの集合で表を引き、
+    なければテンプレートとの重なりが一番大きいものを選ぶ。
+    返り値: (root, quality) / 音がなければ None
+    """
+    total = sum(hist)
+    if not total:
+        return None
+    cut = max(hist) * threshold
+    m = _mask(pc for pc in range(12) if hist[pc] >= cut)
+    hit = CHORD_BY_MASK.get(m)
+    if hit is not None:
+        return hit
+    best = None
+    best_score = -1.0
+    for root, q, tm in CHORD_TEMPLATES:
+        inside = sum(hist[pc] for pc in range(12) if tm >> pc & 1)
+        # テンプレート外の音を減点し、同点なら3和音を優先（q が小さい）
+        score = inside - 0.5 * (total - inside) + hist[root] * 0.1
+        if score > best_score:
+            best, best_score = (root, q), score
+    return best
+
+
+def chord_label(root, q, names=NOTE_NAMES):
+    return names[root] + CHORD_QUALITIES[q][0]
+
+
+# 各度数のローマ数字（ROMAN_TO_INDEX と同じ表記）
+DEGREE_ROMANS = ['I', 'ii', 'iii', 'IV', 'V', 'vi', 'vii°']
+
+
+def key_spellings(analyzer):
+    """
+    キーごとのルート名の表 [12] を作る。音階の音はそのキーの DIATONIC_MAJOR の綴り
+    （KeyAnalyzer はコード名で度数を引くので、綴りを合わせないとダイアトニックにならない）、
+    音階外の音はそのキーがフラット系ならフラット、それ以外はシャープ。
+    """
+    out = []
+    for chords in analyzer.diatonic.values():
+        roots = [c[:2] if len(c) > 1 and c[1] in '#b' else c[:1] for c in chords]
+        names = list(FLAT_NAMES if any(r.endswith('b') for r in roots) else NOTE_NAMES)
+        for c, r in zip(chords, roots):
+            names[analyzer.voicing(c)[0] % 12] = r
+        out.append(names)
+    return out
+
+
+def _respell(chord, names):
+    """シャープ表記のコード名のルートを names（key_spellings の1行）の綴りにする。"""
+    n = 2 if chord[1:2] == '#' else 1
+    return names[NOTE_NAMES.index(chord[:n])] + chord[n:]
+
+
+def label_keys(results, analyzer, spellings=None):
+    """
+    ワーカーの結果（chords はシャープ表記）に key と romans を付ける（まとめて NumPy で処理）。
+    1. 構成音から調を推定し、コード名をその調の綴りに直す
+    2. 直したコード名で KeyAnalyzer.analyze し、調とローマ数字を取る（ダイアトニック外は None）
+    """
+    spellings = spellings or key_spellings(analyzer)
+    todo = [r for r in results if r.get("chords")]
+    if not todo:
+        return results
+    ids, offsets = analyzer.encode([r["chords"] for r in todo])
+    for r, k in zip(todo, analyzer.detect_keys(ids, offsets)):
+        names = spellings[k]
+        r["chords"] = [_respell(c, names) for c in r["chords"]]
+    for r, (key, romans) in zip(todo, analyzer.analyze([r["chords"] for r in todo])):
+        r["key"] = key
+        r["romans"] = romans
+    return results
+
+
+def analyze_file(path):
+    """1ファイル分の結果（dict）。例外はエラーとして結果に入れる。"""
+    try:
+        hists, _ = bar_histograms(path)
+        chords = []
+        for h in hists:
+            c = identify_chord(h)
+            # 同じコードが続く小節は1つにまとめる
+            if c is not None and (not chords or chords[-1] != c):
+                chords.append(c)
+        # key / romans は親プロセスの label_keys で入れる
+        return {"path": path, "bars": len(hists), "key": None,
+                "chords": [chord_label(r, q) for r, q in chords], "romans": []}
+    except Exception as e:
+        return {"path": path, "error": repr(e)}
+
+
+def iter_midi_files(directory):
+    for dirpath, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith((".mid", ".midi")):
+                yield os.path.join(dirpath, name)
+
+
+def import_directory(directory, workers=None, chunksize=64):
+    """ディレクトリ内の全ファイルを並列に解析し、終わった順に結果を返す（ストリーミング）。"""
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(analyze_file, iter_midi_files(directory), chunksize)
+
+
+def _collapse(seq):
+    """同じものが続くところを1つにまとめる（analyze_file が小節をまとめるのと同じ）。"""
+    out = []
+    for x in seq:
+        if not out or out[-1] != x:
+            out.append(x)
+    return out
+
+
+def match_patterns(romans, patterns):
+    """
+    romans（ファイルの進行）の中に現れる COMMON_PATTERNS のテンプレートを返す。
+    patterns: {style: [[roman, ...], ...]}
+    analyze_file は同じコードが続く小節を1つにまとめているので、テンプレートも同じようにまとめてから探す
+    （I-I-IV-V のようにコードを繰り返すテンプレートも当たる）。
+    """
+    seq = _collapse(r.replace('7', '') if r else None for r in romans)
+    found = []
+    for style, plist in patterns.items():
+        for p in plist:
+            q = _collapse(r.replace('7', '') for r in p)
+            n = len(q)
+            if any(seq[i:i + n] == q for i in range(len(seq) - n + 1)):
+                found.append((style, tuple(p)))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract chord progressions from a folder of MIDI files")
+    parser.add_argument("directory")
+    parser.add_argument("-o", "--output", help="JSON Lines output (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--batch", type=int, default=256, help="files per key-detection batch")
+    args = parser.parse_args(argv)
+
+    # 調の推定とテンプレートの集計に使う（ワーカーでは読み込まない）
+    from analysis import KeyAnalyzer
+    from theory import COMMON_PATTERNS, DIATONIC_MAJOR, chord_to_midi_notes
+
+    analyzer = KeyAnalyzer(DIATONIC_MAJOR, chord_to_midi_notes)
+    spellings = key_spellings(analyzer)
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    counts = {}
+    n = errors = 0
+    pending = []
+
+    def write_pending():
+        for res in label_keys(pending, analyzer, spellings):
+            if "error" not in res:
+                res["patterns"] = [f"{s}:{'-'.join(p)}" for s, p in match_patterns(res["romans"], COMMON_PATTERNS)]
+                for name in res["patterns"]:
+                    counts[name] = counts.get(name, 0) + 1
+            out.write(json.dumps(res, ensure_ascii=False) + "\n")
+        pending.clear()
+
+    t0 = time.perf_counter()
+    try:
+        for res in import_directory(args.directory, args.workers):
+            n += 1
+            if "error" in res:
+                errors += 1
+            pending.append(res)
+            if len(pending) >= args.batch:
+                write_pending()
+        write_pending()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - t0
+    rate = n / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"{n} files ({errors} errors) in {elapsed:.1f}s = {rate:,.0f} files/min", file=sys.stderr)
+    for name, c in sorted(counts.items(), key=lambda x: -x[1]):
+        print(f"{c:8d}  {name}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# mixer.py
+# ブロック単位のポリフォニック・ミキサー（NumPy）。
+# 出力バッファや作業領域はすべて最初に確保し、render() の中では配列データを新しく確保しない。
+# 出力は WAV ファイル（WavWriter）か、オーディオコールバック（callback）へ。
+import sys
+import time
+import wave
+
+import numpy as np
+
+from arrangement import NOTE_ON
+
+SAMPLE_RATE = 44100
+
+
+class Mixer:
+    """
+    max_voices: 同時発音数の上限。超えたら一番古いボイスを止めて使い回す。
+    各ボイスはモノラルの float32 ソースを、左右のゲインを掛けてステレオに足し込む。
+    start() はハンドル (ボイス番号, 世代) を返す。release(handle) するとリリースカーブ
+    （あらかじめ計算済み）に沿ってフェードアウトする。ボイスが盗まれたり使い回されたりして
+    世代が変わっていれば、古いハンドルの release() は何もしない。
+    """
+
+    def __init__(self, block_size=256, max_voices=64, sample_rate=SAMPLE_RATE, release_time=0.08):
+        self.block_size = block_size
+        self.max_voices = max_voices
+        self.sample_rate = sample_rate
+
+        self.out = np.zeros((block_size, 2), dtype=np.float32)
+        self._scratch = np.zeros(block_size, dtype=np.float32)
+        self._scaled = np.zeros(block_size, dtype=np.float32)
+        self._pcm16 = np.zeros((block_size, 2), dtype=np.int16)
+
+        release_len = max(1, int(release_time * sample_rate))
+        # 末尾に block_size 分の 0 を足しておくと、スライスがはみ出しても長さが揃う
+        self._release_curve = np.zeros(release_len + block_size, dtype=np.float32)
+        self._release_curve[:release_len] = np.linspace(1.0, 0.0, release_len, dtype=np.float32)
+        self.release_len = release_len
+
+        self.sources = [None] * max_voices
+        self.positions = np.zeros(max_voices, dtype=np.int64)
+        self.gain_l = np.zeros(max_voices, dtype=np.float32)
+        self.gain_r = np.zeros(max_voices, dtype=np.float32)
+        self.active = np.zeros(max_voices, dtype=bool)
+        self.releasing = np.full(max_voices, -1, dtype=np.int64)  # リリース開始からのサンプル数（-1 = 発音中）
+        self.started = np.zeros(max_voices, dtype=np.int64)
+        self.generation = np.zeros(max_voices, dtype=np.int64)
+        # 発音中のボイス番号（先頭 _n_active 個）と空きボイス（先頭 _n_free 個）。
+        # render() で np.flatnonzero(self.active) のような配列を毎ブロック作らないため。
+        self._active_idx = np.zeros(max_voices, dtype=np.int64)
+        self._n_active = 0
+        self._free = np.arange(max_voices - 1, -1, -1, dtype=np.int64)
+        self._n_free = max_voices
+        self._left = 0              # callback() で self.out に残っている未送出フレーム数
+        self._counter = 0
+        self.stolen = 0
+
+    # ---------- ボイス操作 ----------
+    def start(self, source, gain=0.5, pan=0.0):
+        """source（float32 モノラル）を鳴らし、(ボイス番号, 世代) を返す。pan は -1（左）〜 1（右）。"""
+        if self._n_free:
+            self._n_free -= 1
+            v = int(self._free[self._n_free])
+            self._active_idx[self._n_active] = v
+            self._n_active += 1
+        else:
+            # 空きがなければ一番古いボイスを盗む（発音中の並びにはもう入っている）
+            v = int(self.started.argmin())
+            self.stolen += 1
+        self._counter += 1
+        self.generation[v] += 1
+        self.sources[v] = source
+        self.positions[v] = 0
+        self.gain_l[v] = gain * (1.0 - max(0.0, pan))
+        self.gain_r[v] = gain * (1.0 + min(0.0, pan))
+        self.releasing[v] = -1
+        self.started[v] = self._counter
+        self.active[v] = True
+        return v, int(self.generation[v])
+
+    def release(self, handle):
+        v, gen = handle
+        if self.active[v] and self.generation[v] == gen and self.releasing[v] < 0:
+            self.releasing[v] = 0
+
+    def stop_all(self):
+        self.active[:] = False
+        self.sources = [None] * self.max_voices
+        self._n_active = 0
+        self._free[:] = np.arange(self.max_voices - 1, -1, -1)
+        self._n_free = self.max_voices
+
+    def _finish(self, i):
+        """発音中の並びの i 番目のボイスを止めて空きに戻す。"""
+        v = int(self._active_idx[i])
+        self.active[v] = False
+        self.sources[v] = None
+        self._n_active -= 1
+        self._active_idx[i] = self._active_idx[self._n_active]
+        self._free[self._n_free] = v
+        self._n_free += 1
+
+    @property
+    def voice_count(self):
+        return self._n_active
+
+    # ---------- レンダリング ----------
+    def render(self, out=None):
+        """
+        1ブロック分を out（省略時は self.out, shape=(block_size, 2) の float32）に書き込んで返す。
+        """
+        if out is None:
+            out = self.out
+        out.fill(0.0)
+        bs = self.block_size
+        curve = self._release_curve
+        # 後ろから回すので、止めたボイスの位置に末尾（処理済み）を詰めても取りこぼさない
+        for i in range(self._n_active - 1, -1, -1):
+            v = int(self._active_idx[i])
+            src = self.sources[v]
+            pos = int(self.positions[v])
+            n = min(bs, src.shape[0] - pos)
+            if n <= 0:
+                self._finish(i)
+                continue
+            s = self._scratch[:n]
+            g = self._scaled[:n]
+            s[:] = src[pos:pos + n]
+            rel = int(self.releasing[v])
+            if rel >= 0:
+                np.multiply(s, curve[rel:rel + n], out=s)
+                self.releasing[v] = rel + n
+            np.multiply(s, self.gain_l[v], out=g)
+            np.add(out[:n, 0], g, out=out[:n, 0])
+            np.multiply(s, self.gain_r[v], out=g)
+            np.add(out[:n, 1], g, out=out[:n, 1])
+            self.positions[v] = pos + n
+            if rel >= 0 and rel + n >= self.release_len:
+                self._finish(i)
+        return out
+
+    def render_pcm16(self):
+        """1ブロックを int16 ステレオで返す（内部バッファの参照）。"""
+        out = self.render()
+        np.clip(out, -1.0, 1.0, out=out)
+        np.multiply(out, 32767.0, out=out)
+        self._pcm16[:] = out
+        return self._pcm16
+
+    def callback(self, outdata, frames=None, time_info=None, status=None):
+        """
+        sounddevice などのコールバック形式。outdata（float32, (frames, 2)）に書く。
+        frames が block_size と同じなら直接書き、違えば self.out にブロック単位で描いて切り出す
+        （余ったフレームは次のコールバックの頭に回す）。
+        """
+        if frames is None:
+            frames = len(outdata)
+        if frames == self.block_size and not self._left:
+            self.render(outdata)
+            return
+        bs = self.block_size
+        done = 0
+        while done < frames:
+            if not self._left:
+                self.render()
+                self._left = bs
+            pos = bs - self._left
+            n = min(self._left, frames - done)
+            outdata[done:done + n] = self.out[pos:pos + n]
+            self._left -= n
+            done += n
+
+
+class WavWriter:
+    """Mixer のブロックを 16bit ステレオの WAV に書き出す。"""
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE):
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(2)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sample_rate)
+
+    def write(self, pcm16):
+        self.wav.writeframes(memoryview(pcm16))
+
+    def close(self):
+        self.wav.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def render_events(events, beat_length, note_source, path, block_size=256, max_voices=64, tail=1.0):
+    """
+    arrangement のイベント列を MIDI デバイスなしで WAV に書き出す。
+    note_source(note, velocity) -> float32 モノラルのソース（呼び出し側でキャッシュしてよい）。
+    イベントはブロック境界に合わせて処理する（256サンプルで約6ms）。
+    """
+    mixer = Mixer(block_size=block_size, max_voices=max_voices)
+    sr = mixer.sample_rate
+    voices = {}             # (channel, note) -> Mixer.start() のハンドル
+    block = 0
+    with WavWriter(path, sr) as w:
+        for beat, kind, channel, note, vel in events:
+            due_block = int(beat * beat_length * sr) // block_size
+            while block < due_block:
+                w.write(mixer.render_pcm16())
+                block += 1
+            key = (channel, note)
+            if key in voices:
+                mixer.release(voices.pop(key))
+            if kind == NOTE_ON:
+                voices[key] = mixer.start(note_source(note, vel), gain=0.3)
+        for v in voices.values():
+            mixer.release(v)
+        for _ in range(int(tail * sr) // block_size + 1):
+            w.write(mixer.render_pcm16())
+            block += 1
+    return block * block_size / sr
+
+
+# ---------- ベンチマーク ----------
+def benchmark(block_sizes=(64, 256, 1024), voices=64, seconds=2.0):
+    """
+    1コアでリアルタイムに維持できるボイス数を見積もる。
+    voices 本を鳴らし続けたときの1ブロックあたりの処理時間から、
+    ブロックの再生時間に収まる本数を計算する。
+    """
+    src = (np.random.default_rng(0).standard_normal(SAMPLE_RATE * 4) * 0.1).astype(np.float32)
+    print(f"{'block':>6} {'us/block':>10} {'us/voice':>10} {'voices/core':>12}")
+    for bs in block_sizes:
+        m = Mixer(block_size=bs, max_voices=voices)
+        for i in range(voices):
+            m.start(src, gain=0.1, pan=(i % 3 - 1) * 0.5)
+        blocks = int(seconds * SAMPLE_RATE / bs)
+        t0 = time.perf_counter()
+        for b in range(blocks):
+            if b and b % 100 == 0:
+                # ソースの終わりに来ないよう巻き戻す
+                m.positions[:] = 0
+            m.render()
+        elapsed = (time.perf_counter() - t0) / blocks
+        per_voice = elapsed / voices
+        budget = bs / SAMPLE_RATE
+        print(f"{bs:>6} {elapsed * 1e6:>10.1f} {per_voice * 1e6:>10.2f} {int(budget / per_voice):>12}")
+
+
+if __name__ == "__main__":
+    benchmark(voices=int(sys.argv[1]) if len(sys.argv) > 1 else 64)
@@ -0,0 +1,297 @@
+# playback.py
+# MIDI 出力（MidiManager）と、進行を奏法に従って送る再生ループ（play_progression）。GUI を持たない。
+# main_3.py（GUI）と、仮想MIDIで測るベンチマーク（virtual_midi.py, fanout.py など）の両方が使う。
+import bisect
+import threading
+import time
+
+import pygame.midi
+
+from arrangement import ARRANGEMENTS, NOTE_ON, NOTE_OFF, compile_progression, lane_channels
+from fanout import DeviceWriter
+from groove import humanize
+from scheduler import play_events
+from seeding import derive_seed
+from theory import cached_notes
+
+# ---------- MIDI ハンドリング（シングルトン風） ----------
+class MidiManager:
+    def __init__(self, backend=None):
+        # backend: pygame.midi と同じ関数を持つモジュール/オブジェクト（テストでは virtual_midi.VirtualMidi）
+        self.backend = backend or pygame.midi
+        self.initialized = False
+        self.output = None
+        self.device_id = None
+        self.lock = threading.Lock()
+        # PlaybackMetrics を入れると計測する（None なら計測なし）
+        self.metrics = None
+        # 複数出力（open_outputs）。空でなければ note_on/off は各デバイスのキューへ積むだけ
+        self.writers = {}
+        # デバイス名 -> 遅れ（秒）。calibration.LatencyProfile.latencies() を入れる
+        self.latencies = {}
+        self.output_latency = 0.0
+        # recorder.SessionRecorder を入れると、送ったイベントをすべてログに残す
+        self.recorder = None
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, rec):
+        # note_on/off では self.record（deque.append そのもの）を見るだけにする
+        self._recorder = rec
+        self.record = rec.record if rec else None
+
+    def init(self):
+        if not self.initialized:
+            try:
+                self.backend.init()
+                self.initialized = True
+            except Exception as e:
+                print("MIDI init error:", e)
+                self.initialized = False
+
+    def list_devices(self):
+        self.init()
+        devs = []
+        try:
+            for i in range(self.backend.get_count()):
+                info = self.backend.get_device_info(i)
+                interf, name, is_input, is_output, opened = info
+                name = name.decode('utf-8') if isinstance(name, bytes) else str(name)
+                devs.append((i, name, bool(is_output)))
+        except Exception as e:
+            print("Device listing error:", e)
+        return devs
+
+    def open_output(self, device_id):
+        self.init()
+        m = self.metrics
+        t0 = time.perf_counter() if m else 0.0
+        with self.lock:
+            if m:
+                m.lock_wait('open_output', t0)
+            try:
+                if self.output:
+                    try:
+                        self.output.close()
+                    except Exception as e:
+                        if m:
+                            m.error('open_output.close', e)
+                t1 = time.perf_counter() if m else 0.0
+                self.output = self.backend.Output(device_id)
+                self.device_id = device_id
+                self.output_latency = self.device_latency(device_id)
+                if m:
+                    m.device('open', device_id, t1)
+                return True
+            except Exception as e:
+                print("open_output error:", e)
+                if m:
+                    m.error('open_output', e)
+                self.output = None
+                return False
+
+    def open_outputs(self, device_ids, max_queue=256, policy="coalesce", max_lag=None):
+        """
+        複数のデバイスを同時に開き、それぞれに書き込みスレッド（fanout.DeviceWriter）を付ける。
+        1台が遅くても他のデバイスとスケジューラは止まらない。開けたデバイスIDのリストを返す。
+        """
+        self.init()
+        self.close_outputs()
+        m = self.metrics
+        names = {i: name for (i, name, is_out) in self.list_devices()}
+        writers = {}
+        for device_id in device_ids:
+            t0 = time.perf_counter() if m else 0.0
+            try:
+                out = self.backend.Output(device_id)
+            except Exception as e:
+                print(f"open_outputs error ({device_id}):", e)
+                if m:
+                    m.error('open_outputs', e)
+                continue
+            if m:
+                m.device('open', device_id, t0)
+            writers[device_id] = DeviceWriter(device_id, out, names.get(device_id, ""),
+                                              max_queue=max_queue, policy=policy, max_lag=max_lag, metrics=m,
+                                              latency=self.latencies.get(names.get(device_id), 0.0))
+        with self.lock:
+            self.writers = writers
+        return list(writers)
+
+    def close_outputs(self):
+        with self.lock:
+            writers, self.writers = self.writers, {}
+        for w in writers.values():
+            t0 = time.perf_counter()
+            try:
+                w.close()
+            except Exception as e:
+                if self.metrics:
+                    self.metrics.error('close_outputs', e)
+            if self.metrics:
+                self.metrics.device('close', w.device_id, t0)
+
+    def device_latency(self, device_id):
+        """キャリブレーション済みの遅れ（秒）。測っていなければ 0。"""
+        for i, name, is_out in self.list_devices():
+            if i == device_id:
+                return self.latencies.get(name, 0.0)
+        return 0.0
+
+    def lead_time(self):
+        """スケジューラが早めに送る秒数（開いている出力のうち一番大きい遅れ）。"""
+        writers = self.writers
+        if writers:
+            return max((w.latency for w in list(writers.values())), default=0.0)
+        return self.output_latency if self.output else 0.0
+
+    def output_stats(self):
+        """デバイスごとのキューの深さ・遅れ・捨てた数（DeviceWriter.stats）。"""
+        return [w.stats() for w in list(self.writers.values())]
+
+    def note_on(self, note, vel=100, channel=0, scheduled=None):
+        # close_outputs() が途中で {} に差し替えても、この呼び出しは同じ dict を使う
+        writers = self.writers
+        if writers:
+            self._fan_out(writers, NOTE_ON, note, vel, channel, scheduled)
+            return
+        m = self.metrics
+        t0 = time.perf_counter() if m else 0.0
+        with self.lock:
+            if m:
+                m.lock_wait('note_on', t0)
+            out = self.output
+            if out:
+                try:
+                    out.note_on(int(note), int(vel), int(channel))
+                except Exception as e:
+                    if m:
+                        m.error('note_on', e)
+        # 送り先がなければ記録しない（記録は実際に送ったイベントのログ）
+        r = self.record
+        if r and out:
+            r((scheduled or time.perf_counter(), 0x90 | channel, note, vel))
+        if m and scheduled is not None:
+            m.note('on', note, scheduled - self.output_latency)
+
+    def note_off(self, note, vel=100, channel=0, scheduled=None):
+        writers = self.writers
+        if writers:
+            self._fan_out(writers, NOTE_OFF, note, vel, channel, scheduled)
+            return
+        m = self.metrics
+        t0 = time.perf_counter() if m else 0.0
+        with self.lock:
+            if m:
+                m.lock_wait('note_off', t0)
+            out = self.output
+            if out:
+                try:
+                    out.note_off(int(note), int(vel), int(channel))
+                except Exception as e:
+                    if m:
+                        m.error('note_off', e)
+        # 送り先がなければ記録しない（記録は実際に送ったイベントのログ）
+        r = self.record
+        if r and out:
+            r((scheduled or time.perf_counter(), 0x80 | channel, note, vel))
+        if m and scheduled is not None:
+            m.note('off', note, scheduled - self.output_latency)
+
+    def _fan_out(self, writers, kind, note, vel, channel, scheduled):
+        # 各デバイスのキューに積むだけ（ロック不要）。metrics の actual はキューに積んだ時刻
+        writers = list(writers.values())
+        for w in writers:
+            w.submit(kind, channel, note, vel, scheduled)
+        r = self.record
+        if r:
+            r((scheduled or time.perf_counter(), (0x90 if kind == NOTE_ON else 0x80) | channel, note, vel))
+        m = self.metrics
+        if m and scheduled is not None:
+            m.note('on' if kind == NOTE_ON else 'off', note,
+                   scheduled - max((w.latency for w in writers), default=self.output_latency))
+
+    def close(self):
+        m = self.metrics
+        self.close_outputs()
+        with self.lock:
+            try:
+                if self.output:
+                    t0 = time.perf_counter() if m else 0.0
+                    self.output.close()
+                    if m:
+                        m.device('close', self.device_id, t0)
+                    self.output = None
+            except Exception as e:
+                if m:
+                    m.error('close', e)
+            try:
+                if self.initialized:
+                    self.backend.quit()
+                    self.initialized = False
+            except Exception as e:
+                if m:
+                    m.error('midi.quit', e)
+
+
+def play_progression(progression, tempo, play_style, loop, out, stop_flag, on_event=None,
+                     groove=None, seed=0, on_start=None, melody=None):
+    """
+    進行を奏法（ARRANGEMENTS）に従って out に送る。stop_flag がクリアされたら止まる。
+    GUI に依存しないので、仮想MIDIでのベンチマークからも呼べる。
+    on_event: 送ったイベントごとに (beat, kind, channel, note) で呼ぶ（再生位置の表示用）
+    groove: groove.GROOVES の名前。ループの周ごとに seed から決まる乱数でずらす（同じ seed なら同じ演奏）
+    on_start: 送り始める前に (拍0の perf_counter 時刻, beats_per_chord) で1回呼ぶ（jam.JamServer.begin 用）
+    melody: melody.MelodyLane。奏法のレーンに重ねて別チャンネルでリードを鳴らす
+    """
+    beat_length = 60.0 / tempo  # 1 beat (quarter note) in seconds
+
+    # Block / Arp / Band をイベント列にコンパイルし、1本のスケジューラで送る
+    beats_per_chord, lanes = ARRANGEMENTS.get(play_style, ARRANGEMENTS["Block"])
+    if melody is not None:
+        lanes = lanes + [melody]
+    pass_beats = beats_per_chord * len(progression)
+
+    def pass_events(n):
+        events = list(compile_progression(progression, lanes, beats_per_chord, cached_notes))
+        if groove:
+            events = humanize(events, tempo, groove, derive_seed(seed, n))
+        return events
+
+    try:
+        passes = 0
+        events = pass_events(0)
+        # 出力の遅れの分だけ早く送る（calibration.py）。最初の音が遅れないよう開始もその分ずらし、
+        # グルーブで拍0より前にずれた音（Push）があればさらにその分だけ遅らせる
+        lead = out.lead_time()
+        first = events[0][0] if events else 0.0
+        start = time.perf_counter() + lead + max(0.0, -first) * beat_length
+        if on_start is not None:
+            on_start(start, beats_per_chord)
+        while stop_flag.is_set():
+            # グルーブのずれは周の境目をまたぐ（次の周の頭が前にずれる・この周の最後が後ろにずれる）ので、
+            # 次の周の最初の音より後ろに来る音は送らずに次の周へ回し、次の周の音と時刻順に混ぜて送る
+            upcoming = pass_events(passes + 1) if loop else []
+            cut = pass_beats + upcoming[0][0] if upcoming else float("inf")
+            i = bisect.bisect_left([e[0] for e in events], cut)
+            if not play_events(events[:i], out, beat_length, start, stop_flag, lead, on_event):
+                break
+            start += pass_beats * beat_length
+            passes += 1
+            if not loop:
+                break
+            carry = [(e[0] - pass_beats,) + tuple(e[1:]) for e in events[i:]]
+            events = sorted(carry + upcoming, key=lambda e: e[:4]) if carry else upcoming
+    finally:
+        # ensure all notes off
+        # attempt to turn off any lingering notes
+        for ch in lane_channels(lanes):
+            for n in range(0, 128):
+                try:
+                    out.note_off(n, 0, channel=ch)
+                except Exception as e:
+                    if out.metrics:
+                        out.metrics.error('all_notes_off', e)
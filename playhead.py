@@ -0,0 +1,273 @@
+# playhead.py
+# 再生中のコードと鳴っている音（指板上の位置）を GUI に表示する。
+# 再生スレッドは PlayheadFeed.post() で deque に積むだけ（ロックなし、Tk には触らない）。
+# Tk スレッドは root.after で最大 fps 回/秒だけ drain() し、その間のイベントは
+# 「最後の拍 + 今鳴っている音の集合」の1状態にまとめてから描画する（音ごとには描かない）。
+# 再生スレッドが終わったら finish() を積み、Tk 側はそれを描き終えた時点で after を止める。
+import collections
+import statistics
+import time
+import tkinter as tk
+
+from arrangement import NOTE_ON, DRUM_CHANNEL
+
+FINISHED = object()     # finish() の印
+
+# 標準チューニング（6弦 -> 1弦）の開放弦
+STANDARD_TUNING = (40, 45, 50, 55, 59, 64)
+FRETS = 15
+
+
+class PlayheadFeed:
+    """
+    再生スレッド -> Tk スレッドの受け渡し。
+    deque の append / popleft はスレッドセーフなのでロックは使わない。
+    maxlen を超えて溜まったら古いイベントから捨てる（描画が止まっていても再生は遅れない）。
+    """
+
+    def __init__(self, maxlen=4096):
+        self.events = collections.deque(maxlen=maxlen)
+        self.held = set()       # (channel, note)。Tk スレッド側だけが触る
+        self.beat = None
+        self.finished = False   # 最後に取り出したのが finish() の印なら True
+
+    def post(self, beat, kind, channel, note):
+        self.events.append((beat, kind, channel, note))
+
+    def reset(self):
+        self.events.clear()
+        self.events.append(None)    # Tk スレッド側で held をクリアする印
+
+    def finish(self):
+        """再生スレッドの終わりに呼ぶ。held をクリアし、そこで描画を止めてよいことを知らせる。"""
+        self.reset()
+        self.events.append(FINISHED)
+
+    def drain(self):
+        """
+        溜まったイベントをまとめて適用し、変化があれば (beat, 鳴っている音) を返す。なければ None。
+        ドラムは指板に出さない。
+        """
+        changed = False
+        events = self.events
+        while events:
+            try:
+                ev = events.popleft()
+            except IndexError:
+                break
+            if ev is FINISHED:
+                self.finished = True
+                continue
+            changed = True
+            self.finished = False
+            if ev is None:
+                self.held.clear()
+                self.beat = None
+                continue
+            beat, kind, channel, note = ev
+            self.beat = beat
+            if channel == DRUM_CHANNEL:
+                continue
+            # 同じ音を別のチャンネル（メロディーなど）でも鳴らすので、チャンネルごとに数える
+            if kind == NOTE_ON:
+                self.held.add((channel, note))
+            else:
+                self.held.discard((channel, note))
+        if not changed:
+            return None
+        return self.beat, frozenset(note for _, note in self.held)
+
+
+def fret_positions(note, tuning=STANDARD_TUNING, frets=FRETS):
+    """MIDIノートを弾ける (弦, フレット) の一覧。弦は 0 = 6弦。"""
+    return [(s, note - open_) for s, open_ in enumerate(tuning) if 0 <= note - open_ <= frets]
+
+
+class PlayheadView:
+    """
+    進行のコード枠と指板を1つの Canvas に描く。項目は最初に全部作っておき、
+    フレームごとには色を変える（itemconfigure）だけにする。
+    """
+
+    def __init__(self, parent, feed, fps=60, width=760, height=170):
+        self.feed = feed
+        self.frame_ms = max(1, int(1000 / fps))
+        self.canvas = tk.Canvas(parent, width=width, height=height, bg="#111", highlightthickness=0)
+        self.width = width
+        self.progression = []
+        self.beats_per_chord = 1
+        self.chord_items = []
+        self.current_chord = None
+        self.lit = set()
+        self.frame_times = collections.deque(maxlen=600)
+        self.frames = 0
+        self._job = None
+        self._build_fretboard(height)
+
+    def pack(self, **kw):
+        self.canvas.pack(**kw)
+
+    def _build_fretboard(self, height):
+        c = self.canvas
+        top, left = 50, 20
+        self.fret_w = (self.width - left * 2) / (FRETS + 1)
+        self.string_h = (height - top - 10) / (len(STANDARD_TUNING) - 1)
+        for f in range(FRETS + 2):
+            x = left + f * self.fret_w
+            c.create_line(x, top, x, top + self.string_h * 5, fill="#555", width=3 if f == 1 else 1)
+        self.dots = {}
+        for s in range(len(STANDARD_TUNING)):
+            # 1弦を上に描く
+            y = top + (len(STANDARD_TUNING) - 1 - s) * self.string_h
+            c.create_line(left, y, self.width - left, y, fill="#888")
+            for f in range(FRETS + 1):
+                x = left + (f + 0.5) * self.fret_w
+                self.dots[(s, f)] = c.create_oval(x - 6, y - 6, x + 6, y + 6, fill="", outline="", state="hidden")
+
+    def set_progression(self, progression, beats_per_chord):
+        """再生開始時に Tk スレッドから呼ぶ。"""
+        c = self.canvas
+        for item in self.chord_items:
+            c.delete(item[0])
+            c.delete(item[1])
+        self.chord_items = []
+        self.progression = list(progression)
+        self.beats_per_chord = beats_per_chord
+        n = max(1, len(self.progression))
+        w = (self.width - 40) / n
+        for i, chord in enumerate(self.progression):
+            x0 = 20 + i * w
+            box = c.create_rectangle(x0 + 2, 8, x0 + w - 2, 38, fill="#222", outline="#444")
+            label = c.create_text(x0 + w / 2, 23, text=chord, fill="#E8E8E8", font=("Consolas", 11))
+            self.chord_items.append((box, label))
+        self.current_chord = None
+        self._light(frozenset())
+        self.feed.reset()
+
+    def start(self):
+        if self._job is None:
+            self._job = self.canvas.after(self.frame_ms, self._tick)
+
+    def stop(self):
+        if self._job is not None:
+            try:
+                self.canvas.after_cancel(self._job)
+            except tk.TclError:
+                pass
+            self._job = None
+
+    def _tick(self):
+        t0 = time.perf_counter()
+        state = self.feed.drain()
+        if state is not None:
+            self.render(*state)
+        self.frame_times.append(time.perf_counter() - t0)
+        self.frames += 1
+        if self.feed.finished and not self.feed.events:
+            # 再生が終わって描き切ったので止まる（次の再生で start() し直す）
+            self._job = None
+            return
+        self._job = self.canvas.after(self.frame_ms, self._tick)
+
+    def render(self, beat, held):
+        if beat is not None and self.progression:
+            idx = int(beat // self.beats_per_chord) % len(self.progression)
+        else:
+            idx = None
+        if idx != self.current_chord:
+            if self.current_chord is not None:
+                self.canvas.itemconfigure(self.chord_items[self.current_chord][0], fill="#222")
+            if idx is not None:
+                self.canvas.itemconfigure(self.chord_items[idx][0], fill="#1f6f8b")
+            self.current_chord = idx
+        self._light(held)
+
+    def _light(self, held):
+        want = {pos for note in held for pos in fret_positions(note)}
+        c = self.canvas
+        for pos in self.lit - want:
+            c.itemconfigure(self.dots[pos], state="hidden")
+        for pos in want - self.lit:
+            c.itemconfigure(self.dots[pos], state="normal", fill="#f0a030")
+        self.lit = want
+
+    def frame_stats(self):
+        times = [t * 1000.0 for t in self.frame_times]
+        return {
+            "frames": self.frames,
+            "frame_mean_ms": statistics.fmean(times) if times else 0.0,
+            "frame_max_ms": max(times) if times else 0.0,
+        }
+
+
+def benchmark(seconds=10.0, max_frame_ms=4.0, style="Arp"):
+    """
+    200 BPM のアルペジオ（style で Band なども可）を仮想MIDIで流しながら、Tk 側の1フレームの処理時間を測る。
+    ディスプレイがなければ drain（まとめ処理）だけを同じ間隔で回して測る。
+    1フレームの最大処理時間が max_frame_ms を超えたら終了コード 1。
+    """
+    import random
+    import threading
+    from arrangement import ARRANGEMENTS
+    from playback import MidiManager, play_progression
+    from theory import generate_progression
+    from virtual_midi import VirtualMidi
+
+    prog = generate_progression('C', 'Pop', 16, rng=random.Random(1))
+    feed = PlayheadFeed()
+    mm = MidiManager(backend=VirtualMidi())
+    mm.open_output(0)
+    flag = threading.Event()
+    flag.set()
+    posted = [0]
+
+    def post(beat, kind, channel, note):
+        posted[0] += 1
+        feed.post(beat, kind, channel, note)
+
+    player = threading.Thread(target=play_progression, args=(prog, 200, style, True, mm, flag),
+                              kwargs={"on_event": post}, daemon=True)
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        root = None
+
+    if root is not None:
+        view = PlayheadView(root, feed)
+        view.pack()
+        view.set_progression(prog, ARRANGEMENTS[style][0])
+        view.start()
+        player.start()
+        root.after(int(seconds * 1000), root.quit)
+        root.mainloop()
+        stats = view.frame_stats()
+        root.destroy()
+        mode = "tk"
+    else:
+        # 描画なし: drain だけを 60Hz で回す
+        times = []
+        frames = 0
+        player.start()
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            t0 = time.perf_counter()
+            feed.drain()
+            times.append((time.perf_counter() - t0) * 1000.0)
+            frames += 1
+            time.sleep(1 / 60)
+        stats = {"frames": frames, "frame_mean_ms": statistics.fmean(times), "frame_max_ms": max(times)}
+        mode = "headless (drain only)"
+    flag.clear()
+    player.join(timeout=2.0)
+    ok = stats["frame_max_ms"] <= max_frame_ms
+    print(f"mode: {mode}, style: {style} @ 200 BPM")
+    print(f"events posted: {posted[0]:,} in {seconds:.0f}s, frames: {stats['frames']} "
+          f"({posted[0] / max(1, stats['frames']):.1f} events coalesced per frame)")
+    print(f"{'PASS' if ok else 'FAIL'} UI time per frame: mean {stats['frame_mean_ms']:.3f} ms, "
+          f"max {stats['frame_max_ms']:.3f} ms (limit {max_frame_ms} ms)")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(0 if benchmark(style=sys.argv[1] if len(sys.argv) > 1 else "Arp") else 1)
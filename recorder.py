@@ -0,0 +1,376 @@
+# recorder.py
+# MidiManager が送ったイベントをすべて残すセッションレコーダと、その再生・変換。
+# あとから演奏やタイミングの不具合を再現できるように、常に記録しておく。
+#
+# ファイル形式（リトルエンディアン）:
+#   ヘッダ 32 バイト: b"GSES", 版(u32), 記録開始の時刻(f64, time.time()), レコード長(u32), 予備
+#   レコード 12 バイト: 記録開始からの秒数(f64。スケジュールされたイベントは送る予定の時刻), ステータス(u8: 0x90|ch / 0x80|ch), ノート(u8), ベロシティ(u8), 予備
+#
+# 記録は deque にタプルを1つ積むだけ（関数呼び出しなし。1イベント 1µs 未満）。
+# flush_interval 秒ごとに、書き込みスレッドがまとめてレコードにしてファイルへ書く。
+# sessions/ には起動ごとに1ファイルできるので、open_new が古いものから消す（SESSIONS_KEEP 個まで）。
+# 途中で落ちても、最後の書き込みまでのレコードは読める（半端なレコードは捨てる）。
+#
+# python recorder.py                         記録のオーバーヘッドを測る
+# python recorder.py replay LOG [--speed S]  仮想MIDIへ再生（S=0 はできるだけ速く）
+# python recorder.py midi LOG OUT.mid        SMF（フォーマット0）に変換
+# python recorder.py wav LOG OUT.wav         内蔵シンセで WAV に書き出す
+import collections
+import itertools
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from arrangement import NOTE_ON, NOTE_OFF
+from scheduler import wait_until
+
+MAGIC = b"GSES"
+VERSION = 1
+HEADER = struct.Struct("<4sIdI12x")
+RECORD = struct.Struct("<dBBBx")
+RECORD_SIZE = RECORD.size
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("status", "u1"), ("note", "u1"), ("vel", "u1"), ("pad", "u1")])
+SESSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions")
+SESSIONS_KEEP = 20                      # 残すセッションファイルの数
+SESSIONS_MAX_BYTES = 256 * 1024 * 1024  # 残すセッションファイルの合計サイズ
+
+
+class SessionRecorder:
+    """
+    1セッション = 1ファイル。record はどのスレッドから呼んでもよい。
+    record((時刻, ステータス, ノート, ベロシティ)) の時刻は time.perf_counter() の値
+    （スケジュールされたイベントなら scheduled をそのまま渡し、clock() を呼ばない）。
+    capacity: 書き出し待ちにためておけるレコード数。書き込みスレッドが見たときにこれより多く
+              たまっていたら（書き込みが追いつかない）、古いレコードから捨てて dropped に数える
+
+    record は deque.append そのもの（Python の関数を1段も挟まない。タプルを作って渡すだけ）。
+    ロックも使わない（with lock だけで 0.4µs かかる）。append / popleft はスレッドセーフ。
+    deque に maxlen を付けると黙って捨てて数えられないので、上限は書き込みスレッドが守る
+    （その間にたまる分だけ capacity を超えることがある）。
+    書き込みスレッドが flush_interval ごとにたまった分を取り出し、NumPy でまとめてレコードにして書く。
+    """
+
+    def __init__(self, path, capacity=1 << 18, flush_interval=0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.started, RECORD_SIZE))
+        self.file.flush()
+        self.capacity = capacity
+        self._pending = collections.deque()
+        self.record = self._pending.append
+        self._flushed = 0           # 書き出し済みのレコード数（書き込みスレッドだけが触る）
+        self._wake = threading.Event()
+        self.dropped = 0            # 捨てたレコード数（書き込みスレッドだけが触る）
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def open_new(cls, directory=SESSIONS_DIR, keep=SESSIONS_KEEP, max_bytes=SESSIONS_MAX_BYTES, **kw):
+        """directory に日時の名前で新しいセッションファイルを作る。古いセッションは prune_sessions で消す。"""
+        os.makedirs(directory, exist_ok=True)
+        prune_sessions(directory, keep - 1, max_bytes)
+        name = time.strftime("session-%Y%m%d-%H%M%S") + f"-{os.getpid()}.gses"
+        return cls(os.path.join(directory, name), **kw)
+
+    # ---------- 書き込みスレッド ----------
+    def _run(self):
+        while self.running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write_ready()
+        self._write_ready()
+
+    def _write_ready(self):
+        """たまっているレコードをファイルへ書く。書いた数を返す。"""
+        pending = self._pending
+        n = len(pending)
+        if not n:
+            return 0
+        popleft = pending.popleft
+        if n > self.capacity:
+            # 書き込みが追いつかない: 古いほうから捨てる
+            for _ in range(n - self.capacity):
+                popleft()
+            self.dropped += n - self.capacity
+            n = self.capacity
+        # np.array(タプルのリスト) より、平らにして fromiter で読むほうが倍ほど速い
+        rows = np.fromiter(itertools.chain.from_iterable(popleft() for _ in range(n)),
+                           dtype=np.float64, count=4 * n).reshape(n, 4)
+        out = np.zeros(n, dtype=RECORD_DTYPE)
+        out["t"] = rows[:, 0] - self.t0
+        out["status"] = rows[:, 1]
+        out["note"] = rows[:, 2]
+        out["vel"] = rows[:, 3]
+        self.file.write(out.tobytes())
+        self.file.flush()
+        self._flushed += n
+        return n
+
+    def flush(self):
+        """今までの記録をすぐファイルに書くよう書き込みスレッドを起こす（待たない）。"""
+        self._wake.set()
+
+    def close(self, timeout=2.0):
+        self.running = False
+        self._wake.set()
+        self.thread.join(timeout)
+        self.file.close()
+
+    def stats(self):
+        return {"path": self.path, "records": self._flushed, "dropped": self.dropped}
+
+
+def prune_sessions(directory=SESSIONS_DIR, keep=SESSIONS_KEEP, max_bytes=SESSIONS_MAX_BYTES):
+    """
+    directory のセッションファイルを新しいほうから keep 個、合計 max_bytes まで残し、残りを消す。
+    消した数を返す。
+    """
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith(".gses"):
+            path = os.path.join(directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, path, st.st_size))
+    files.sort(reverse=True)
+    removed = 0
+    total = 0
+    for i, (_, path, size) in enumerate(files):
+        total += size
+        if i >= keep or total > max_bytes:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+# ---------- 読み出し ----------
+def read_session(path):
+    """(記録開始の time.time(), 時刻順のレコードの構造化配列) を返す。末尾の半端なレコードは捨てる。"""
+    with open(path, "rb") as f:
+        head = f.read(HEADER.size)
+        if len(head) < HEADER.size:
+            raise ValueError(f"{path}: not a session log (too short)")
+        magic, version, started, size = HEADER.unpack(head)
+        if magic != MAGIC or size != RECORD_SIZE:
+            raise ValueError(f"{path}: not a session log")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported session log version {version}")
+        data = f.read()
+    n = len(data) // RECORD_SIZE
+    # 時刻は送る予定の時刻なので、書いた順（送った順）と前後することがある
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=n)
+    return started, records[np.argsort(records["t"], kind="stable")]
+
+
+def to_events(records):
+    """レコード -> arrangement と同じ (秒, kind, channel, note, vel) のイベント列。"""
+    kinds = np.where((records["status"] & 0xF0 == 0x90) & (records["vel"] > 0), NOTE_ON, NOTE_OFF)
+    return list(zip(records["t"].tolist(), kinds.tolist(), (records["status"] & 0x0F).tolist(),
+                    records["note"].tolist(), records["vel"].tolist()))
+
+
+def replay(records, out, speed=1.0, stop_flag=None):
+    """
+    out（note_on/note_off(note, vel, channel) を持つもの）へ流し直す。
+    speed: 1.0 で記録どおりの間隔、2.0 で2倍速、0 ならできるだけ速く。送った数を返す。
+    """
+    events = to_events(records)
+    if not events:
+        return 0
+    base = events[0][0]
+    start = time.perf_counter()
+    sent = 0
+    for t, kind, channel, note, vel in events:
+        if stop_flag is not None and not stop_flag.is_set():
+            break
+        if speed and not wait_until(start + (t - base) / speed, stop_flag):
+            break
+        if kind == NOTE_ON:
+            out.note_on(note, vel, channel)
+        else:
+            out.note_off(note, vel, channel)
+        sent += 1
+    return sent
+
+
+def _varlen(n):
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append(0x80 | (n & 0x7F))
+        n >>= 7
+    return bytes(reversed(out))
+
+
+def to_midi(records, path, ticks_per_beat=480, tempo=120.0):
+    """SMF フォーマット0に書き出す。秒は tempo（BPM）でティックに直す。"""
+    ticks_per_second = ticks_per_beat * tempo / 60.0
+    t = records["t"] - (records["t"][0] if len(records) else 0.0)
+    ticks = np.round(t * ticks_per_second).astype(np.int64)
+    track = bytearray()
+    us_per_beat = int(round(60_000_000 / tempo))
+    track += b"\x00\xff\x51\x03" + us_per_beat.to_bytes(3, "big")
+    last = 0
+    for tick, status, note, vel in zip(ticks.tolist(), records["status"].tolist(),
+                                      records["note"].tolist(), records["vel"].tolist()):
+        track += _varlen(tick - last)
+        track += bytes((status, note & 0x7F, vel & 0x7F))
+        last = tick
+    track += b"\x00\xff\x2f\x00"
+    with open(path, "wb") as f:
+        f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, ticks_per_beat))
+        f.write(b"MTrk" + struct.pack(">I", len(track)) + track)
+    return len(records)
+
+
+def to_wav(records, path, renderer=None):
+    """内蔵シンセ（synth.BuiltinRenderer）とミキサーで WAV に書き出す。秒数を返す。"""
+    from mixer import render_events
+    from synth import BuiltinRenderer
+
+    renderer = renderer or BuiltinRenderer()
+    sources = {}
+
+    def note_source(note, vel):
+        if (note, vel) not in sources:
+            sources[(note, vel)] = renderer.render_mono([note], duration=2.0, velocity=vel)
+        return sources[(note, vel)]
+
+    events = to_events(records)
+    if events:
+        base = events[0][0]
+        events = [(t - base, kind, ch, note, vel) for t, kind, ch, note, vel in events]
+    # 1拍 = 1秒として渡す
+    return render_events(events, 1.0, note_source, path)
+
+
+# ---------- ベンチマーク ----------
+class _NullOutput:
+    def note_on(self, note, vel, channel=0):
+        pass
+
+    def note_off(self, note, vel, channel=0):
+        pass
+
+    def close(self):
+        pass
+
+
+class _NullBackend:
+    """何もしない出力1台だけの MIDI バックエンド（オーバーヘッドの計測用）。"""
+
+    def init(self):
+        pass
+
+    def quit(self):
+        pass
+
+    def get_count(self):
+        return 1
+
+    def get_device_info(self, i):
+        return (b"null", b"null", 0, 1, 0)
+
+    def Output(self, device_id):
+        return _NullOutput()
+
+
+def benchmark(n=200_000, max_us=1.0):
+    """
+    MidiManager.note_on/note_off に記録を付けたときの1イベントあたりの増分と、
+    record() 単体の時間を測る。あわせて、書いたログを読み直して最高速で再生・変換する。
+    """
+    import tempfile
+    from playback import MidiManager
+    from virtual_midi import VirtualMidi
+
+    tmp = tempfile.mkdtemp()
+    mm = MidiManager(backend=_NullBackend())
+    mm.open_output(0)
+
+    def run():
+        # スケジューラと同じく、送る予定の時刻（scheduled）を付けて呼ぶ
+        t0 = time.perf_counter()
+        for i in range(n // 2):
+            mm.note_on(60 + i % 24, 100, i % 4, t0)
+            mm.note_off(60 + i % 24, 0, i % 4, t0)
+        return (time.perf_counter() - t0) / n
+
+    # 1コアでは揺れが大きいので、記録なし/ありを交互に測ってそれぞれの最小を取る
+    run()
+    rec = SessionRecorder(os.path.join(tmp, "bench.gses"))
+    base = with_rec = float("inf")
+    for _ in range(5):
+        mm.recorder = None
+        base = min(base, run())
+        mm.recorder = rec
+        with_rec = min(with_rec, run())
+        rec.flush()
+    mm.recorder = None
+    t0 = time.perf_counter()
+    for i in range(n):
+        rec.record((t0, 0x90, 60, 100))
+    record_only = (time.perf_counter() - t0) / n
+    rec.close()
+    overhead = (with_rec - base) * 1e6
+
+    started, records = read_session(rec.path)
+    size = os.path.getsize(rec.path)
+    print(f"note_on/off: {base * 1e6:.3f} us -> {with_rec * 1e6:.3f} us per event "
+          f"(recording adds {overhead:.3f} us), record() alone {record_only * 1e6:.3f} us")
+    print(f"log: {len(records):,} records, {size / 1e6:.1f} MB ({RECORD_SIZE} bytes/record), "
+          f"dropped={rec.dropped}")
+
+    backend = VirtualMidi()
+    out = backend.Output(0)
+    t0 = time.perf_counter()
+    sent = replay(records[:100_000], out, speed=0)
+    elapsed = time.perf_counter() - t0
+    print(f"replay (as fast as possible): {sent:,} events in {elapsed:.2f}s = {sent / elapsed:,.0f} events/s")
+    t0 = time.perf_counter()
+    to_midi(records, os.path.join(tmp, "bench.mid"))
+    print(f"to_midi: {time.perf_counter() - t0:.2f}s")
+    ok = overhead < max_us
+    print(f"{'PASS' if ok else 'FAIL'} recording overhead {overhead:.3f} us/event (limit {max_us} us)")
+    return ok
+
+
+def main(argv):
+    if not argv:
+        sys.exit(0 if benchmark() else 1)
+    cmd = argv[0]
+    if cmd == "replay" and len(argv) >= 2:
+        from virtual_midi import VirtualMidi
+        speed = float(argv[argv.index("--speed") + 1]) if "--speed" in argv else 1.0
+        started, records = read_session(argv[1])
+        backend = VirtualMidi()
+        out = backend.Output(0)
+        t0 = time.perf_counter()
+        sent = replay(records, out, speed)
+        print(f"{sent} events in {time.perf_counter() - t0:.2f}s "
+              f"(recorded {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))})")
+    elif cmd == "midi" and len(argv) >= 3:
+        started, records = read_session(argv[1])
+        print(f"{to_midi(records, argv[2])} events -> {argv[2]}")
+    elif cmd == "wav" and len(argv) >= 3:
+        started, records = read_session(argv[1])
+        print(f"{to_wav(records, argv[2]):.1f}s -> {argv[2]}")
+    else:
+        print("usage: recorder.py [replay LOG [--speed S] | midi LOG OUT.mid | wav LOG OUT.wav]")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,50 @@
+# scheduler.py
+# 時刻順のイベントストリームを1本のスレッドで出力へ送るスケジューラ。
+import time
+
+from arrangement import NOTE_ON
+
+
+# time.sleep は OS によって1ms前後寝過ごすので、最後の SPIN 秒はビジーウェイトで合わせる
+SPIN = 0.0015
+
+
+def wait_until(deadline, stop_flag=None, poll=0.05, spin=SPIN):
+    """
+    deadline（perf_counter秒）まで待つ。長い待ちは poll ごとに stop_flag を確認する。
+    False を返したら停止要求。
+    """
+    while True:
+        if stop_flag is not None and not stop_flag.is_set():
+            return False
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return True
+        if remaining > spin:
+            time.sleep(min(remaining - spin, poll))
+        else:
+            while time.perf_counter() < deadline:
+                pass
+            return True
+
+
+def play_events(events, out, beat_length, start, stop_flag=None, lead=0.0, on_event=None):
+    """
+    events: (beat, kind, channel, note, velocity) の時刻順イテレータ
+    out: note_on/note_off(note, vel, channel=, scheduled=) を持つ出力（MidiManager）
+    start: 拍0に対応する perf_counter 時刻
+    lead: 出力の遅れの補正。鳴るべき時刻 due より lead 秒早く送る（scheduled には due を渡す）
+    on_event: 送ったあとに (beat, kind, channel, note) で呼ぶ（playhead.PlayheadFeed.post など。軽い処理だけ）
+    最後まで送ったら True、途中で止まったら False。
+    """
+    for beat, kind, channel, note, vel in events:
+        due = start + beat * beat_length
+        if not wait_until(due - lead, stop_flag):
+            return False
+        if kind == NOTE_ON:
+            out.note_on(note, vel, channel=channel, scheduled=due)
+        else:
+            out.note_off(note, vel, channel=channel, scheduled=due)
+        if on_event is not None:
+            on_event(beat, kind, channel, note)
+    return True
@@ -0,0 +1,114 @@
+# seeding.py
+# 再現可能な乱数と生成ログ。
+# 生成はグローバルな random ではなく、シードから作った random.Random を渡して行う。
+# 同じ (seed, key, style, bars) なら必ず同じ進行になる。
+import hashlib
+import json
+import os
+import random
+import secrets
+import threading
+import time
+
+
+def new_seed():
+    """63bitの新しいシード（ログやUIに出して後から再現できるようにする）。"""
+    return secrets.randbits(63)
+
+
+def make_rng(seed=None):
+    """
+    seed から random.Random を作る。seed が None なら新しいシードを引く。
+    (rng, seed) を返す。
+    """
+    if seed is None:
+        seed = new_seed()
+    return random.Random(seed), seed
+
+
+def derive_seed(root_seed, *path):
+    """
+    root_seed と path（ワーカー番号やジョブ番号など）から子シードを決定的に作る。
+    呼び出し順に依存しないので、プロセスをまたいで分割しても重複しない。
+    """
+    h = hashlib.sha256(repr((int(root_seed),) + tuple(path)).encode("utf-8")).digest()
+    return int.from_bytes(h[:8], "little") >> 1
+
+
+def spawn_seeds(root_seed, n):
+    """ワーカーごとの子シードを n 個作る。"""
+    return [derive_seed(root_seed, i) for i in range(n)]
+
+
+def spawn_rngs(root_seed, n):
+    """ワーカーごとの random.Random を n 個作る。"""
+    return [random.Random(s) for s in spawn_seeds(root_seed, n)]
+
+
+# ---------- 生成ログ ----------
+class GenerationLog:
+    """
+    追記専用の生成ログ（JSON Lines）。1行 = 1回の生成。
+    {"seq", "time", "seed", "key", "style", "bars", "progression"}
+    追記の途中で落ちると最後の行が途切れるので、読むときは読めない行を飛ばし、
+    次の追記は新しい行から始める。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seq = 0
+        self._partial = False
+        if os.path.exists(path):
+            for rec in self.read(path):
+                self.seq = max(self.seq, rec.get("seq", 0))
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    self._partial = f.read(1) != b"\n"
+
+    def append(self, seed, key, style, bars, progression):
+        with self.lock:
+            self.seq += 1
+            rec = {
+                "seq": self.seq,
+                "time": time.time(),
+                "seed": seed,
+                "key": key,
+                "style": style,
+                "bars": bars,
+                "progression": list(progression),
+            }
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self._partial:
+                    f.write("\n")
+                    self._partial = False
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            return rec
+
+    @staticmethod
+    def read(path):
+        """記録を順に返す。途切れた行（JSON として読めない行）は飛ばす。"""
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(rec, dict):
+                    yield rec
+
+
+def replay(path, generate):
+    """
+    ログを先頭から再生する。generate(key, style, bars, rng=...) で作り直し、
+    (record, regenerated, matches) を順に返す。
+    """
+    for rec in GenerationLog.read(path):
+        rng = random.Random(rec["seed"])
+        prog = generate(rec["key"], rec["style"], rec["bars"], rng=rng)
+        yield rec, prog, list(prog) == rec["progression"]
@@ -0,0 +1,419 @@
+# similarity.py
+# 大量の進行から「I–V–vi–IV に似た進行（キーは問わない）」を探すインデックス。
+# - 進行は analysis.KeyAnalyzer で度数列（0..6、ダイアトニック外は 7）にするので移調に依存しない
+# - 度数の3-gram（進行はループするので末尾は先頭につなぐ）の集合を特徴にする
+# - 各進行に MinHash 署名（uint32 × SIG_SIZE）を持ち、LSH のバンドで候補を絞ってから署名の一致率で並べる
+# - 3-gram ごとの転置リストも持ち、バンドで候補が足りないときに使う
+# ディスク上はセグメント（ディレクトリ）ごとに .npy を置き、np.load(mmap_mode='r') で開く。
+# add() はメモリ上に溜め、flush() で新しいセグメントとして書き出す（既存のセグメントは書き換えない）。
+# 検索は全セグメントを回るので、同じくらいの大きさのセグメントが MERGE_FACTOR 個たまったら
+# 1つにまとめ直す（size-tiered。セグメント数は件数の対数程度に収まる）。
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from midi_import import DEGREE_ROMANS
+from theory import roman_degree
+
+N_SYMBOLS = 8          # 度数 0..6 + その他
+GRAM = 3
+VOCAB = N_SYMBOLS ** GRAM
+SIG_SIZE = 32
+BANDS = 8
+ROWS = SIG_SIZE // BANDS
+_PRIME = 4294967291    # 2^32 未満の素数
+_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5], dtype=np.uint64)
+MERGE_FACTOR = 4       # 同じ段（件数の log4）のセグメントがこの数たまったらまとめる
+
+
+def _hash_table(seed=12345):
+    """gram -> 各ハッシュ関数の値 (SIG_SIZE, VOCAB)。インデックスとクエリで同じものを使う。"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, SIG_SIZE, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, SIG_SIZE, dtype=np.uint64)
+    g = np.arange(VOCAB, dtype=np.uint64)
+    return ((a[:, None] * g[None, :] + b[:, None]) % _PRIME).astype(np.uint32)
+
+
+HASHES = _hash_table()
+
+
+def cyclic_grams(deg, offsets):
+    """フラットな度数列とオフセット -> 各位置の3-gram ID（行ごとに循環）。"""
+    deg = np.asarray(deg, dtype=np.int64)
+    lengths = np.diff(offsets)
+    starts = np.repeat(offsets[:-1], lengths)
+    lens = np.repeat(lengths, lengths)
+    pos = np.arange(len(deg))
+    rel = pos - starts
+    g = np.zeros(len(deg), dtype=np.int64)
+    for j in range(GRAM):
+        g = g * N_SYMBOLS + deg[starts + (rel + j) % lens]
+    return g
+
+
+def signatures(deg, offsets, chunk=100_000):
+    """MinHash 署名 (N, SIG_SIZE) uint32。空の進行は全部 0xFFFFFFFF。"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(offsets) - 1
+    out = np.full((n, SIG_SIZE), 0xFFFFFFFF, dtype=np.uint32)
+    for r0 in range(0, n, chunk):
+        r1 = min(n, r0 + chunk)
+        a, b = offsets[r0], offsets[r1]
+        local = offsets[r0:r1 + 1] - a
+        lengths = np.diff(local)
+        nonempty = lengths > 0
+        if not nonempty.any():
+            continue
+        grams = cyclic_grams(deg[a:b], local)
+        vals = HASHES[:, grams]                                   # (SIG_SIZE, grams)
+        mins = np.minimum.reduceat(vals, local[:-1][nonempty], axis=1)
+        out[r0:r1][nonempty] = mins.T
+    return out
+
+
+def band_keys(sig):
+    """署名 (N, SIG_SIZE) -> バンドごとのキー (BANDS, N) uint64。"""
+    s = sig.reshape(len(sig), BANDS, ROWS).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        keys = (s * _MIX[:ROWS]).sum(axis=2, dtype=np.uint64)
+    return keys.T.copy()
+
+
+def _row_grams(deg, offsets, r0, r1):
+    """進行 r0..r1 の (gram, 進行番号) の組（重複なし、gram -> 進行番号の順）。"""
+    a, b = offsets[r0], offsets[r1]
+    local = offsets[r0:r1 + 1] - a
+    m = r1 - r0
+    grams = cyclic_grams(deg[a:b], local)
+    rows = np.repeat(np.arange(m, dtype=np.int64), np.diff(local))
+    pairs = np.sort(grams * m + rows)
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+    return pairs // m, (pairs % m + r0).astype(np.uint32)
+
+
+class Segment:
+    """書き出し済みの1セグメント（mmap で開く、読み取り専用）。"""
+
+    FILES = ("ids", "sig", "band_keys", "band_ids", "gram_offsets", "gram_ids", "deg", "deg_offsets")
+
+    def __init__(self, path):
+        self.path = path
+        for name in self.FILES:
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def write(path, ids, deg, deg_offsets, sig=None, chunk=1_000_000):
+        """
+        セグメントを書き出す。sig は署名の配列のリスト（マージ元のセグメントのもの）で、
+        与えられれば計算し直さずにつなぐ。大きい配列はファイルに直接書き、チャンクごとに処理する
+        （1000万件のマージでも全体をメモリに持たない）。
+        """
+        os.makedirs(path, exist_ok=True)
+        ids = np.asarray(ids, dtype=np.uint64)
+        deg = np.asarray(deg, dtype=np.uint8)
+        deg_offsets = np.asarray(deg_offsets, dtype=np.int64)
+        n = len(ids)
+        for name, arr in (("ids", ids), ("deg", deg), ("deg_offsets", deg_offsets)):
+            np.save(os.path.join(path, name + ".npy"), arr)
+
+        out = open_memmap(os.path.join(path, "sig.npy"), mode="w+", dtype=np.uint32, shape=(n, SIG_SIZE))
+        if sig is None:
+            for r0 in range(0, n, chunk):
+                r1 = min(n, r0 + chunk)
+                a = deg_offsets[r0]
+                out[r0:r1] = signatures(deg[a:deg_offsets[r1]], deg_offsets[r0:r1 + 1] - a)
+        else:
+            r0 = 0
+            for part in sig:
+                for c0 in range(0, len(part), chunk):
+                    block = part[c0:c0 + chunk]
+                    out[r0 + c0:r0 + c0 + len(block)] = block
+                r0 += len(part)
+
+        keys = np.empty((BANDS, n), dtype=np.uint64)
+        for r0 in range(0, n, chunk):
+            keys[:, r0:r0 + chunk] = band_keys(out[r0:r0 + chunk])
+        del out
+        sorted_keys = open_memmap(os.path.join(path, "band_keys.npy"), mode="w+", dtype=np.uint64, shape=(BANDS, n))
+        band_ids = open_memmap(os.path.join(path, "band_ids.npy"), mode="w+", dtype=np.uint32, shape=(BANDS, n))
+        for band in range(BANDS):
+            order = np.argsort(keys[band], kind="stable")
+            sorted_keys[band] = keys[band][order]
+            band_ids[band] = order
+        del keys, sorted_keys, band_ids
+
+        # 3-gram -> 進行の転置リスト（CSR 形式）。1つの進行で同じ gram は1回だけ。
+        # 1回目で gram ごとの件数を数え、2回目でチャンクごとに各 gram の書き込み位置へ置く
+        counts = np.zeros(VOCAB, dtype=np.int64)
+        for r0 in range(0, n, chunk):
+            g, _ = _row_grams(deg, deg_offsets, r0, min(n, r0 + chunk))
+            counts += np.bincount(g, minlength=VOCAB)
+        gram_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        gram_ids = open_memmap(os.path.join(path, "gram_ids.npy"), mode="w+", dtype=np.uint32,
+                               shape=(int(gram_offsets[-1]),))
+        cursor = gram_offsets[:-1].copy()
+        for r0 in range(0, n, chunk):
+            g, r = _row_grams(deg, deg_offsets, r0, min(n, r0 + chunk))
+            cg = np.bincount(g, minlength=VOCAB)
+            first = np.cumsum(cg) - cg
+            gram_ids[cursor[g] + np.arange(len(g)) - first[g]] = r
+            cursor += cg
+        del gram_ids
+        np.save(os.path.join(path, "gram_offsets.npy"), gram_offsets)
+
+    def candidates(self, qkeys, qgrams, limit):
+        """バンドが一致する進行を集め、少なければ gram の転置リストで補う（ローカル番号）。"""
+        found = []
+        total = 0
+        for band in range(BANDS):
+            keys = self.band_keys[band]
+            lo = np.searchsorted(keys, qkeys[band], "left")
+            hi = np.searchsorted(keys, qkeys[band], "right")
+            if hi > lo:
+                take = min(hi, lo + limit)
+                found.append(np.asarray(self.band_ids[band, lo:take]))
+                total += take - lo
+            if total >= limit:
+                break
+        if total < limit:
+            # 転置リストは短い（珍しい gram の）ものから使う
+            lists = [(self.gram_offsets[g + 1] - self.gram_offsets[g], g) for g in qgrams]
+            for size, g in sorted(lists):
+                if size == 0:
+                    continue
+                a = self.gram_offsets[g]
+                take = min(size, limit - total)
+                found.append(np.asarray(self.gram_ids[a:a + take]))
+                total += take
+                if total >= limit:
+                    break
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found).astype(np.int64))
+
+
+class SimilarityIndex:
+    """
+    path: インデックスのディレクトリ（seg_00000, seg_00001, ... を置く。使っているものは meta.json に並ぶ）
+    analyzer: KeyAnalyzer（コード名の進行を追加・検索するとき）
+    """
+
+    def __init__(self, path, analyzer=None):
+        self.path = path
+        self.analyzer = analyzer
+        os.makedirs(path, exist_ok=True)
+        names = sorted(n for n in os.listdir(path)
+                       if n.startswith("seg_") and os.path.exists(os.path.join(path, n, "deg_offsets.npy")))
+        meta = os.path.join(path, "meta.json")
+        if os.path.exists(meta):
+            with open(meta, encoding="utf-8") as f:
+                listed = json.load(f).get("names")
+            if listed is not None:
+                # マージの途中で止まったときの残り（meta.json にないセグメント）は消す
+                for n in set(names) - set(listed):
+                    shutil.rmtree(os.path.join(path, n), ignore_errors=True)
+                names = listed
+        self.segments = [Segment(os.path.join(path, n)) for n in names]
+        self._next = 1 + max((int(n[4:]) for n in names), default=-1)
+        self._pending_ids = []
+        self._pending_deg = []
+        self._pending_len = []
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments) + len(self._pending_ids)
+
+    # ---------- 追加 ----------
+    def add_degrees(self, ids, deg, offsets):
+        """度数列（フラット + オフセット）をまとめて追加する。ids は呼び出し側の通し番号。"""
+        offsets = np.asarray(offsets, dtype=np.int64)
+        self._pending_ids.append(np.asarray(ids, dtype=np.uint64))
+        self._pending_deg.append(np.asarray(deg, dtype=np.uint8))
+        self._pending_len.append(np.diff(offsets))
+
+    def add(self, progressions, ids):
+        """コード名の進行を追加する（キー推定と度数付けは analyzer で一括）。"""
+        deg, offsets = self.to_degrees(progressions)
+        self.add_degrees(ids, deg, offsets)
+
+    def to_degrees(self, progressions):
+        a = self.analyzer
+        if a is None:
+            raise ValueError("chord-name progressions need a KeyAnalyzer: create SimilarityIndex(path, analyzer=...) "
+                             "or pass Roman numerals ('I', 'V', 'vi', ...)")
+        chord_ids, offsets = a.encode(progressions)
+        key_idx = a.detect_keys(chord_ids, offsets)
+        deg = a.degrees(chord_ids, offsets, key_idx).astype(np.int64)
+        deg[deg < 0] = N_SYMBOLS - 1
+        return deg, offsets
+
+    def flush(self):
+        """溜まっている追加分を新しいセグメントとして書き出す。"""
+        if not self._pending_ids:
+            return None
+        ids = np.concatenate(self._pending_ids)
+        deg = np.concatenate(self._pending_deg)
+        lengths = np.concatenate(self._pending_len)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        path = self._new_segment_path()
+        Segment.write(path, ids, deg, offsets)
+        self.segments.append(Segment(path))
+        self._pending_ids, self._pending_deg, self._pending_len = [], [], []
+        self._write_meta()
+        self._maybe_merge()
+        return path
+
+    def compact(self):
+        """全セグメントを1つにまとめる（追加が終わったあとの検索を一番速くする）。"""
+        self.flush()
+        if len(self.segments) > 1:
+            self._merge(0, len(self.segments))
+
+    def _new_segment_path(self):
+        path = os.path.join(self.path, f"seg_{self._next:05d}")
+        self._next += 1
+        return path
+
+    def _write_meta(self):
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segments": len(self.segments), "entries": len(self), "sig_size": SIG_SIZE,
+                       "bands": BANDS, "gram": GRAM,
+                       "names": [os.path.basename(s.path) for s in self.segments]}, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    @staticmethod
+    def _tier(n):
+        t = 0
+        while n >= MERGE_FACTOR:
+            n //= MERGE_FACTOR
+            t += 1
+        return t
+
+    def _maybe_merge(self):
+        """末尾のセグメントの段以下のものが MERGE_FACTOR 個以上続いていたらまとめる（繰り返す）。"""
+        while len(self.segments) >= MERGE_FACTOR:
+            t = self._tier(len(self.segments[-1]))
+            i = len(self.segments)
+            while i > 0 and self._tier(len(self.segments[i - 1])) <= t:
+                i -= 1
+            if len(self.segments) - i < MERGE_FACTOR:
+                break
+            self._merge(i, len(self.segments))
+
+    def _merge(self, i, j):
+        """segments[i:j] を1つのセグメントに書き直す（署名は計算し直さない）。"""
+        old = self.segments[i:j]
+        ids = np.concatenate([s.ids for s in old])
+        deg = np.concatenate([s.deg for s in old])
+        lengths = np.concatenate([np.diff(s.deg_offsets) for s in old])
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        path = self._new_segment_path()
+        Segment.write(path, ids, deg, offsets, sig=[s.sig for s in old])
+        del ids, deg, lengths, offsets
+        self.segments[i:j] = [Segment(path)]
+        self._write_meta()
+        paths = [s.path for s in old]
+        del old                 # mmap を閉じてから消す
+        for p in paths:
+            shutil.rmtree(p, ignore_errors=True)
+
+    # ---------- 検索 ----------
+    def query_degrees(self, deg, k=10, candidates=5000):
+        """
+        度数列（0..6）に似た進行を返す: [(id, 類似度, ローマ数字の列), ...]
+        類似度は MinHash による3-gram集合の Jaccard 推定値。
+        """
+        deg = np.asarray(deg, dtype=np.int64)
+        offsets = np.array([0, len(deg)])
+        qsig = signatures(deg, offsets)
+        qkeys = band_keys(qsig)[:, 0]
+        qgrams = np.unique(cyclic_grams(deg, offsets))
+        results = []
+        total = max(1, sum(len(s) for s in self.segments))
+        for seg in self.segments:
+            # 候補数は件数に比例して配る（セグメントが増えても1回の検索で見る件数は変わらない）
+            cand = seg.candidates(qkeys, qgrams, max(k, candidates * len(seg) // total))
+            if not cand.size:
+                continue
+            sim = (np.asarray(seg.sig[cand]) == qsig[0]).mean(axis=1)
+            top = cand[np.argsort(-sim, kind="stable")[:k]]
+            top_sim = np.sort(sim)[::-1][:k]
+            for local, s in zip(top, top_sim):
+                a, b = seg.deg_offsets[local], seg.deg_offsets[local + 1]
+                romans = [DEGREE_ROMANS[d] if d < 7 else "?" for d in seg.deg[a:b]]
+                results.append((int(seg.ids[local]), float(s), romans))
+        results.sort(key=lambda r: -r[1])
+        return results[:k]
+
+    def query(self, progression, k=10, candidates=5000):
+        """
+        progression: コード名の列（キーは自動推定）か、ローマ数字の列（'I', 'V', 'vi', 'VI', ...）。
+        ローマ数字は ROMAN_TO_INDEX の度数で引くので大文字小文字は問わない。
+        コード名の列は analyzer がないと度数にできないので ValueError。
+        """
+        deg = [roman_degree(r) for r in progression]
+        if None in deg:
+            deg, _ = self.to_degrees([list(progression)])
+        return self.query_degrees(deg, k, candidates)
+
+
+def benchmark(n=1_000_000, bars=8, queries=200, batch=None):
+    """
+    n 件（COMMON_PATTERNS を全キーでランダムに組み合わせ、一部のコードを置き換えたもの）で
+    インデックスを作り、top-10 検索の時間を測る。
+    batch を与えると batch 件ずつ add_degrees() + flush() で少しずつ作る（セグメントのマージも込み）。
+    """
+    import tempfile
+    from theory import COMMON_PATTERNS, ROMAN_TO_INDEX
+
+    patterns = [p for plist in COMMON_PATTERNS.values() for p in plist]
+    rng = np.random.default_rng(0)
+    base = np.array([[ROMAN_TO_INDEX[p[i % len(p)].replace("°", "")] for i in range(bars)] for p in patterns])
+    batch = batch or n
+
+    path = tempfile.mkdtemp(prefix="simidx_")
+    try:
+        index = SimilarityIndex(path)
+        t0 = time.perf_counter()
+        most = 0
+        for r0 in range(0, n, batch):
+            m = min(batch, n - r0)
+            deg = base[rng.integers(0, len(base), m)]
+            # 2割のコードをランダムな度数に置き換えて多様にする
+            mask = rng.random(deg.shape) < 0.2
+            deg[mask] = rng.integers(0, 7, mask.sum())
+            index.add_degrees(np.arange(r0, r0 + m), deg.ravel(), np.arange(m + 1, dtype=np.int64) * bars)
+            index.flush()
+            most = max(most, len(index.segments))
+        build = time.perf_counter() - t0
+        index = SimilarityIndex(path)      # mmap で開き直す
+        qs = [[0, 4, 5, 3]] + [list(rng.integers(0, 7, bars)) for _ in range(queries - 1)]
+        index.query_degrees(qs[0])
+        times = []
+        for q in qs:
+            t = time.perf_counter()
+            index.query_degrees(q, k=10)
+            times.append(time.perf_counter() - t)
+        times.sort()
+        print(f"entries: {n:,}  build: {build:.1f}s  (batches of {batch:,}, "
+              f"segments: {[len(s) for s in index.segments]}, at most {most})")
+        print(f"query top-10: median {times[len(times) // 2] * 1000:.2f} ms, p95 {times[int(len(times) * 0.95)] * 1000:.2f} ms")
+        print("I-V-vi-IV ->", index.query_degrees([0, 4, 5, 3], k=3))
+    finally:
+        del index
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # python similarity.py [件数] [1回の追加件数]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+              batch=int(sys.argv[2]) if len(sys.argv) > 2 else None)
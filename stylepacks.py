@@ -0,0 +1,402 @@
+# stylepacks.py
+# スタイルパック（styles/ 以下の JSON / TOML）からデータテーブルを読み込む。
+# main.py / main_2.py / main_3.py が別々に持っていた DIATONIC_MAJOR / COMMON_PATTERNS /
+# CHORD_SHAPES / NOTE_TO_MIDI を1か所にまとめ、ファイルを足すだけでスタイルを増やせるようにする。
+#
+# パックの形（どの項目も省略可。ファイル名順に読み、後のファイルが前を上書き/追加する）:
+#   {
+#     "name": "core",
+#     "keys":   {"C": ["C","Dm","Em","F","G","Am","Bdim"], ...},     7つのダイアトニックコード
+#     "styles": {"Pop": [["I","V","vi","IV"], ...], ...},           同じスタイル名はパターンを追加
+#     "shapes": {"C": "x32010", ...},
+#     "note_to_midi": {"C": 60, ...}
+#   }
+#
+# 読み込んだ内容は検査してから整数の表（コードID・度数ID・オフセット配列）にコンパイルし、
+# バイナリのキャッシュに保存する。次回からはファイルの mtime/サイズが同じならキャッシュだけ読む。
+# StyleStore.reload_if_changed() を定期的に呼べば、再起動せずに編集が反映される。
+# 読み直した表は新しい dict として作るので、使う側は参照を付け替える（読んでいる dict は書き換えない）。
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+
+try:
+    import tomllib
+except ImportError:     # Python 3.10 以前は TOML のパックを読まない
+    tomllib = None
+
+STYLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles")
+CACHE_NAME = ".stylecache.bin"
+
+ROMAN_TO_INDEX = {'I':0,'ii':1,'II':1,'iii':2,'III':2,'IV':3,'V':4,'vi':5,'VI':5,'vii°':6,'VII':6}
+
+SHAPE_RE = re.compile(r"^[x0-9]{6}$")
+# ルート（note_to_midi にある音名）+ 種類（m, 7, maj7, dim など）
+CHORD_RE = re.compile(r"^([A-G][#b]?)([A-Za-z0-9#b°+]*)$")
+
+
+class StylePackError(ValueError):
+    """パックの内容が不正（ファイル名と場所をメッセージに含める）。"""
+
+
+# ---------- 読み込みと検査 ----------
+def pack_files(directory):
+    """読み込むファイルの一覧（ファイル名順）。TOML は tomllib があるときだけ。"""
+    if not os.path.isdir(directory):
+        return []
+    exts = (".json", ".toml") if tomllib else (".json",)
+    return sorted(os.path.join(directory, n) for n in os.listdir(directory)
+                  if n.endswith(exts) and not n.startswith("."))
+
+
+def fingerprint(files):
+    """ファイル名・mtime・サイズから作るハッシュ（内容は読まない）。"""
+    h = hashlib.sha1()
+    for path in files:
+        st = os.stat(path)
+        h.update(f"{os.path.basename(path)}\0{st.st_mtime_ns}\0{st.st_size}\n".encode("utf-8"))
+    return h.digest()
+
+
+def read_pack(path):
+    if path.endswith(".toml"):
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def validate_pack(pack, where):
+    """パック1つを検査する。不正なら StylePackError。"""
+    if not isinstance(pack, dict):
+        raise StylePackError(f"{where}: top level must be an object")
+    for key, chords in pack.get("keys", {}).items():
+        if not isinstance(chords, list) or len(chords) != 7 or not all(isinstance(c, str) and c for c in chords):
+            raise StylePackError(f"{where}: keys.{key} must be a list of 7 chord names")
+    for style, patterns in pack.get("styles", {}).items():
+        if not isinstance(patterns, list) or not patterns:
+            raise StylePackError(f"{where}: styles.{style} must be a non-empty list of patterns")
+        for i, pattern in enumerate(patterns):
+            if not isinstance(pattern, list) or not pattern:
+                raise StylePackError(f"{where}: styles.{style}[{i}] must be a non-empty list")
+            for numeral in pattern:
+                if not isinstance(numeral, str):
+                    raise StylePackError(f"{where}: styles.{style}[{i}]: unknown numeral {numeral!r}")
+                base = numeral[:-1] if numeral.endswith('7') else numeral
+                if base not in ROMAN_TO_INDEX and base.replace("°", "") not in ROMAN_TO_INDEX:
+                    raise StylePackError(f"{where}: styles.{style}[{i}]: unknown numeral {numeral!r}")
+    for chord, shape in pack.get("shapes", {}).items():
+        if not isinstance(shape, str) or not SHAPE_RE.match(shape):
+            raise StylePackError(f"{where}: shapes.{chord} must be 6 characters of x/0-9, got {shape!r}")
+    for note, midi in pack.get("note_to_midi", {}).items():
+        if not isinstance(midi, int) or not 0 <= midi <= 127:
+            raise StylePackError(f"{where}: note_to_midi.{note} must be an integer 0-127")
+
+
+def validate_chords(pack, where, note_names):
+    """
+    keys と shapes のコード名を検査する。ルートは note_names（全パックの note_to_midi の音名）のどれか。
+    validate_pack のあとで、全パックの note_to_midi がそろってから呼ぶ。
+    """
+    named = [(f"keys.{key}", c) for key, chords in pack.get("keys", {}).items() for c in chords]
+    named += [(f"shapes.{c}", c) for c in pack.get("shapes", {})]
+    for field, chord in named:
+        m = CHORD_RE.match(chord)
+        if not m or m.group(1) not in note_names:
+            raise StylePackError(f"{where}: {field}: bad chord name {chord!r} "
+                                 f"(root must be one of note_to_midi: {', '.join(sorted(note_names))})")
+
+
+# ---------- コンパイル済みの表 ----------
+class StyleTables:
+    """
+    整数の表:
+      chords:           コード名の表（ID = 添字）
+      keys, styles:     キー名・スタイル名の表
+      numerals:         ローマ数字の表
+      diatonic:         array('H') キーごとに7つのコードID（K*7）
+      style_offsets:    array('I') スタイル s のパターンは pattern_offsets[style_offsets[s]:style_offsets[s+1]]
+      pattern_offsets:  array('I') パターン p の度数は pattern_numerals[pattern_offsets[p]:pattern_offsets[p+1]]
+      pattern_numerals: array('H') 度数ID
+      shapes:           {コードID: 形}
+      note_to_midi:     {音名: MIDIノート}
+    """
+
+    def __init__(self):
+        self.chords = []
+        self.keys = []
+        self.styles = []
+        self.numerals = []
+        self.diatonic = array("H")
+        self.style_offsets = array("I", [0])
+        self.pattern_offsets = array("I", [0])
+        self.pattern_numerals = array("H")
+        self.shapes = {}
+        self.note_to_midi = {}
+        self.sources = []
+        self.errors = []
+
+    @classmethod
+    def compile(cls, packs):
+        """packs: [(ファイル名, 検査済みの dict), ...]"""
+        t = cls()
+        chord_ids = {}
+        numeral_ids = {}
+
+        def cid(name):
+            if name not in chord_ids:
+                chord_ids[name] = len(t.chords)
+                t.chords.append(name)
+            return chord_ids[name]
+
+        def nid(numeral):
+            if numeral not in numeral_ids:
+                numeral_ids[numeral] = len(t.numerals)
+                t.numerals.append(numeral)
+            return numeral_ids[numeral]
+
+        keys = {}
+        styles = {}         # スタイル名 -> {パターン(tuple): None}（順序を保って重複を除く）
+        shapes = {}
+        for source, pack in packs:
+            t.sources.append(os.path.basename(source))
+            keys.update(pack.get("keys", {}))
+            for style, patterns in pack.get("styles", {}).items():
+                known = styles.setdefault(style, {})
+                for p in patterns:
+                    known.setdefault(tuple(p), None)
+            shapes.update(pack.get("shapes", {}))
+            t.note_to_midi.update(pack.get("note_to_midi", {}))
+
+        for key, chords in keys.items():
+            t.keys.append(key)
+            t.diatonic.extend(cid(c) for c in chords)
+        for style, patterns in styles.items():
+            t.styles.append(style)
+            for p in patterns:
+                t.pattern_numerals.extend(nid(n) for n in p)
+                t.pattern_offsets.append(len(t.pattern_numerals))
+            t.style_offsets.append(len(t.pattern_offsets) - 1)
+        t.shapes = {cid(c): s for c, s in shapes.items()}
+        return t
+
+    # ---------- dict への展開 ----------
+    def diatonic_major(self):
+        ch = self.chords
+        d = self.diatonic
+        return {k: [ch[c] for c in d[i * 7:i * 7 + 7]] for i, k in enumerate(self.keys)}
+
+    def common_patterns(self):
+        nums = self.numerals
+        po = self.pattern_offsets
+        pn = self.pattern_numerals
+        so = self.style_offsets
+        return {s: [[nums[n] for n in pn[po[p]:po[p + 1]]] for p in range(so[i], so[i + 1])]
+                for i, s in enumerate(self.styles)}
+
+    def chord_shapes(self):
+        return {self.chords[c]: s for c, s in self.shapes.items()}
+
+    def as_dicts(self):
+        """(DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI)"""
+        return self.diatonic_major(), self.common_patterns(), self.chord_shapes(), dict(self.note_to_midi)
+
+    def pattern_count(self):
+        return len(self.pattern_offsets) - 1
+
+    # ---------- バイナリキャッシュ ----------
+    _MAGIC = b"GSTY"
+    _HEADER = struct.Struct("<4sH20s")
+
+    def save(self, path, fp):
+        names = json.dumps({
+            "chords": self.chords, "keys": self.keys, "styles": self.styles, "numerals": self.numerals,
+            "shapes": {str(c): s for c, s in self.shapes.items()}, "note_to_midi": self.note_to_midi,
+            "sources": self.sources,
+        }, ensure_ascii=False).encode("utf-8")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self._HEADER.pack(self._MAGIC, 1, fp))
+            f.write(struct.pack("<I", len(names)))
+            f.write(names)
+            for a in (self.diatonic, self.style_offsets, self.pattern_offsets, self.pattern_numerals):
+                f.write(struct.pack("<I", len(a)))
+                a.tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, fp):
+        """キャッシュを読む。fingerprint が違う・壊れている・ないときは None。"""
+        try:
+            with open(path, "rb") as f:
+                magic, version, saved_fp = cls._HEADER.unpack(f.read(cls._HEADER.size))
+                if magic != cls._MAGIC or version != 1 or saved_fp != fp:
+                    return None
+                (nlen,) = struct.unpack("<I", f.read(4))
+                names = json.loads(f.read(nlen).decode("utf-8"))
+                t = cls()
+                for attr, code in (("diatonic", "H"), ("style_offsets", "I"),
+                                   ("pattern_offsets", "I"), ("pattern_numerals", "H")):
+                    (n,) = struct.unpack("<I", f.read(4))
+                    a = array(code)
+                    a.fromfile(f, n)
+                    setattr(t, attr, a)
+        except (OSError, ValueError, EOFError, struct.error):
+            return None
+        t.chords = names["chords"]
+        t.keys = names["keys"]
+        t.styles = names["styles"]
+        t.numerals = names["numerals"]
+        t.shapes = {int(c): s for c, s in names["shapes"].items()}
+        t.note_to_midi = names["note_to_midi"]
+        t.sources = names["sources"]
+        return t
+
+
+# ---------- ストア ----------
+class StyleStore:
+    """
+    directory のパックを読み、キャッシュ付きで StyleTables を返す。
+    不正なパックは読み飛ばして errors に残す（編集途中のファイルで動いているアプリを落とさない）。
+    """
+
+    def __init__(self, directory=STYLES_DIR, cache_path=None):
+        self.directory = directory
+        self.cache_path = cache_path or os.path.join(directory, CACHE_NAME)
+        self.tables = None
+        self.fp = None
+        self.errors = []
+        self.from_cache = False
+
+    def load(self):
+        files = pack_files(self.directory)
+        fp = fingerprint(files)
+        tables = StyleTables.load(self.cache_path, fp)
+        self.from_cache = tables is not None
+        if tables is None:
+            packs = []
+            self.errors = []
+            for path in files:
+                try:
+                    pack = read_pack(path)
+                    validate_pack(pack, os.path.basename(path))
+                except (OSError, ValueError) as e:
+                    # json.JSONDecodeError / tomllib.TOMLDecodeError も ValueError
+                    self.errors.append(str(e) if isinstance(e, StylePackError) else f"{os.path.basename(path)}: {e}")
+                    continue
+                packs.append((path, pack))
+            # コード名のルートは、どのパックの note_to_midi にあってもよい
+            note_names = {n for _, pack in packs for n in pack.get("note_to_midi", {})}
+            valid = []
+            for path, pack in packs:
+                try:
+                    validate_chords(pack, os.path.basename(path), note_names)
+                except StylePackError as e:
+                    self.errors.append(str(e))
+                    continue
+                valid.append((path, pack))
+            tables = StyleTables.compile(valid)
+            tables.errors = list(self.errors)
+            # 不正なパックがあるときはキャッシュしない（直したら読み直す）
+            if not self.errors:
+                try:
+                    tables.save(self.cache_path, fp)
+                except OSError as e:
+                    print("style cache write error:", e)
+        self.tables = tables
+        self.fp = fp
+        return tables
+
+    def missing(self):
+        """キーかスタイルが1つもなければ、その説明（あれば None）。"""
+        t = self.tables
+        if t is None or not t.keys or not t.styles:
+            return (f"no keys or styles loaded from {self.directory} "
+                    f"(add a style pack such as core.json; errors: {'; '.join(self.errors) or 'none'})")
+        return None
+
+    def require(self):
+        """キーとスタイルがそろっていなければ StylePackError（起動時に呼ぶ）。"""
+        message = self.missing()
+        if message:
+            raise StylePackError(message)
+
+    def changed(self):
+        """前回読んでからファイルが足された/消えた/編集されたか（stat だけ）。"""
+        return fingerprint(pack_files(self.directory)) != self.fp
+
+    def reload_if_changed(self):
+        """
+        変わっていれば読み直して True。
+        不正なパックがあれば前の表のまま False（編集途中で保存しても、直すまでは今のスタイルで動く）。
+        """
+        if self.tables is not None and not self.changed():
+            return False
+        previous = self.tables
+        self.load()
+        if (self.errors or self.missing()) and previous is not None:
+            self.tables = previous
+            return False
+        return True
+
+
+def load_tables(directory=STYLES_DIR):
+    """(DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI) を返す。"""
+    store = StyleStore(directory)
+    tables = store.load()
+    for e in store.errors:
+        print("style pack error:", e)
+    store.require()
+    return tables.as_dicts()
+
+
+def benchmark(n_files=500, styles_per_file=5, patterns_per_style=4):
+    """
+    n_files 個のパック（合計 n_files * styles_per_file * patterns_per_style パターン）を作り、
+    初回のコンパイルとキャッシュからの読み込みにかかる時間を比べる。
+    """
+    import random
+    import shutil
+    import tempfile
+
+    rng = random.Random(0)
+    numerals = ['I', 'ii', 'iii', 'IV', 'V', 'vi', 'vii°', 'V7', 'ii7']
+    d = tempfile.mkdtemp(prefix="styles_")
+    try:
+        shutil.copy(os.path.join(STYLES_DIR, "core.json"), d)
+        for i in range(n_files):
+            pack = {"name": f"gen{i}", "styles": {
+                f"Gen{i}-{j}": [[rng.choice(numerals) for _ in range(rng.choice((4, 8)))]
+                                for _ in range(patterns_per_style)]
+                for j in range(styles_per_file)}}
+            with open(os.path.join(d, f"gen{i:04d}.json"), "w", encoding="utf-8") as f:
+                json.dump(pack, f)
+
+        t0 = time.perf_counter()
+        store = StyleStore(d)
+        tables = store.load()
+        t1 = time.perf_counter()
+        store = StyleStore(d)
+        store.load()
+        dicts = store.tables.as_dicts()
+        t2 = time.perf_counter()
+        assert store.from_cache
+        print(f"packs: {n_files + 1}, styles: {len(tables.styles):,}, patterns: {tables.pattern_count():,}")
+        print(f"compile from files: {(t1 - t0) * 1000:8.1f} ms")
+        print(f"load from cache   : {(t2 - t1) * 1000:8.1f} ms (incl. building the dicts)")
+        t0 = time.perf_counter()
+        for _ in range(100):
+            store.changed()
+        print(f"mtime check       : {(time.perf_counter() - t0) * 10:8.2f} ms")
+        assert dicts[1] == tables.common_patterns()
+    finally:
+        shutil.rmtree(d, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
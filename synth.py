@@ -0,0 +1,249 @@
+# synth.py
+# コードの音をあらかじめPCMにレンダリングしておき、クリック時はキャッシュから即再生する。
+# レンダラは2種類:
+#   - FluidSynthRenderer: 同梱の GuitarA.sf2 を使う（pyfluidsynth がある場合）
+#   - BuiltinRenderer:    NumPy の簡易撥弦シンセ（依存なし）
+# 再生は pygame.mixer に渡す。
+import os
+import queue
+import statistics
+import threading
+import time
+
+import numpy as np
+
+from cache import LRUCache
+
+SAMPLE_RATE = 44100
+DEFAULT_SOUNDFONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GuitarSound_test", "GuitarA.sf2")
+
+
+def midi_to_freq(note):
+    return 440.0 * 2.0 ** ((note - 69) / 12.0)
+
+
+def to_pcm16_stereo(mono):
+    """float32 [-1, 1] のモノラルを int16 ステレオ（インターリーブ）の bytes にする。"""
+    peak = float(np.max(np.abs(mono))) if mono.size else 0.0
+    if peak > 1.0:
+        mono = mono / peak
+    pcm = (mono * 32767.0).astype(np.int16)
+    return np.repeat(pcm, 2).tobytes()
+
+
+# ---------- レンダラ ----------
+class BuiltinRenderer:
+    """
+    倍音を減衰させて足し合わせる簡易ギター音。弦ごとに strum 秒ずつずらす。
+    高い倍音ほど早く減衰させると、それらしい撥弦の響きになる。
+    """
+    name = "builtin"
+
+    def __init__(self, sample_rate=SAMPLE_RATE, harmonics=8, decay=2.5, strum=0.015, gain=0.25):
+        self.sample_rate = sample_rate
+        self.harmonics = harmonics
+        self.decay = decay
+        self.strum = strum
+        self.gain = gain
+
+    def render_mono(self, notes, duration=1.5, velocity=100):
+        sr = self.sample_rate
+        n = int(sr * duration)
+        t = np.arange(n, dtype=np.float32) / sr
+        out = np.zeros(n, dtype=np.float32)
+        k = np.arange(1, self.harmonics + 1, dtype=np.float32)[:, None]
+        amp = (1.0 / k) * (velocity / 127.0)
+        for i, note in enumerate(notes):
+            start = int(i * self.strum * sr)
+            if start >= n:
+                break
+            tt = t[: n - start]
+            f = midi_to_freq(note)
+            # (harmonics, samples) を一度に計算
+            partials = amp * np.exp(-tt * self.decay * k) * np.sin(2.0 * np.pi * f * k * tt)
+            out[start:] += partials.sum(axis=0)
+        return out * self.gain
+
+    def render(self, notes, duration=1.5, velocity=100):
+        return to_pcm16_stereo(self.render_mono(notes, duration, velocity))
+
+
+class FluidSynthRenderer:
+    """
+    FluidSynth をオーディオドライバなしで動かし、get_samples で直接PCMを取り出す。
+    """
+    name = "fluidsynth"
+
+    def __init__(self, soundfont=DEFAULT_SOUNDFONT, sample_rate=SAMPLE_RATE, program=25, release=0.4):
+        import fluidsynth
+        self.sample_rate = sample_rate
+        self.release = release
+        self.synth = fluidsynth.Synth(samplerate=float(sample_rate))
+        sfid = self.synth.sfload(soundfont)
+        if sfid < 0:
+            raise RuntimeError(f"cannot load soundfont: {soundfont}")
+        self.synth.program_select(0, sfid, 0, program)
+        self.lock = threading.Lock()
+
+    def render(self, notes, duration=1.5, velocity=100):
+        sr = self.sample_rate
+        with self.lock:
+            for n in notes:
+                self.synth.noteon(0, n, velocity)
+            body = self.synth.get_samples(int(sr * duration))
+            for n in notes:
+                self.synth.noteoff(0, n)
+            tail = self.synth.get_samples(int(sr * self.release))
+        return np.concatenate([body, tail]).astype(np.int16).tobytes()
+
+
+def make_renderer(soundfont=DEFAULT_SOUNDFONT):
+    """SoundFont が使えれば FluidSynth、なければ内蔵シンセ。"""
+    if soundfont and os.path.exists(soundfont):
+        try:
+            return FluidSynthRenderer(soundfont)
+        except Exception as e:
+            print("FluidSynth renderer unavailable, using builtin synth:", e)
+    return BuiltinRenderer()
+
+
+# ---------- サンプルバンク ----------
+class SampleBank:
+    """
+    コードごとのPCMをバイト数上限付きの LRU に保持する。
+    prerender() で生成直後にバックグラウンドのワーカーでレンダリングしておき、
+    play() はキャッシュにあればそのままミキサーへ渡す。なければその場では合成せず
+    （クリックした Tk スレッドを止めないよう）ワーカーに回して None を返す。
+    store: cache.ResultCache。渡せば PCM を store.renders（ディスク2段目つき）に置き、
+           表が変わって renders が作り直されたら古い PCM は使わない。None なら自前の LRU
+    """
+
+    def __init__(self, voicing, renderer=None, max_bytes=32 * 1024 * 1024, duration=1.5, store=None):
+        self.voicing = voicing
+        self.renderer = renderer or BuiltinRenderer()
+        self.duration = duration
+        self.store = store
+        self._cache = LRUCache(max_bytes=max_bytes, sizeof=len)
+        self._jobs = queue.Queue()
+        self._pending = set()       # ワーカーに積んだがまだ描き終えていないコード
+        self._lock = threading.Lock()
+        self._worker = None
+        self.misses = 0
+        self.sounds = {}
+        self.latencies = {"cached": [], "live": []}
+        self.mixer_ready = False
+
+    @property
+    def cache(self):
+        return self.store.renders if self.store is not None else self._cache
+
+    def _key(self, chord):
+        return (self.renderer.name, chord, tuple(self.voicing(chord)), self.duration)
+
+    def render(self, chord):
+        return self.renderer.render(self.voicing(chord), self.duration)
+
+    def prerender(self, chords):
+        """バックグラウンドのワーカーでレンダリングしてキャッシュを温める。新しく積んだ数を返す。"""
+        # get() はディスクにあればメモリに戻す（ディスクにもなければワーカーに積む）
+        todo = [c for c in dict.fromkeys(chords) if self.cache.get(self._key(c)) is None]
+        queued = 0
+        with self._lock:
+            for c in todo:
+                if c not in self._pending:
+                    self._pending.add(c)
+                    self._jobs.put(c)
+                    queued += 1
+            if queued and self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="sample-prerender", daemon=True)
+                self._worker.start()
+        return queued
+
+    def _work(self):
+        while True:
+            c = self._jobs.get()
+            try:
+                self.cache.put(self._key(c), self.render(c))
+            except Exception as e:
+                print("prerender error:", e)
+            finally:
+                with self._lock:
+                    self._pending.discard(c)
+
+    def wait(self, timeout=None):
+        """積んだレンダリングが終わるまで待つ。終わっていれば True。"""
+        end = None if timeout is None else time.perf_counter() + timeout
+        while self._pending:
+            if end is not None and time.perf_counter() >= end:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def init_mixer(self):
+        if not self.mixer_ready:
+            import pygame.mixer
+            pygame.mixer.init(frequency=self.renderer.sample_rate, size=-16, channels=2, buffer=256)
+            pygame.mixer.set_num_channels(32)
+            self.mixer_ready = True
+
+    def play(self, chord):
+        """
+        キャッシュにあれば、クリックから mixer に渡すまでの時間を記録して再生し、Sound を返す。
+        なければワーカーにレンダリングを回して None を返す（呼んだ側は MIDI などで鳴らす）。
+        """
+        t0 = time.perf_counter()
+        self.init_mixer()
+        pcm = self.cache.get(self._key(chord))
+        if pcm is None:
+            self.misses += 1
+            self.prerender([chord])
+            return None
+        return self._play_pcm(pcm, "cached", t0)
+
+    def _play_pcm(self, pcm, path, t0):
+        import pygame.mixer
+        sound = pygame.mixer.Sound(buffer=pcm)
+        sound.play()
+        self.latencies[path].append(time.perf_counter() - t0)
+        return sound
+
+    def latency_report(self):
+        report = {}
+        for path, values in self.latencies.items():
+            if values:
+                ms = sorted(v * 1000.0 for v in values)
+                report[path] = {
+                    "count": len(ms),
+                    "median_ms": statistics.median(ms),
+                    "p95_ms": ms[int(0.95 * (len(ms) - 1))],
+                }
+        return report
+
+
+def benchmark(repeat=20):
+    """
+    キャッシュからの再生と、毎回合成する場合のクリック→ミキサー投入までの時間を比べる。
+    音声デバイスがない環境では SDL_AUDIODRIVER=dummy で動かす。
+    """
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    from theory import chord_to_midi_notes
+
+    chords = ["C", "G", "Am", "F", "Dm", "Em", "E", "A"]
+    renderer = make_renderer()
+    live = SampleBank(chord_to_midi_notes, renderer, max_bytes=0)  # 何も保持しない = 常にその場で合成
+    cached = SampleBank(chord_to_midi_notes, renderer)
+    cached.prerender(chords)
+    cached.wait()
+    live.init_mixer()
+    for _ in range(repeat):
+        for c in chords:
+            t0 = time.perf_counter()
+            live._play_pcm(live.render(c), "live", t0)
+            cached.play(c)
+    print(f"renderer: {renderer.name}")
+    print("live synthesis :", live.latency_report().get("live"))
+    print("pre-rendered   :", cached.latency_report().get("cached"))
+
+
+if __name__ == "__main__":
+    benchmark()
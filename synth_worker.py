@@ -0,0 +1,506 @@
+# synth_worker.py
+# 音の合成を GUI とは別のプロセスで行う。
+# GUI（Tk）と同じプロセスで FluidSynth を鳴らすと、ウィジェットの作り直しやファイルダイアログ、
+# root.update() などで GIL やメインスレッドが止まったときに音が途切れる。
+#
+#   GUI プロセス --(Pipe: 予定時刻つきイベント)--> 合成プロセス --(共有メモリのリングバッファ)--> 出力プロセス
+#
+# 合成プロセスは実時間より lead 秒だけ先までPCMを書き、出力プロセス（sounddevice のコールバック、
+# なければ実時間で読み捨てるだけの null 出力）がそれを読む。どちらも GUI プロセスの GIL には関係しない。
+# リングバッファは書き手1・読み手1（SPSC）で、書き位置は合成側だけ、読み位置は出力側だけが進める。
+# 読み出しは共有メモリ上の NumPy ビューをそのまま返す（コピーなし）。
+#
+# 数え方:
+#   underrun: 出力側が読もうとしたときに足りなかった回数（足りない分は無音で埋める）
+#   overrun:  合成側が書こうとしたときにリングが一杯だった回数（そのブロックは捨てる）
+import heapq
+import multiprocessing as mp
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from scheduler import wait_until
+from synth import SAMPLE_RATE, DEFAULT_SOUNDFONT, BuiltinRenderer
+
+# ヘッダ（int64）の位置
+_WRITE, _READ, _UNDERRUNS, _OVERRUNS, _UNDERRUN_FRAMES, _CAPACITY, _RATE = range(7)
+HEADER_WORDS = 8
+CHANNELS = 2
+
+
+class AudioRing:
+    """
+    共有メモリ上の int16 ステレオのリングバッファ。
+    書き位置・読み位置は単調に増えるフレーム数で持ち、実際の位置は capacity で割った余り。
+    create() した側が unlink() する。他のプロセスは attach(name) で同じメモリを開く。
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        self.capacity = int(self.header[_CAPACITY])
+        self.sample_rate = int(self.header[_RATE])
+        self.frames = np.ndarray((self.capacity, CHANNELS), dtype=np.int16, buffer=shm.buf,
+                                 offset=HEADER_WORDS * 8)
+
+    @classmethod
+    def create(cls, capacity, sample_rate=SAMPLE_RATE):
+        size = HEADER_WORDS * 8 + capacity * CHANNELS * 2
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_CAPACITY] = capacity
+        header[_RATE] = sample_rate
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def available(self):
+        """読めるフレーム数。"""
+        return int(self.header[_WRITE] - self.header[_READ])
+
+    def space(self):
+        """書けるフレーム数。"""
+        return self.capacity - self.available()
+
+    # ---------- 書き手（合成プロセス） ----------
+    def write(self, block):
+        """block（(n, 2) の int16）を書く。空きが足りなければ書かずに overrun を数えて False。"""
+        n = len(block)
+        w = int(self.header[_WRITE])
+        if self.capacity - (w - int(self.header[_READ])) < n:
+            self.header[_OVERRUNS] += 1
+            return False
+        i = w % self.capacity
+        first = min(n, self.capacity - i)
+        self.frames[i:i + first] = block[:first]
+        if first < n:
+            self.frames[:n - first] = block[first:]
+        # データを書き終えてから書き位置を進める
+        self.header[_WRITE] = w + n
+        return True
+
+    # ---------- 読み手（出力プロセス） ----------
+    def read_views(self, frames):
+        """
+        最大 frames フレーム分のビューを (前半, 後半) で返す（コピーなし）。
+        リングの終わりをまたがなければ後半は空。読み終えたら advance() する。
+        """
+        r = int(self.header[_READ])
+        n = min(frames, int(self.header[_WRITE]) - r)
+        i = r % self.capacity
+        first = min(n, self.capacity - i)
+        return self.frames[i:i + first], self.frames[:n - first]
+
+    def advance(self, frames):
+        self.header[_READ] += frames
+
+    def read_into(self, out):
+        """
+        out（(n, 2) の int16、sounddevice の outdata など）を埋める。
+        足りなければ残りを無音にして underrun を数える。読めたフレーム数を返す。
+        """
+        a, b = self.read_views(len(out))
+        got = len(a) + len(b)
+        out[:len(a)] = a
+        out[len(a):got] = b
+        if got < len(out):
+            out[got:] = 0
+            self.header[_UNDERRUNS] += 1
+            self.header[_UNDERRUN_FRAMES] += len(out) - got
+        self.advance(got)
+        return got
+
+    def stats(self):
+        h = self.header
+        return {
+            "capacity_ms": self.capacity / self.sample_rate * 1000.0,
+            "fill_ms": self.available() / self.sample_rate * 1000.0,
+            "written_frames": int(h[_WRITE]),
+            "read_frames": int(h[_READ]),
+            "underruns": int(h[_UNDERRUNS]),
+            "underrun_ms": int(h[_UNDERRUN_FRAMES]) / self.sample_rate * 1000.0,
+            "overruns": int(h[_OVERRUNS]),
+        }
+
+    def close(self):
+        # ビューを消してからでないと close できない
+        self.header = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# ---------- 合成エンジン ----------
+class FluidSynthEngine:
+    """FluidSynth をドライバなしで動かし、get_samples でブロックずつ取り出す。"""
+    name = "fluidsynth"
+
+    def __init__(self, soundfont, sample_rate=SAMPLE_RATE, program=25, polyphony=64, gain=0.2):
+        import fluidsynth
+        self.synth = fluidsynth.Synth(gain=gain, samplerate=float(sample_rate), **{"synth.polyphony": polyphony})
+        sfid = self.synth.sfload(soundfont)
+        if sfid < 0:
+            raise RuntimeError(f"cannot load soundfont: {soundfont}")
+        for ch in range(16):
+            if ch != 9:
+                self.synth.program_select(ch, sfid, 0, program)
+
+    def note_on(self, channel, note, vel):
+        self.synth.noteon(channel, note, vel)
+
+    def note_off(self, channel, note):
+        self.synth.noteoff(channel, note)
+
+    def render(self, frames):
+        return np.asarray(self.synth.get_samples(frames), dtype=np.int16).reshape(-1, CHANNELS)
+
+    def close(self):
+        self.synth.delete()
+
+
+class BuiltinEngine:
+    """FluidSynth がないときの代わり。mixer.Mixer で内蔵シンセの音を重ねる。"""
+    name = "builtin"
+
+    def __init__(self, sample_rate=SAMPLE_RATE, block_size=256, max_voices=64, duration=2.0, gain=0.2):
+        from mixer import Mixer
+        self.mixer = Mixer(block_size=block_size, max_voices=max_voices, sample_rate=sample_rate)
+        self.renderer = BuiltinRenderer(sample_rate)
+        self.duration = duration
+        self.voice_gain = gain * 1.5    # FluidSynth の gain=0.2 とだいたい同じ音量（1音 0.3）
+        self.sources = {}
+        self.voices = {}        # (channel, note) -> Mixer.start() のハンドル（盗まれていれば release は無視される）
+
+    def source(self, note, vel):
+        key = (note, vel)
+        src = self.sources.get(key)
+        if src is None:
+            src = self.sources[key] = self.renderer.render_mono([note], self.duration, vel)
+        return src
+
+    def note_on(self, channel, note, vel):
+        key = (channel, note)
+        if key in self.voices:
+            self.mixer.release(self.voices.pop(key))
+        self.voices[key] = self.mixer.start(self.source(note, vel), gain=self.voice_gain)
+
+    def note_off(self, channel, note):
+        v = self.voices.pop((channel, note), None)
+        if v is not None:
+            self.mixer.release(v)
+
+    def render(self, frames):
+        return self.mixer.render_pcm16()
+
+    def close(self):
+        self.mixer.stop_all()
+
+
+def make_engine(soundfont=DEFAULT_SOUNDFONT, sample_rate=SAMPLE_RATE, block_size=256, program=25,
+                polyphony=64, gain=0.2):
+    """SoundFont と pyfluidsynth があれば FluidSynth、なければ内蔵シンセ。"""
+    if soundfont and os.path.exists(soundfont):
+        try:
+            return FluidSynthEngine(soundfont, sample_rate, program, polyphony, gain)
+        except Exception as e:
+            print("FluidSynth unavailable in synth worker, using builtin synth:", e)
+    return BuiltinEngine(sample_rate, block_size, max_voices=polyphony, gain=gain)
+
+
+# ---------- 合成プロセス ----------
+def synth_loop(conn, ring, engine, block_size=256, lead=0.05):
+    """
+    Pipe からイベントを受け取り、リングに実時間より lead 秒先まで書き続ける。
+    イベント: ("on", channel, note, vel, 時刻) / ("off", channel, note, 0, 時刻) / ("quit",)
+    時刻は送る側の time.perf_counter()（同じマシンならプロセス間で共通）。None は「すぐ」。
+    """
+    sr = ring.sample_rate
+    lead_frames = int(lead * sr)
+    t0 = time.perf_counter()
+    rendered = 0            # t0 からのフレーム数（= このフレームが鳴るべき時刻）
+    pending = []            # (フレーム, 通し番号, kind, channel, note, vel)
+    seq = 0
+    block_time = block_size / sr
+    while True:
+        # 次のブロックを書く時刻まで、イベントを待ちながら寝る
+        timeout = max(0.0, t0 + (rendered - lead_frames) / sr - time.perf_counter())
+        while conn.poll(min(timeout, block_time)):
+            msg = conn.recv()
+            if msg[0] == "quit":
+                return
+            kind, channel, note, vel, at = msg
+            frame = rendered if at is None else int((at - t0) * sr)
+            heapq.heappush(pending, (frame, seq, kind, channel, note, vel))
+            seq += 1
+            timeout = max(0.0, t0 + (rendered - lead_frames) / sr - time.perf_counter())
+        due = int((time.perf_counter() - t0) * sr) + lead_frames
+        while rendered < due:
+            # イベントはブロックの頭でまとめて処理する（256サンプルで約6ms）
+            end = rendered + block_size
+            while pending and pending[0][0] < end:
+                _, _, kind, channel, note, vel = heapq.heappop(pending)
+                if kind == "on":
+                    engine.note_on(channel, note, vel)
+                else:
+                    engine.note_off(channel, note)
+            ring.write(engine.render(block_size))
+            rendered = end
+
+
+def _synth_main(conn, ring_name, soundfont, block_size, lead, program, polyphony, gain):
+    ring = AudioRing.attach(ring_name)
+    engine = make_engine(soundfont, ring.sample_rate, block_size, program, polyphony, gain)
+    conn.send(("ready", engine.name))
+    try:
+        synth_loop(conn, ring, engine, block_size, lead)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        engine.close()
+        ring.close()
+
+
+# ---------- 出力プロセス ----------
+def null_output(ring, block_size, stop, sink=None):
+    """
+    オーディオデバイスの代わりに、実時間でブロックずつ読む。
+    sink(pcm) を渡せば読んだブロックを渡す（WAV に書くなど）。
+    """
+    buf = np.zeros((block_size, CHANNELS), dtype=np.int16)
+    period = block_size / ring.sample_rate
+    deadline = time.perf_counter() + period
+    while not stop.is_set():
+        wait_until(deadline)
+        ring.read_into(buf)
+        if sink is not None:
+            sink(buf)
+        deadline += period
+
+
+def _output_main(ring_name, block_size, device, stop, wav_path=None, latency=None):
+    ring = AudioRing.attach(ring_name)
+    try:
+        if device == "null":
+            if wav_path:
+                from mixer import WavWriter
+                with WavWriter(wav_path, ring.sample_rate) as w:
+                    null_output(ring, block_size, stop, w.write)
+            else:
+                null_output(ring, block_size, stop)
+        else:
+            import sounddevice as sd
+
+            def callback(outdata, frames, time_info, status):
+                ring.read_into(outdata)
+
+            with sd.OutputStream(samplerate=ring.sample_rate, channels=CHANNELS, dtype="int16",
+                                 blocksize=block_size, device=device, latency=latency, callback=callback):
+                stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+def default_device():
+    """sounddevice があれば既定のデバイス（None）、なければ null 出力。"""
+    try:
+        import sounddevice  # noqa: F401
+        return None
+    except ImportError:
+        return "null"
+
+
+class SynthProcess:
+    """
+    GUI 側から使う窓口。note_on / note_off は Pipe に送るだけですぐ戻る。
+    MidiManager と同じ形（note_on(note, vel, channel, scheduled=None)）なので play_events にも渡せる。
+
+    lead: 合成プロセスが先に書いておく長さ（秒）。GUI が止まっても、合成・出力プロセスは動き続ける。
+          音が出るまでの遅れは lead ぶん増えるので、lead_time() で返してスケジューラに早めに送らせる
+    device: sounddevice の出力デバイス（None = 既定）、"null" なら実時間で読み捨てる
+    wav_path: device="null" のとき、出力をここに書く
+    polyphony, gain: 合成エンジンの同時発音数と音量（FluidSynth の synth.polyphony / gain）
+    output_latency: sounddevice の出力バッファ（秒、None = sounddevice の既定）
+    startup_timeout: 合成プロセスの準備完了をこれ以上待たない（秒）。間に合わないか途中で落ちたら
+          プロセスを止め、リングを閉じて（unlink して）RuntimeError
+    """
+
+    def __init__(self, soundfont=DEFAULT_SOUNDFONT, sample_rate=SAMPLE_RATE, block_size=256,
+                 lead=0.05, capacity=0.5, program=25, device="auto", wav_path=None,
+                 polyphony=64, gain=0.2, output_latency=None, startup_timeout=10.0):
+        if device == "auto":
+            device = default_device()
+        self.block_size = block_size
+        self.lead = lead
+        self.metrics = None
+        ctx = mp.get_context("spawn")    # Tk を抱えたプロセスを fork しない
+        self.ring = AudioRing.create(int(capacity * sample_rate), sample_rate)
+        self.conn, child = ctx.Pipe()
+        self.stop = ctx.Event()
+        self.synth = ctx.Process(target=_synth_main, name="synth-worker", daemon=True,
+                                 args=(child, self.ring.name, soundfont, block_size, lead, program,
+                                       polyphony, gain))
+        self.output = ctx.Process(target=_output_main, name="audio-output", daemon=True,
+                                  args=(self.ring.name, block_size, device, self.stop, wav_path,
+                                        output_latency))
+        self.synth.start()
+        try:
+            self.engine = self._wait_ready(startup_timeout)
+        except BaseException:
+            if self.synth.is_alive():
+                self.synth.terminate()
+            self.synth.join(1.0)
+            self.conn.close()
+            self.ring.close()
+            raise
+        self.output.start()
+
+    def _wait_ready(self, timeout):
+        """合成プロセスからの ("ready", エンジン名) を、プロセスの生死を見ながら待つ。"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            if self.conn.poll(0.1):
+                try:
+                    kind, engine = self.conn.recv()
+                except EOFError:
+                    break
+                return engine
+            if not self.synth.is_alive():
+                break
+            if time.perf_counter() >= deadline:
+                raise RuntimeError(f"synth worker did not start within {timeout:.1f}s")
+        raise RuntimeError(f"synth worker exited during startup (exitcode {self.synth.exitcode})")
+
+    # ---------- イベント ----------
+    def note_on(self, note, vel=100, channel=0, scheduled=None):
+        self.conn.send(("on", int(channel), int(note), int(vel), scheduled))
+
+    def note_off(self, note, vel=0, channel=0, scheduled=None):
+        self.conn.send(("off", int(channel), int(note), 0, scheduled))
+
+    def lead_time(self):
+        return self.lead
+
+    def stats(self):
+        s = self.ring.stats()
+        s["engine"] = self.engine
+        return s
+
+    def close(self, timeout=2.0):
+        try:
+            self.conn.send(("quit",))
+        except (BrokenPipeError, OSError):
+            pass
+        self.stop.set()
+        for p in (self.synth, self.output):
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self.conn.close()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- ベンチマーク ----------
+class _InProcessSynth:
+    """比較用: 合成も出力も GUI と同じプロセスのスレッドで動かす（今の GuitarSound.py と同じ構成）。"""
+
+    def __init__(self, block_size=256, lead=0.05, capacity=0.5, sample_rate=SAMPLE_RATE):
+        import threading
+        self.block_size = block_size
+        self.ring = AudioRing.create(int(capacity * sample_rate), sample_rate)
+        self.conn, child = mp.Pipe()
+        self.stop = threading.Event()
+        engine = BuiltinEngine(sample_rate, block_size)
+        self.threads = [
+            threading.Thread(target=synth_loop, args=(child, self.ring, engine, block_size, lead), daemon=True),
+            threading.Thread(target=null_output, args=(self.ring, block_size, self.stop), daemon=True),
+        ]
+        for th in self.threads:
+            th.start()
+
+    note_on = SynthProcess.note_on
+    note_off = SynthProcess.note_off
+
+    def stats(self):
+        return self.ring.stats()
+
+    def close(self):
+        self.conn.send(("quit",))
+        self.stop.set()
+        for th in self.threads:
+            th.join(2.0)
+        self.ring.close()
+
+
+def _block_gui(seconds):
+    """GUI スレッドが止まった状態を作る: 前半は GIL を握ったままの C 呼び出し、後半は Python のループ。"""
+    data = list(np.random.default_rng(0).random(200_000))
+    end = time.perf_counter() + seconds / 2
+    while time.perf_counter() < end:
+        sorted(data)        # 1回の呼び出しの間ずっと GIL を握る
+    end = time.perf_counter() + seconds / 2
+    x = 0
+    while time.perf_counter() < end:
+        for i in range(10_000):
+            x += i * i
+    return x
+
+
+def benchmark(seconds=4.0, stall=2.0, lead=0.05):
+    """
+    和音を鳴らし続けながら、途中で GUI スレッドを stall 秒止める。
+    同じプロセスのスレッドで合成した場合と、別プロセスで合成した場合の underrun / overrun を比べる。
+    """
+    notes = [60, 64, 67, 72]
+    results = {}
+    for label, make in (("in-process threads", lambda: _InProcessSynth(lead=lead)),
+                        ("worker process", lambda: SynthProcess(lead=lead, device="null"))):
+        synth = make()
+        time.sleep(0.3)
+        before = synth.stats()
+        t0 = time.perf_counter()
+        k = 0
+        stalled = False
+        while time.perf_counter() - t0 < seconds:
+            # GUI からのクリックの代わりに、和音を 0.25 秒ごとに送る
+            now = time.perf_counter()
+            for n in notes:
+                synth.note_off(n + 12 * (k % 2 == 0), 0, 0, now)
+                synth.note_on(n + 12 * (k % 2), 100, 0, now)
+            k += 1
+            if not stalled and now - t0 > (seconds - stall) / 2:
+                _block_gui(stall)
+                stalled = True
+            time.sleep(0.25)
+        after = synth.stats()
+        synth.close()
+        results[label] = {key: after[key] - before[key] for key in ("underruns", "underrun_ms", "overruns")}
+        results[label]["engine"] = after.get("engine", "builtin")
+    print(f"GUI thread blocked for {stall:.1f}s in a {seconds:.1f}s run, lead {lead * 1000:.0f} ms")
+    for label, r in results.items():
+        print(f"{label:20s} underruns={r['underruns']:4d} ({r['underrun_ms']:7.1f} ms of silence) "
+              f"overruns={r['overruns']:4d} engine={r['engine']}")
+    return results["worker process"]["underruns"] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark() else 1)
@@ -0,0 +1,163 @@
+# theory.py
+# コードの表（スタイルパック）と進行の生成・ボイシング・キャッシュ。GUI を持たない。
+# main_3.py とベンチマーク（arrangement.py, capo.py など）はここから読む。
+# スタイルパックを読み直すと apply_styles が表の名前を付け替えるので、
+# 実行中に読み直す側（main_3.py）は theory.DIATONIC_MAJOR のようにモジュール経由で参照する。
+import random
+
+from cache import ResultCache
+from capo import CapoEngine, default_tunings
+from compact import Progression
+from seeding import make_rng
+from stylepacks import StyleStore
+
+# ---------- データ定義 ----------
+# styles/ のスタイルパックから読む（stylepacks.py）。実行中にパックが編集されたら
+# main_3.ChordApp.poll_styles が読み直し、apply_styles で新しい dict に付け替える
+STYLE_STORE = StyleStore()
+STYLE_STORE.load()
+for _e in STYLE_STORE.errors:
+    print("style pack error:", _e)
+STYLE_STORE.require()
+DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI = STYLE_STORE.tables.as_dicts()
+
+def apply_styles(tables):
+    """
+    読み直した表に差し替える。dict の中身は書き換えず、新しい dict を作ってから名前を付け替える
+    （再生スレッドが読んでいる途中の dict が空になったり混ざったりしない）。
+    """
+    global DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI, _capo_engine
+    DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI = tables.as_dicts()
+    _capo_engine = None     # CHORD_SHAPES が変わったので suggest_capo で作り直す
+
+ROMAN_TO_INDEX = {'I':0,'ii':1,'II':1,'iii':2,'III':2,'IV':3,'V':4,'vi':5,'VI':5,'vii°':6,'VII':6}
+_DEGREE_BY_NUMERAL = {r.replace('°', '').upper(): i for r, i in ROMAN_TO_INDEX.items()}
+
+def roman_degree(roman):
+    """
+    ローマ数字 -> 度数（0..6）。ROMAN_TO_INDEX を大文字小文字を区別せずに引く
+    （'vi' も 'VI' も 5、'°' と '7' は無視）。ローマ数字でなければ None。
+    """
+    return _DEGREE_BY_NUMERAL.get(roman.replace('°', '').rstrip('7').upper())
+
+# ---------- ロジック ----------
+def roman_to_chord(roman, key):
+    """
+    シンプルにローマ数字をDIATONIC_MAJORの対応するコードに変換する。
+    小文字はマイナーを表示(だしスケールの指定に従う）。
+    '7' サフィックスがあれば簡易的に7thを追加(テンションは考慮せず表記のみ）。
+    """
+    roman_in = roman
+    roman = roman.replace("°", "")
+    add7 = False
+    if roman.endswith('7'):
+        add7 = True
+        roman = roman[:-1]
+
+    idx = ROMAN_TO_INDEX.get(roman, 0)
+    chords = DIATONIC_MAJOR.get(key) or next(iter(DIATONIC_MAJOR.values()))
+    base = chords[idx]
+    if add7:
+        # 簡易: メジャーなら7（maj7ではなくdom7表記は行わない）を付加、マイナーはm7
+        if 'm' in base:
+            return base + '7'  # Em -> Em7
+        else:
+            return base + '7'
+    return base
+
+def generate_progression(key, style, bars=4, rng=None, compact=False):
+    """
+    rng: random.Random（省略時は新しいシードで作る）。シード付きで渡せば結果を再現できる。
+    compact: True なら compact.Progression（コードID配列）で返す。
+    """
+    if rng is None:
+        rng, _ = make_rng()
+    patterns = COMMON_PATTERNS.get(style) or next(iter(COMMON_PATTERNS.values()))
+    pattern = rng.choice(patterns)
+    prog = []
+    i = 0
+    while len(prog) < bars:
+        prog.append(roman_to_chord(pattern[i % len(pattern)], key))
+        i += 1
+    if compact:
+        return Progression.from_names(prog, key=key, style=style)
+    return prog
+
+def get_shape(chord):
+    return CHORD_SHAPES.get(chord, "N/A")
+
+def parse_chord_name(chord_name):
+    """
+    ルートとタイプを分離。例: 'F#m7' -> ('F#','m7')
+    """
+    if len(chord_name) >= 2 and chord_name[1] in ['#', 'b']:
+        root = chord_name[:2]
+        chord_type = chord_name[2:]
+    else:
+        root = chord_name[0]
+        chord_type = chord_name[1:]
+    return root, chord_type
+
+def chord_to_midi_notes(chord_name, octave_offset=0):
+    """
+    より柔軟な変換。
+    - メジャー: 0, +4, +7
+    - マイナー: 0, +3, +7
+    - 7th (dominant/maj/min を簡易): 0,+4,+7,+10 (4音で演奏)
+    octave_offset: ±12 per octave
+    """
+    root, ctype = parse_chord_name(chord_name)
+    root_note = NOTE_TO_MIDI.get(root, 60) + octave_offset
+    notes = []
+    if 'm' in ctype and 'maj' not in ctype and '7' not in ctype:
+        notes = [root_note, root_note+3, root_note+7]
+    elif '7' in ctype:
+        # simplistic: include 7th (dominant/minor/maj not fully distinguished)
+        if 'maj' in ctype or 'M' in ctype:
+            # maj7 -> 0,4,7,11
+            notes = [root_note, root_note+4, root_note+7, root_note+11]
+        elif 'm' in ctype:
+            # m7 -> 0,3,7,10
+            notes = [root_note, root_note+3, root_note+7, root_note+10]
+        else:
+            # dominant 7
+            notes = [root_note, root_note+4, root_note+7, root_note+10]
+    else:
+        notes = [root_note, root_note+4, root_note+7]
+    # ensure in reasonable midi range
+    notes = [max(0, min(127, n)) for n in notes]
+    return notes
+
+# ---------- キャッシュ ----------
+# テーブルが書き換わったら results.validate() で全体が無効化される
+results = ResultCache(lambda: (DIATONIC_MAJOR, COMMON_PATTERNS, CHORD_SHAPES, NOTE_TO_MIDI))
+
+def cached_progression(key, style, bars, seed):
+    """(key, style, bars, seed) が同じなら生成をスキップする。"""
+    def compute():
+        prog = generate_progression(key, style, bars, rng=random.Random(seed), compact=True)
+        prog.seed = seed
+        return prog
+    return results.progressions.get_or_compute((key, style, bars, seed), compute)
+
+def resolve_voicing(chord):
+    """コード名 -> (MIDIノートのタプル, シェイプ)。"""
+    return results.voicings.get_or_compute(
+        chord, lambda: (tuple(chord_to_midi_notes(chord)), get_shape(chord)))
+
+def cached_notes(chord):
+    return list(resolve_voicing(chord)[0])
+
+_capo_engine = None
+
+
+def suggest_capo(progression):
+    """
+    押さえやすいカポ位置とチューニング（capo.CapoEngine の一番よい候補）。
+    CapoEngine は表を作るので一度だけ作り、スタイルを読み直したとき（apply_styles）に捨てる。
+    """
+    global _capo_engine
+    engine = _capo_engine
+    if engine is None:
+        engine = _capo_engine = CapoEngine(default_tunings(CHORD_SHAPES))
+    return engine.suggest(progression, top=1)[0]
@@ -0,0 +1,225 @@
+# virtual_midi.py
+# プロセス内の仮想MIDI出力/入力（ループバック）。pygame.midi の代わりに MidiManager に渡せる。
+#   midi = MidiManager(backend=VirtualMidi())
+# 送られたイベントはすべて高分解能のタイムスタンプ付きで記録され、対になる入力から読める。
+# latency（到着の遅れ）と block（送信呼び出し自体にかかる時間）を設定できる。
+#
+# python virtual_midi.py で、極端なテンポでの再生のジッターとスループットを検査する。
+import sys
+import threading
+import time
+from collections import deque
+
+
+class VirtualPort:
+    """1本の仮想ポート（出力と入力のペアで共有する）。"""
+
+    def __init__(self, name, latency=0.0, block=0.0):
+        self.name = name
+        self.latency = latency      # 秒、または event -> 秒 の関数
+        self.block = block          # 送信1回あたりにかかる時間（遅いポートの再現）
+        self.events = []            # (送信時刻, status, data1, data2)
+        self.inbox = deque()        # (到着時刻, status, data1, data2)
+        self.lock = threading.Lock()
+
+    def send(self, status, data1, data2):
+        if self.block:
+            # 実際のドライバの送信待ちと同じく GIL を手放して待つ
+            time.sleep(self.block)
+        t = time.perf_counter()
+        ev = (t, status, data1, data2)
+        delay = self.latency(ev) if callable(self.latency) else self.latency
+        with self.lock:
+            self.events.append(ev)
+            self.inbox.append((t + delay, status, data1, data2))
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.inbox.clear()
+
+
+class VirtualOutput:
+    """pygame.midi.Output と同じメソッドを持つ出力。"""
+
+    def __init__(self, port):
+        self.port = port
+        self.closed = False
+
+    def write_short(self, status, data1=0, data2=0):
+        if self.closed:
+            raise RuntimeError("port is closed")
+        self.port.send(status, data1, data2)
+
+    def note_on(self, note, velocity=None, channel=0):
+        self.write_short(0x90 | channel, note, 100 if velocity is None else velocity)
+
+    def note_off(self, note, velocity=None, channel=0):
+        self.write_short(0x80 | channel, note, 0 if velocity is None else velocity)
+
+    def set_instrument(self, instrument_id, channel=0):
+        self.write_short(0xC0 | channel, instrument_id)
+
+    def close(self):
+        self.closed = True
+
+
+class VirtualInput:
+    """pygame.midi.Input と同じ poll/read。到着時刻を過ぎたイベントだけ読める。"""
+
+    def __init__(self, port):
+        self.port = port
+
+    def poll(self):
+        with self.port.lock:
+            return bool(self.port.inbox) and self.port.inbox[0][0] <= time.perf_counter()
+
+    def read(self, num_events):
+        out = []
+        now = time.perf_counter()
+        with self.port.lock:
+            while self.port.inbox and len(out) < num_events and self.port.inbox[0][0] <= now:
+                t, status, d1, d2 = self.port.inbox.popleft()
+                out.append([[status, d1, d2, 0], int(t * 1000)])
+        return out
+
+    def read_timed(self, num_events):
+        """read() と同じだが、到着時刻を perf_counter の秒で返す（計測用）。"""
+        out = []
+        now = time.perf_counter()
+        with self.port.lock:
+            while self.port.inbox and len(out) < num_events and self.port.inbox[0][0] <= now:
+                out.append(self.port.inbox.popleft())
+        return out
+
+    def close(self):
+        pass
+
+
+class VirtualMidi:
+    """
+    pygame.midi モジュールの代わり。ポートごとに出力デバイス（偶数番）と入力デバイス（奇数番）を作る。
+    ports: ポート名のリスト、または {名前: {"latency": 秒, "block": 秒}}
+    """
+
+    def __init__(self, ports=("Virtual Out",)):
+        if isinstance(ports, dict):
+            self.ports = [VirtualPort(name, **opts) for name, opts in ports.items()]
+        else:
+            self.ports = [VirtualPort(name) for name in ports]
+        self.initialized = False
+
+    def init(self):
+        self.initialized = True
+
+    def quit(self):
+        self.initialized = False
+
+    def get_init(self):
+        return self.initialized
+
+    def get_count(self):
+        return len(self.ports) * 2
+
+    def get_device_info(self, device_id):
+        port = self.ports[device_id // 2]
+        is_output = device_id % 2 == 0
+        return (b"virtual", port.name.encode("utf-8"), int(not is_output), int(is_output), 0)
+
+    def get_default_output_id(self):
+        return 0
+
+    def get_default_input_id(self):
+        return 1
+
+    def port(self, device_id):
+        return self.ports[device_id // 2]
+
+    def Output(self, device_id, latency=0, buffer_size=256):
+        if device_id % 2:
+            raise ValueError("device is an input")
+        return VirtualOutput(self.ports[device_id // 2])
+
+    def Input(self, device_id, buffer_size=4096):
+        if not device_id % 2:
+            raise ValueError("device is an output")
+        return VirtualInput(self.ports[device_id // 2])
+
+    @staticmethod
+    def time():
+        return int(time.perf_counter() * 1000)
+
+
+# ---------- ベンチマーク ----------
+def run_scenario(name, progression, tempo, play_style, max_median_ms, max_p95_ms, loops=1):
+    """
+    仮想デバイスで play_progression を動かし、予定時刻と送信時刻のずれ（遅れ）を検査する。
+    合否は遅れの中央値と p95 で見る。ジッター（標準偏差）と max は、OS のスケジューリングで
+    まれに十数ms跳ねる1回に引きずられるので表示だけ。
+    (結果 dict, 合否) を返す。
+    """
+    import statistics
+    from playback import MidiManager, play_progression
+    from instrumentation import PlaybackMetrics
+
+    backend = VirtualMidi()
+    mm = MidiManager(backend=backend)
+    mm.open_output(0)
+    mm.metrics = PlaybackMetrics(capacity=1 << 16)
+    flag = threading.Event()
+    flag.set()
+    t0 = time.perf_counter()
+    play_progression(progression * loops, tempo, play_style, False, mm, flag)
+    elapsed = time.perf_counter() - t0
+    notes = mm.metrics.notes.snapshot()
+    late = [(actual - sched) * 1000.0 for (_, _, sched, actual) in notes]
+    port = backend.port(0)
+    res = {
+        "scenario": name,
+        "events": len(notes),
+        "sent": len(port.events),
+        "jitter_ms": statistics.pstdev(late) if len(late) > 1 else 0.0,
+        "median_late_ms": statistics.median(late) if late else 0.0,
+        "p95_late_ms": sorted(late)[int(len(late) * 0.95)] if late else 0.0,
+        "max_late_ms": max(late) if late else 0.0,
+        "events_per_s": len(port.events) / elapsed if elapsed else 0.0,
+    }
+    ok = res["median_late_ms"] <= max_median_ms and res["p95_late_ms"] <= max_p95_ms
+    return res, ok
+
+
+def benchmark():
+    """
+    200 BPM の 16小節アルペジオなどを仮想デバイスで再生し、上限を超えたら終了コード 1。
+    最後に待ちなしで流し、スケジューラ + MidiManager の送信スループットを見る。
+    """
+    from theory import generate_progression
+    import random
+
+    prog16 = generate_progression('C', 'Pop', 16, rng=random.Random(1))
+    scenarios = [
+        ("block 200bpm x16", prog16, 200, "Block", 1.0, 5.0),
+        ("arp 200bpm x16", prog16, 200, "Arp", 1.0, 5.0),
+        ("band 200bpm x16", prog16, 200, "Band", 1.0, 5.0),
+    ]
+    failed = 0
+    for name, prog, tempo, style, median, p95 in scenarios:
+        res, ok = run_scenario(name, prog, tempo, style, median, p95)
+        failed += not ok
+        print(f"{'PASS' if ok else 'FAIL'} {name:32s} events={res['events']:5d} "
+              f"late median={res['median_late_ms']:.3f}ms p95={res['p95_late_ms']:.3f}ms "
+              f"max={res['max_late_ms']:.3f}ms jitter={res['jitter_ms']:.3f}ms "
+              f"rate={res['events_per_s']:,.0f}/s")
+
+    # スループット: 実質テンポ無限大（待ちなし）で Band を200周、送信できたイベント数/秒
+    min_rate = 20000
+    res, _ = run_scenario("band throughput", prog16, 1e9, "Band", float("inf"), float("inf"), loops=200)
+    ok = res["events_per_s"] >= min_rate
+    failed += not ok
+    print(f"{'PASS' if ok else 'FAIL'} {'band x200 as fast as possible':32s} events={res['events']:5d} "
+          f"rate={res['events_per_s']:,.0f}/s (min {min_rate:,}/s)")
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if benchmark() else 0)